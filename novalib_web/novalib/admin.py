@@ -1,30 +1,54 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.urls import reverse, path
 from django.utils.html import format_html
 from django.shortcuts import redirect, render
+from django.utils import timezone
 from django.db import models  # <-- Add this import
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django import forms  # <-- Add this import
-from .models import User, BooksLog, Login, ReturnDesk, Department, Notification, DeveloperNotification, BooksDetail  # Added BooksDetail
+from .models import User, BooksLog, Login, ReturnDesk, Department, Notification, DeveloperNotification, BooksDetail, FineLedgerEntry, HoldRequest, Title, WishlistEntry, CirculationEvent  # Added BooksDetail
+from .fines import post_fine_entry
+from .wishlists import wishlist_entries
+from .profiling import PROFILE_BUFFER_SIZE, PROFILE_HEADER, get_profile, profile_url, recent_profiles
+from .refcache import department_names, title_choices
 
 # Register your models here.
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = (
-        'barcode_number', 'first_name', 'last_name', 'phone_number', 'email', 'department',
+        'barcode_number', 'first_name', 'last_name', 'phone_number', 'email', 'department_name',
         'issued_book_list', 'wish_list', 'due_fine'  # show Due Fine column
     )
-    search_fields = ('barcode_number', 'first_name', 'last_name', 'email', 'phone_number', 'department')
+    search_fields = ('barcode_number', 'first_name', 'last_name', 'email', 'phone_number', 'department__name')
+    list_select_related = ('fine_balance',)
+    # Skip the second COUNT(*) of the whole table for "N total"
+    show_full_result_count = False
     actions = ['view_profile_action', 'view_wishlist_action', 'view_bookhold_action']
 
+    def get_queryset(self, request):
+        # The list columns read these prefetches: two queries per page instead of two per row
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('book_details', queryset=BooksDetail.objects.only('user_id', 'book_title'), to_attr='issued_copies'),
+            Prefetch('wishlist_entries', queryset=WishlistEntry.objects.select_related('title').only('user_id', 'title__book_title'),
+                     to_attr='wishlisted'),
+        )
+
+    def department_name(self, obj):
+        # From the cached id -> name map instead of a join per page
+        return department_names().get(obj.department_id, '-')
+    department_name.short_description = 'Department'
+    department_name.admin_order_field = 'department__name'
+
     def profile_link(self, obj):
         url = reverse('admin:novalib_user_change', args=[obj.pk])
         return format_html('<a href="{}">Profile</a>', url)
     profile_link.short_description = 'Profile'
 
     def wishlist_link(self, obj):
-        # Filter BooksLog by ManyToMany wishlist relation
-        url = reverse('admin:novalib_bookslog_changelist') + f'?wishlist__id__exact={obj.pk}'
+        # The student's wishlist entries
+        url = reverse('admin:novalib_wishlistentry_changelist') + f'?user__id__exact={obj.pk}'
         return format_html('<a href="{}">Wishlist</a>', url)
     wishlist_link.short_description = 'Wishlist'
 
@@ -45,12 +69,14 @@ class UserAdmin(admin.ModelAdmin):
     def view_wishlist_action(self, request, queryset):
         if queryset.count() == 1:
             obj = queryset.first()
-            # Show only wishlist books for the selected user via M2M field
-            wishlist_books = BooksLog.objects.filter(wishlist=obj)
+            # Show only wishlist books for the selected user, with their catalog entry
+            wishlist_books = wishlist_entries([obj.pk]).annotate(timestamp=F('created_at'))
+            holds = HoldRequest.objects.filter(user=obj, status__in=HoldRequest.ACTIVE_STATUSES).select_related('title', 'copy')
             context = dict(
                 self.admin_site.each_context(request),
                 user=obj,
                 wishlist_books=wishlist_books,
+                holds=holds,
             )
             return render(request, "admin/wishlist_list.html", context)
         else:
@@ -74,42 +100,69 @@ class UserAdmin(admin.ModelAdmin):
 
     def issued_book_list(self, obj):
         # List of books currently issued to the user from BooksDetail (any assigned book)
-        titles = BooksDetail.objects.filter(user=obj).values_list('book_title', flat=True).distinct()
+        if hasattr(obj, 'issued_copies'):
+            titles = list(dict.fromkeys(copy.book_title for copy in obj.issued_copies))
+        else:
+            titles = BooksDetail.objects.filter(user=obj).values_list('book_title', flat=True).distinct()
         return ", ".join(titles) if titles else "-"
     issued_book_list.short_description = "Issued Book List"
 
     def wish_list(self, obj):
         # List of books in the user's wishlist
+        if hasattr(obj, 'wishlisted'):
+            return ", ".join(entry.title.book_title for entry in obj.wishlisted) or "-"
         return ", ".join(
-            BooksLog.objects.filter(wishlist=obj).values_list('book_title', flat=True)
+            WishlistEntry.objects.filter(user=obj).values_list('title__book_title', flat=True)
         ) or "-"
     wish_list.short_description = "Wish List"
 
-    # New: Due Fine column (sum of fines from ReturnDesk for the user)
+    # Due Fine column: read from the materialized FineBalance row, which is
+    # joined into the changelist query via list_select_related
     def due_fine(self, obj):
-        total_fine = ReturnDesk.objects.filter(student=obj).aggregate(models.Sum('fine'))['fine__sum']
-        return total_fine if total_fine else 0
+        balance = getattr(obj, 'fine_balance', None)
+        return balance.balance if balance else 0
     due_fine.short_description = "Due Fine"
 
     # Keep existing payment method (not shown in list_display anymore)
     def payment(self, obj):
-        # Sum of fines for the user in ReturnDesk
-        total_fine = ReturnDesk.objects.filter(student=obj).aggregate(models.Sum('fine'))['fine__sum']
-        return total_fine if total_fine else 0
+        # Outstanding amount still to be paid, same source as due_fine
+        return self.due_fine(obj)
     payment.short_description = "Payment"
 
+def _count_subquery(queryset):
+    # COUNT(*) of a correlated queryset as an annotation (0 when nothing matches)
+    return Coalesce(Subquery(
+        queryset.order_by().values('title').annotate(n=Count('pk')).values('n')[:1]
+    ), 0)
+
 @admin.register(BooksLog)
 class BooksLogAdmin(admin.ModelAdmin):
     list_display = ('book_title', 'available_count', 'book_count', 'get_wishlist_users', 'auther', 'availability')  # added 'book_count' after 'available_count'
-    search_fields = ('wishlist__barcode_number', 'book_title', 'auther')  # Removed user__barcode_number
+    search_fields = ('title__wishlist_entries__user__barcode_number', 'book_title', 'auther')  # Removed user__barcode_number
+    show_full_result_count = False
     fieldsets = (
         (None, {
-            'fields': ('wishlist', 'book_title', 'auther', 'avalible')
+            'fields': ('book_title', 'auther', 'avalible')
         }),
     )
 
+    def get_queryset(self, request):
+        # Copy counts come from correlated subqueries and wishlist users from
+        # one prefetch through the joined Title, so the page costs the same
+        # however many rows it shows
+        copies = BooksDetail.objects.filter(title=OuterRef('title'))
+        return super().get_queryset(request).annotate(
+            _book_count=_count_subquery(copies),
+            _available_count=_count_subquery(copies.filter(user__isnull=True, avalible=True)),
+        ).select_related('title').prefetch_related(
+            Prefetch('title__wishlist_entries', queryset=WishlistEntry.objects.select_related('user').only(
+                'title_id', 'user__first_name', 'user__last_name')),
+        )
+
     def get_wishlist_users(self, obj):
-        return ", ".join([f"{user.first_name} {user.last_name}" for user in obj.wishlist.all()])
+        if obj.title is None:
+            return ""
+        return ", ".join([f"{entry.user.first_name} {entry.user.last_name}" for entry in obj.title.wishlist_entries.all()])
     get_wishlist_users.short_description = 'Wishlist Users'
 
     def view_available_books(self, request, queryset):
@@ -135,13 +188,17 @@ class BooksLogAdmin(admin.ModelAdmin):
     view_unavailable_books.short_description = "Show Unavailable Books (separate page)"
 
     def available_count(self, obj):
-        # Count BooksDetail entries for same title+author that have no user and are marked available
-        return BooksDetail.objects.filter(book_title=obj.book_title, auther=obj.auther, user__isnull=True, avalible=True).count()
+        # Count BooksDetail entries for the same Title that have no user and are marked available
+        if hasattr(obj, '_available_count'):
+            return obj._available_count
+        return BooksDetail.objects.filter(title_id=obj.title_id, user__isnull=True, avalible=True).count()
     available_count.short_description = 'Available Count'
 
     def book_count(self, obj):
-        # Total copies for the same title+author (regardless of user/availability)
-        return BooksDetail.objects.filter(book_title=obj.book_title, auther=obj.auther).count()
+        # Total copies for the same Title (regardless of user/availability)
+        if hasattr(obj, '_book_count'):
+            return obj._book_count
+        return BooksDetail.objects.filter(title_id=obj.title_id).count()
     book_count.short_description = 'Book Count'
 
     def availability(self, obj):
@@ -153,6 +210,8 @@ class BooksLogAdmin(admin.ModelAdmin):
 @admin.register(Login)
 class LoginAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'login_time', 'ip_address', 'authorized')  # Corrected 'authorized'
+    list_select_related = ('user',)
+    show_full_result_count = False
     search_fields = ('user__barcode_number', 'ip_address')
 
     def get_urls(self):
@@ -162,7 +221,17 @@ class LoginAdmin(admin.ModelAdmin):
                 "bookhold/<int:user_id>/",
                 self.admin_site.admin_view(self.bookhold_view),
                 name="novalib_login_bookhold",
-            )
+            ),
+            path(
+                "profiles/",
+                self.admin_site.admin_view(self.profile_list_view),
+                name="novalib_profile_list",
+            ),
+            path(
+                "profiles/<str:profile_id>/",
+                self.admin_site.admin_view(self.profile_detail_view),
+                name="novalib_profile_detail",
+            ),
         ]
         return custom_urls + urls
 
@@ -177,12 +246,39 @@ class LoginAdmin(admin.ModelAdmin):
         )
         return render(request, "admin/bookhold_list.html", context)
 
+    def profile_list_view(self, request):
+        # Recent request profiles, plus a signed link to profile a given path
+        path_to_profile = (request.GET.get('path') or '').strip()
+        context = dict(
+            self.admin_site.each_context(request),
+            title="Request profiles",
+            profiles=recent_profiles(),
+            path_to_profile=path_to_profile,
+            profile_link=profile_url(path_to_profile, request.user) if path_to_profile.startswith('/') else None,
+            header=PROFILE_HEADER,
+            buffer_size=PROFILE_BUFFER_SIZE,
+        )
+        return render(request, "admin/profile_list.html", context)
+
+    def profile_detail_view(self, request, profile_id):
+        entry = get_profile(profile_id)
+        if entry is None:
+            self.message_user(request, "That profile is no longer in the buffer.", level=messages.WARNING)
+            return redirect('admin:novalib_profile_list')
+        context = dict(
+            self.admin_site.each_context(request),
+            title=f"Profile of {entry['method']} {entry['path']}",
+            profile=entry,
+        )
+        return render(request, "admin/profile_detail.html", context)
+
 @admin.register(ReturnDesk)
 class ReturnDeskAdmin(admin.ModelAdmin):
     list_display = (
         'student_barcode', 'student_name', 'book', 'fine', 'otp', 'otp_expired'
     )
     search_fields = ('student__barcode_number', 'student__first_name', 'student__last_name', 'book', 'otp')
+    list_select_related = ('student',)
 
     # Detect if ReturnDesk.book is a ForeignKey to BooksLog
     _book_field = ReturnDesk._meta.get_field('book')
@@ -247,7 +343,12 @@ class DepartmentAdmin(admin.ModelAdmin):
     search_fields = ('name',)
     actions = ['view_users']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_total_users=Count('user'))
+
     def total_users(self, obj):
+        if hasattr(obj, '_total_users'):
+            return obj._total_users
         return User.objects.filter(department=obj).count()  # Filter by the Department object itself
     total_users.short_description = 'Total Users'
 
@@ -268,6 +369,7 @@ class DepartmentAdmin(admin.ModelAdmin):
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ('notification_id', 'title', 'uploaded_by', 'message', 'uploaded_image')  # show notification_id
+    list_select_related = ('uploaded_by',)
     search_fields = ('notification_id', 'title', 'uploaded_by__username', 'message')
     readonly_fields = ('uploaded_image_preview',)
 
@@ -277,15 +379,10 @@ class NotificationAdmin(admin.ModelAdmin):
         return "-"
     uploaded_image_preview.short_description = "Image Preview"
 
-    def delete_model(self, request, obj):
-        # Delete the image file from storage if it exists
-        if obj.uploaded_image and obj.uploaded_image.storage.exists(obj.uploaded_image.name):
-            obj.uploaded_image.delete(save=False)
-        super().delete_model(request, obj)
-
 @admin.register(DeveloperNotification)
 class DeveloperNotificationAdmin(admin.ModelAdmin):
     list_display = ('notification_id', 'title', 'uploaded_by', 'message', 'uploaded_image')  # Show notification_id
+    list_select_related = ('uploaded_by',)
     search_fields = ('notification_id', 'title', 'uploaded_by__username', 'message')
     readonly_fields = ('uploaded_image_preview',)
 
@@ -295,16 +392,25 @@ class DeveloperNotificationAdmin(admin.ModelAdmin):
         return "-"
     uploaded_image_preview.short_description = "Image Preview"
 
-    def delete_model(self, request, obj):
-        # Delete the image file from storage if it exists
-        if obj.uploaded_image and obj.uploaded_image.storage.exists(obj.uploaded_image.name):
-            obj.uploaded_image.delete(save=False)
-        super().delete_model(request, obj)
-
 @admin.register(BooksDetail)
 class BooksDetailAdmin(admin.ModelAdmin):
-    list_display = ('book_barcode', 'get_title_author', 'user', 'is_available', 'get_issued_date', 'get_return_date')  # use admin method for availability
+    list_display = ('book_barcode', 'get_title_author', 'user', 'reserved_for', 'is_available', 'get_issued_date', 'get_return_date')  # use admin method for availability
+    list_select_related = ('user', 'reserved_for')
+    show_full_result_count = False
     search_fields = ('book_barcode', 'book_title', 'auther')
+    actions = ['return_copies_action']
+
+    def return_copies_action(self, request, queryset):
+        # Saving each copy with no user runs the return path, which hands it to the next hold
+        returned = 0
+        for copy in queryset.filter(user__isnull=False):
+            copy.user = None
+            copy.avalible = True
+            copy.return_date = timezone.localdate()
+            copy.save()
+            returned += 1
+        self.message_user(request, f"Returned {returned} copies.")
+    return_copies_action.short_description = "Return selected copies"
 
     def get_title_author(self, obj):
         return f"{obj.book_title} ({obj.auther})"
@@ -319,8 +425,8 @@ class BooksDetailAdmin(admin.ModelAdmin):
     get_return_date.short_description = 'Return Date'
 
     def is_available(self, obj):
-        # If assigned to a user -> unavailable. Otherwise fall back to stored avalible flag.
-        if getattr(obj, 'user', None):
+        # If assigned or reserved for a user -> unavailable. Otherwise fall back to stored avalible flag.
+        if obj.user_id or obj.reserved_for_id:
             return False
         return bool(obj.avalible)
     is_available.short_description = 'Available'
@@ -329,7 +435,11 @@ class BooksDetailAdmin(admin.ModelAdmin):
     # use default queryset (BooksDetail.objects.all()) so admin shows actual BooksDetail rows
 
     class BooksDetailForm(forms.ModelForm):
-        book_title_author = forms.ChoiceField(choices=[], required=True, label="Book title and Author")
+        # Titles that have a BooksLog entry; the copy is linked by Title id
+        book_title_author = forms.ModelChoiceField(
+            queryset=Title.objects.filter(log_entries__isnull=False).distinct().order_by('book_title', 'auther'),
+            required=True, label="Book title and Author",
+        )
 
         class Meta:
             model = BooksDetail
@@ -337,34 +447,22 @@ class BooksDetailAdmin(admin.ModelAdmin):
 
         def __init__(self, *args, **kwargs):
             super().__init__(*args, **kwargs)
-            # Build unique (title, author) pairs from BooksLog
-            pairs = BooksLog.objects.values_list('book_title', 'auther').distinct()
-            self.fields['book_title_author'].choices = [
-                (f"{title}|||{author}", f"{title} ({author})") for title, author in pairs
-            ]
+            # Choices come from the cache; only the submitted Title is read back
+            self.fields['book_title_author'].choices = [('', '---------'), *title_choices()]
             # Set initial values if editing
             if self.instance and self.instance.pk:
-                self.fields['book_title_author'].initial = f"{self.instance.book_title}|||{self.instance.auther}"
+                self.fields['book_title_author'].initial = self.instance.title_id
 
         def clean(self):
             cleaned_data = super().clean()
-            value = cleaned_data.get('book_title_author')
-            if value:
-                title, author = value.split('|||', 1)
+            title = cleaned_data.get('book_title_author')
+            if title:
                 # set on instance so save works even when fields are removed from form
-                self.instance.book_title = title
-                self.instance.auther = author
+                self.instance.title = title
+                self.instance.book_title = title.book_title
+                self.instance.auther = title.auther
             return cleaned_data
 
-        def save(self, commit=True):
-            # ensure instance has book_title/auther from dropdown before saving
-            value = self.cleaned_data.get('book_title_author')
-            if value:
-                title, author = value.split('|||', 1)
-                self.instance.book_title = title
-                self.instance.auther = author
-            return super().save(commit=commit)
-
     form = BooksDetailForm
 
     def get_form(self, request, obj=None, **kwargs):
@@ -373,3 +471,58 @@ class BooksDetailAdmin(admin.ModelAdmin):
         form.base_fields.pop('book_title', None)
         form.base_fields.pop('auther', None)
         return form
+
+
+@admin.register(FineLedgerEntry)
+class FineLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'amount', 'note', 'created_at')
+    list_filter = ('kind',)
+    list_select_related = ('user',)
+    search_fields = ('user__barcode_number', 'note')
+    fields = ('user', 'kind', 'amount', 'note')
+    raw_id_fields = ('user',)
+
+    # The ledger is append-only: entries can be added (e.g. a payment) but not edited or removed
+    def get_readonly_fields(self, request, obj=None):
+        return self.fields if obj else ()
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            return
+        amount = abs(obj.amount)
+        if obj.kind == FineLedgerEntry.PAYMENT:
+            amount = -amount
+        # Post through the ledger helper so the balance row moves in the same transaction
+        entry = post_fine_entry(obj.user_id, amount, obj.kind, note=obj.note)
+        obj.pk = entry.pk
+
+@admin.register(HoldRequest)
+class HoldRequestAdmin(admin.ModelAdmin):
+    list_display = ('title', 'position', 'user', 'status', 'copy', 'expires_at')
+    list_filter = ('status',)
+    list_select_related = ('title', 'user', 'copy')
+    search_fields = ('title__book_title', 'title__auther', 'user__barcode_number')
+    raw_id_fields = ('title', 'user', 'copy')
+    ordering = ('title', 'position')
+
+@admin.register(WishlistEntry)
+class WishlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'title', 'created_at')
+    list_select_related = ('user', 'title')
+    search_fields = ('user__barcode_number', 'title__book_title', 'title__auther')
+    raw_id_fields = ('user', 'title')
+    show_full_result_count = False
+
+@admin.register(CirculationEvent)
+class CirculationEventAdmin(admin.ModelAdmin):
+    list_display = ('occurred_at', 'kind', 'book_title', 'copy', 'user', 'fine')
+    list_filter = ('kind',)
+    list_select_related = ('copy', 'user')
+    # Exact matches, so each search is an index lookup rather than a LIKE scan
+    search_fields = ('=copy__book_barcode', '=user__barcode_number', '=title__book_title')
+    date_hierarchy = 'month'
+    raw_id_fields = ('copy', 'title', 'user', 'return_desk')
+    show_full_result_count = False
@@ -0,0 +1,112 @@
+"""
+Shared helpers for the JSON API views: `?fields=` projection pushed down
+into `.values()`, and a pluggable JSON encoder for responses.
+"""
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+def stdlib_dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+_django_encoder = DjangoJSONEncoder()
+
+
+def _orjson_default(value):
+    # Decimals, and datetimes/times as Django's encoder writes them
+    # (milliseconds, "Z" for UTC), so responses don't change with the encoder
+    return _django_encoder.default(value)
+
+
+def orjson_dumps(data):
+    return orjson.dumps(data, default=_orjson_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+_dumps = None
+
+
+def get_json_dumps():
+    """
+    The callable used to encode API responses (data -> bytes). Set
+    NOVALIB_JSON_ENCODER to a dotted path to override; otherwise orjson is
+    used when installed, falling back to Django's encoder.
+    """
+    global _dumps
+    if _dumps is None:
+        path = getattr(settings, 'NOVALIB_JSON_ENCODER', None)
+        if path:
+            _dumps = import_string(path)
+        else:
+            _dumps = orjson_dumps if orjson is not None else stdlib_dumps
+    return _dumps
+
+
+class FastJsonResponse(HttpResponse):
+    """JsonResponse equivalent (lists allowed) that encodes via get_json_dumps()."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=get_json_dumps()(data), **kwargs)
+
+
+def selected_fields(params, field_map, default=None):
+    """
+    Output fields requested with ?fields=a,b,c (read from `params`, e.g.
+    request.GET), in request order. Unknown names are ignored; with no
+    (valid) selection the default set is used.
+    """
+    default = list(default or field_map)
+    raw = (params.get('fields') or '').strip()
+    if not raw:
+        return default
+    fields = []
+    for name in raw.split(','):
+        name = name.strip()
+        if name in field_map and name not in fields:
+            fields.append(name)
+    return fields or default
+
+
+def _columns(field_map, fields, extra_columns):
+    columns = list(extra_columns)
+    for name in fields:
+        spec = field_map[name]
+        for column in ((spec,) if isinstance(spec, str) else spec[0]):
+            if column not in columns:
+                columns.append(column)
+    return columns or ['pk']
+
+
+def _build(row, field_map, fields):
+    item = {}
+    for name in fields:
+        spec = field_map[name]
+        item[name] = row[spec] if isinstance(spec, str) else spec[1](row)
+    return item
+
+
+def project(queryset, field_map, fields, extra_columns=()):
+    """
+    Fetch only the columns the selected output fields need and build the
+    response rows. `field_map` maps an output name to either a column name
+    or a `(columns, convert)` pair where `convert(row)` builds the value.
+    Relations are only joined when a selected field spans them.
+    """
+    rows = queryset.values(*_columns(field_map, fields, extra_columns))
+    return [_build(row, field_map, fields) for row in rows]
+
+
+async def aproject(queryset, field_map, fields, extra_columns=()):
+    """project() for async views, streaming rows with the async ORM."""
+    rows = queryset.values(*_columns(field_map, fields, extra_columns))
+    return [_build(row, field_map, fields) async for row in rows.aiterator()]
@@ -0,0 +1,104 @@
+"""
+Async (ASGI) versions of the read-heavy API views and OTP dispatch.
+
+They build the same querysets as novalib.views and run them with the
+async ORM, so a worker keeps serving other requests while waiting on
+the database. SMTP, which has no async client in Django, runs in the
+thread pool so it never blocks the event loop. novalib.urls routes the
+public paths here when NOVALIB_ASYNC_VIEWS is on (see asgi.py).
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.timezone import now
+from django.views.decorators.csrf import csrf_exempt
+
+from novalib import singleflight
+from novalib.api import FastJsonResponse, aproject
+from novalib.db_router import replica_reads
+from novalib.models import DeveloperNotification, Login, Notification, User
+from novalib.views import (
+    BOOK_LOG_PARAMS, _attach_wishlist_users, _book_log_query, _flight_key, _notification_rows, _otp_email,
+    _search_term, _suggestion_query, _unique_suggestions, _user_lookup_q, _user_wishlist_query,
+    generate_otp, get_client_ip,
+)
+from novalib.wishlists import wishers
+
+
+@csrf_exempt
+@replica_reads
+async def book_log_list(request):
+    """Async book_log_list; same parameters and response."""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    user_q = _user_lookup_q(request.GET)
+    users_qs = User.objects.filter(user_q) if user_q else None
+    rows = await singleflight.ado('book_log', _flight_key(request.GET, BOOK_LOG_PARAMS),
+                                  lambda: aproject(*_book_log_query(request.GET, users_qs)))
+    return FastJsonResponse(rows)
+
+
+@csrf_exempt
+async def user_wishlist(request):
+    """Async user_wishlist; same parameters and response."""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    q = _user_lookup_q(request.GET)
+    if not q:
+        return FastJsonResponse([])
+    logs, field_map, fields, extra_columns = _user_wishlist_query(request.GET, User.objects.filter(q))
+    rows = await aproject(logs, field_map, fields, extra_columns)
+    if 'wishlist_users' in fields and rows:
+        links = [link async for link in wishers([row['wishlist_users'] for row in rows]).aiterator()]
+        _attach_wishlist_users(rows, links)
+    return FastJsonResponse(rows)
+
+
+@csrf_exempt
+@replica_reads
+async def book_suggestions(request):
+    """Async book_suggestions; same parameters and response."""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    term = _search_term(request.GET.get('search'))
+    qs = _suggestion_query(term)
+    if qs is None:
+        return FastJsonResponse([])
+
+    async def rows():
+        return _unique_suggestions([row async for row in qs.aiterator()])
+
+    return FastJsonResponse(await singleflight.ado('suggestions', term, rows))
+
+
+@replica_reads
+async def notifications(request):
+    return FastJsonResponse(await sync_to_async(_notification_rows)(request, Notification))
+
+
+@replica_reads
+async def DeveloperNotifications(request):
+    return FastJsonResponse(await sync_to_async(_notification_rows)(request, DeveloperNotification))
+
+
+@csrf_exempt
+async def send_otp(request):
+    """Async send_otp: DB work on the async ORM, SMTP in the thread pool."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    data = json.loads(request.body.decode('utf-8'))
+    user = await User.objects.filter(barcode_number=data.get('barcode')).afirst()
+    if user is None:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    otp = generate_otp()
+    # Not thread_sensitive: each send gets its own pool thread instead of
+    # queueing behind every other sync call on the shared one
+    await sync_to_async(_otp_email(user, otp).send, thread_sensitive=False)(fail_silently=False)
+
+    stamp = now()
+    await User.objects.filter(pk=user.pk).aupdate(otp=otp, otp_created_at=stamp)
+    await Login.objects.acreate(user=user, login_time=stamp, ip_address=get_client_ip(request))
+
+    return JsonResponse({'user': {'name': f"{user.first_name} {user.last_name}", 'phone': user.phone_number}, 'email': user.email}, status=200)
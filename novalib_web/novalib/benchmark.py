@@ -0,0 +1,155 @@
+"""
+Endpoint benchmark used by `manage.py benchmark`.
+
+Builds request targets for every public API endpoint from the rows of a
+generated library (novalib.datagen), boots the app in a child process
+with an in-memory mail backend, drives one endpoint at a time with
+novalib.loadtest and returns per-endpoint throughput and percentiles.
+Each endpoint gets several request variants (different students, titles
+and search terms) under one name so caches and indexes see a realistic
+spread rather than one hot key.
+"""
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from http.client import HTTPConnection
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from novalib.loadtest import target
+from novalib.models import BooksDetail, BooksLog, Login, User
+
+# Valid for the whole run; the benchmark sets it on the students it verifies
+BENCH_OTP = '246810'
+
+
+def _sample(queryset, count, rng):
+    rows = list(queryset[:count * 4])
+    rng.shuffle(rows)
+    return rows[:count]
+
+
+def build_targets(prefix='G', variants=20, seed=1):
+    """
+    {endpoint name: [targets]} drawn from the dataset with barcode `prefix`
+    (any rows when none carry it). Students used for verify-otp are primed
+    with BENCH_OTP and a login row.
+    """
+    rng = random.Random(seed)
+    users = User.objects.filter(barcode_number__startswith=f'{prefix}U')
+    if not users.exists():
+        users = User.objects.all()
+    titles = BooksLog.objects.filter(book_barcode__startswith=f'{prefix}T')
+    if not titles.exists():
+        titles = BooksLog.objects.all()
+
+    borrowers = _sample(BooksDetail.objects.filter(user__isnull=False, user__in=users)
+                        .order_by('user_id').values_list('user__barcode_number', flat=True).distinct(),
+                        variants, rng)
+    students = _sample(users.order_by('id').values_list('barcode_number', flat=True), variants * 3, rng)
+    # The lowest ids are the most popular generated titles
+    popular = _sample(titles.order_by('id').values_list('book_barcode', 'book_title', 'auther'), variants, rng)
+    if not students or not popular:
+        raise ValueError('no dataset found; run `manage.py generate_library` first')
+    words = sorted({word for _, title, _ in popular for word in title.split() if not word.isdigit()})
+
+    send_users = students[:variants]
+    verify_users = students[variants:variants * 2]
+    wishlist_users = students[variants * 2:] or students
+    User.objects.filter(barcode_number__in=verify_users).update(
+        otp=BENCH_OTP, otp_created_at=now() + timedelta(days=1),
+    )
+    Login.objects.bulk_create([
+        Login(user=user, ip_address='127.0.0.1')
+        for user in User.objects.filter(barcode_number__in=verify_users)
+    ])
+
+    def pick(values):
+        return [values[i % len(values)] for i in range(variants)]
+
+    targets = {
+        'search': [target(f'/book-log/?search={word}', name='search') for word in pick(words)],
+        'suggestions': [target(f'/book-suggestions/?search={word[:3]}', name='suggestions')
+                        for word in pick(words)],
+        'book_log_user': [target(f'/book-log/?barcode={barcode}', name='book_log_user')
+                          for barcode in pick(borrowers or students)],
+        'user_wishlist': [target(f'/user-wishlist/?barcode={barcode}', name='user_wishlist')
+                          for barcode in pick(wishlist_users)],
+        'notifications': [target('/library-notifications/', name='notifications')],
+        'developer_notifications': [target('/notifications/', name='developer_notifications')],
+        'send_otp': [target('/api/send-otp/', 'POST', {'barcode': barcode}, name='send_otp')
+                     for barcode in send_users],
+        'verify_otp': [target('/api/verify-otp/', 'POST', {'barcode': barcode, 'otp': BENCH_OTP},
+                              name='verify_otp')
+                       for barcode in verify_users],
+    }
+    # Add and remove alternate per worker, so the wishlist doesn't just grow
+    wishlist_ops = []
+    for barcode, (book_barcode, _, _) in zip(pick(wishlist_users), pick(popular)):
+        body = {'user_barcode': barcode, 'book_barcode': book_barcode}
+        wishlist_ops.append(target('/api/wishlist/', 'POST', body, name='wishlist_add_remove'))
+        wishlist_ops.append(target('/api/wishlist/', 'DELETE', body, name='wishlist_add_remove'))
+    targets['wishlist_add_remove'] = wishlist_ops
+    return targets
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command=None, port=None, timeout=60):
+    """
+    Start the app in a child process and wait until it answers. `command`
+    may use {host} and {port}; the default is the development server
+    without autoreload. Returns (process, base_url).
+    """
+    port = port or free_port()
+    manage = os.path.join(settings.BASE_DIR, 'manage.py')
+    command = command or f'{sys.executable} {manage} runserver {{host}}:{{port}} --noreload'
+    env = {
+        **os.environ,
+        'DJANGO_DEBUG': 'False',
+        # OTP mail stays in memory instead of going to SMTP
+        'DJANGO_EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+    }
+    # The request log goes to a file: an unread pipe would fill and stall the server
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command.format(host='127.0.0.1', port=port).split(), env=env,
+                               stdout=subprocess.DEVNULL, stderr=log)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f'server exited: {log.read().decode(errors="replace")[-2000:]}')
+        try:
+            conn = HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/book-suggestions/')
+            conn.getresponse().read()
+            conn.close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('server did not start in time')
+
+
+def compare(previous, current):
+    """Rows of (endpoint, metric, before, after, change %) for endpoints in both runs."""
+    rows = []
+    for name, after in current['results'].items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            continue
+        for metric in ('rps', 'p50_ms', 'p99_ms'):
+            old, new = before[metric], after[metric]
+            change = (new - old) / old * 100 if old else 0.0
+            rows.append((name, metric, old, new, change))
+    return rows
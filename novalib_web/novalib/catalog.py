@@ -0,0 +1,145 @@
+"""
+Versioned catalog for offline search in the mobile app: a compact
+snapshot of every title with its availability, plus deltas since a
+version read from the CatalogChange log.
+
+A client that has synced to version v never asks for anything at or
+below v again, so a change must not become visible after a higher
+version has. Auto-increment ids don't guarantee that: they are handed
+out at INSERT and show up at COMMIT, and a long transaction (a batch
+request, hold expiry) commits after shorter ones that started later.
+Versions therefore come from the single CatalogVersion row, bumped in
+the writing transaction; the row lock it takes is held until that
+transaction ends, so the next version can't be handed out before the
+previous one is committed or rolled back. The price is that catalog
+writers queue behind each other from their first change to their commit.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from novalib.metrics import record_cache
+from novalib.models import BooksDetail, BooksLog, CatalogChange, CatalogVersion, Title
+
+# Column order of each title row in snapshot/delta payloads
+CATALOG_FIELDS = ['book_title', 'book_author', 'available', 'total']
+# Number of (title, author) pairs combined into one OR-ed lookup
+_KEY_BATCH = 200
+
+
+def record_catalog_change(book_title, auther):
+    """Log a change to (book_title, auther) at the next catalog version."""
+    with transaction.atomic():
+        if not CatalogVersion.objects.filter(pk=1).update(value=F('value') + 1):
+            # Only on a database whose counter row was never created (flushed)
+            CatalogVersion.objects.get_or_create(pk=1)
+            CatalogVersion.objects.filter(pk=1).update(value=F('value') + 1)
+        version = CatalogVersion.objects.values_list('value', flat=True).get(pk=1)
+        return CatalogChange.objects.create(version=version, book_title=book_title or '', auther=auther or '')
+
+
+def current_version():
+    return CatalogVersion.objects.filter(pk=1).values_list('value', flat=True).first() or 0
+
+
+def _title_rows(keys=None):
+    """
+    [title, author, available, total] for every title, or only for `keys`
+    ((title, author) pairs). Titles come from BooksLog and copies from
+    BooksDetail, so a title with no copies shows 0/0. Pairs are looked up
+    once in Title's unique index; both tables are then read by title_id.
+    """
+    counts = {}
+    titles = set()
+    batches = [None] if keys is None else [keys[i:i + _KEY_BATCH] for i in range(0, len(keys), _KEY_BATCH)]
+    for batch in batches:
+        key_q = Q()
+        for title, author in batch or ():
+            key_q |= Q(book_title=title, auther=author)
+        if batch is not None and not key_q:
+            continue
+        copies = BooksDetail.objects.all()
+        logs = BooksLog.objects.all()
+        if batch is not None:
+            copies = copies.filter(title__in=Title.objects.filter(key_q))
+            logs = logs.filter(title__in=Title.objects.filter(key_q))
+        copies = (copies
+                  .values('title__book_title', 'title__auther')
+                  .annotate(total=Count('id'),
+                            available=Count('id', filter=Q(user__isnull=True, avalible=True))))
+        for row in copies:
+            counts[(row['title__book_title'], row['title__auther'])] = (row['available'], row['total'])
+        titles.update(logs.values_list('title__book_title', 'title__auther').distinct())
+    titles.update(counts)
+    return [
+        [title, author, *counts.get((title, author), (0, 0))]
+        for title, author in sorted(titles)
+    ]
+
+
+def snapshot():
+    """
+    Full catalog at the current version. The version is read before the
+    rows, so anything changed while the snapshot is built shows up again
+    in the next delta (rows are idempotent upserts). Cached per version.
+    """
+    version = current_version()
+    cache_key = f'novalib:catalog:snapshot:{version}'
+    data = cache.get(cache_key)
+    record_cache('catalog_snapshot', data is not None)
+    if data is None:
+        data = {'version': version, 'fields': CATALOG_FIELDS, 'titles': _title_rows()}
+        cache.set(cache_key, data, 300)
+    return data
+
+
+def changes_since(since):
+    """
+    Delta from version `since`: `upserts` are title rows to (re)store,
+    `deletes` are [title, author] pairs that no longer exist. Returns
+    {'reset': True} when the client must fetch a fresh snapshot instead.
+    At most NOVALIB_CATALOG_DELTA_MAX_CHANGES change rows are folded into
+    one delta; `more` tells the client to ask again from `version`.
+    """
+    limit = getattr(settings, 'NOVALIB_CATALOG_DELTA_MAX_CHANGES', 5000)
+    oldest = CatalogChange.objects.order_by('version').values_list('version', flat=True).first()
+    version = current_version()
+    if since > version or (oldest is not None and since < oldest - 1):
+        # Unknown future version, or the log was pruned past the client
+        return {'version': version, 'reset': True}
+
+    changes = list(CatalogChange.objects
+                   .filter(version__gt=since)
+                   .order_by('version')
+                   .values_list('version', 'book_title', 'auther')[:limit + 1])
+    more = len(changes) > limit
+    changes = changes[:limit]
+    if not changes:
+        return {'version': since, 'fields': CATALOG_FIELDS, 'upserts': [], 'deletes': [], 'more': False}
+
+    keys = sorted({(title, author) for _, title, author in changes})
+    rows = _title_rows(keys)
+    present = {(row[0], row[1]) for row in rows}
+    return {
+        'version': changes[-1][0],
+        'fields': CATALOG_FIELDS,
+        'upserts': rows,
+        'deletes': [[title, author] for title, author in keys if (title, author) not in present],
+        'more': more,
+    }
+
+
+def prune_changes(before_version, batch_size=5000):
+    """
+    Delete change rows below `before_version` in batches; returns rows
+    removed. The newest row is always kept, so a client older than every
+    remaining row is told to reset.
+    """
+    before_version = min(before_version, current_version())
+    removed = 0
+    while True:
+        ids = list(CatalogChange.objects.filter(version__lt=before_version).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return removed
+        removed += CatalogChange.objects.filter(id__in=ids).delete()[0]
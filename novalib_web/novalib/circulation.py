@@ -0,0 +1,124 @@
+"""
+Circulation history: one CirculationEvent per issue or return of a copy.
+
+BooksDetail.save records an issue when a copy gets a user and a return
+when it loses one. A ReturnDesk row records (or updates) a return with
+its fine. The desk row and the copy's return are one return, whichever
+comes first: the later one is folded into the earlier one's event
+instead of logged twice. Issues also count
+towards the title's popularity (novalib.popularity).
+"""
+from datetime import datetime, timedelta
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from novalib import popularity
+from novalib.models import CirculationEvent, Title
+
+# A copy return and a desk return of the same title this close together are the same return
+DESK_MATCH_WINDOW = timedelta(days=1)
+
+
+def _same_title(title_id, book_title):
+    # Desk events whose book names two titles have no title; match those by name
+    return Q(title_id=title_id) | Q(title__isnull=True, book_title=book_title)
+
+
+def month_start(moment):
+    """First day of the (local) month of a datetime or date."""
+    if isinstance(moment, datetime):
+        if timezone.is_aware(moment):
+            moment = timezone.localtime(moment)
+        moment = moment.date()
+    return moment.replace(day=1)
+
+
+def _event(kind, copy, user_id, **fields):
+    return CirculationEvent(
+        kind=kind, copy=copy, title_id=copy.title_id, user_id=user_id,
+        book_title=copy.book_title, issued_date=fields.pop('issued_date', copy.issued_date),
+        return_date=copy.return_date, **fields,
+    )
+
+
+def record_issue(copy):
+    event = _event(CirculationEvent.ISSUE, copy, copy.user_id)
+    event.save()
+    if event.title_id:
+        popularity.record(popularity.LOAN, event.occurred_at, pk=event.title_id)
+    return event
+
+
+def record_return(copy, user_id, issued_date):
+    """`user_id` is the borrower the copy just came back from."""
+    stamp = timezone.now()
+    desk_event = (CirculationEvent.objects
+                  .filter(_same_title(copy.title_id, copy.book_title),
+                          kind=CirculationEvent.RETURN, user_id=user_id,
+                          copy__isnull=True, return_desk__isnull=False,
+                          occurred_at__gte=stamp - DESK_MATCH_WINDOW)
+                  .order_by('-occurred_at')
+                  .first())
+    if desk_event:
+        desk_event.copy = copy
+        desk_event.title_id = copy.title_id
+        desk_event.issued_date = issued_date
+        desk_event.return_date = copy.return_date
+        desk_event.save(update_fields=['copy', 'title', 'issued_date', 'return_date'])
+        return desk_event
+    event = _event(CirculationEvent.RETURN, copy, user_id, issued_date=issued_date, occurred_at=stamp)
+    event.save()
+    return event
+
+
+def record_desk_return(desk):
+    """Create or update the return event of a ReturnDesk row."""
+    updated = (CirculationEvent.objects
+               .filter(return_desk=desk)
+               .update(user_id=desk.student_id, fine=desk.fine or 0, book_title=desk.book))
+    if updated:
+        return
+    # The desk only names the book; with two authors of that title, leave it unset
+    matches = list(Title.objects.filter(book_title=desk.book).values_list('pk', flat=True)[:2])
+    title_id = matches[0] if len(matches) == 1 else None
+    # The copy may have come back first
+    copy_q = Q(book_title=desk.book) if title_id is None else Q(title_id=title_id)
+    copy_event = (CirculationEvent.objects
+                  .filter(copy_q, kind=CirculationEvent.RETURN, user_id=desk.student_id,
+                          copy__isnull=False, return_desk__isnull=True,
+                          occurred_at__gte=timezone.now() - DESK_MATCH_WINDOW)
+                  .order_by('-occurred_at')
+                  .first())
+    if copy_event:
+        copy_event.return_desk = desk
+        copy_event.fine = desk.fine or 0
+        copy_event.save(update_fields=['return_desk', 'fine'])
+        return
+    CirculationEvent(
+        kind=CirculationEvent.RETURN, user_id=desk.student_id, title_id=title_id,
+        book_title=desk.book, fine=desk.fine or 0, return_desk=desk,
+        return_date=timezone.localdate(),
+    ).save()
+
+
+def copy_history(copy_id):
+    return CirculationEvent.objects.filter(copy_id=copy_id).order_by('-occurred_at')
+
+
+def user_history(user_id):
+    return CirculationEvent.objects.filter(user_id=user_id).order_by('-occurred_at')
+
+
+def monthly_report(month):
+    """
+    Issues, returns and fines per title for the month containing `month`,
+    busiest first, read through the (month, kind) index.
+    """
+    return (CirculationEvent.objects
+            .filter(month=month_start(month))
+            .values('title_id', 'book_title')
+            .annotate(issues=Count('pk', filter=Q(kind=CirculationEvent.ISSUE)),
+                      returns=Count('pk', filter=Q(kind=CirculationEvent.RETURN)),
+                      fines=Sum('fine'))
+            .order_by('-issues', 'book_title'))
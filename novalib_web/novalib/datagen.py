@@ -0,0 +1,356 @@
+"""
+Deterministic synthetic library for measuring performance at production
+scale (used by `manage.py generate_library` and the query-budget tests).
+
+Everything is derived from one seeded Random, and dates count back from
+`as_of`, so the same arguments always produce the same rows. Rows are
+written with explicit primary keys as plain tuples in batched INSERTs
+(see _insert): building half a million model instances and running them
+through bulk_create's per-field compiler took longer than the inserts
+themselves. That skips model save() and signals, so the derived tables
+those would maintain (titles, fine ledger and balances, hold queue,
+circulation history) are written directly.
+Title popularity follows a Zipf-like curve: popular titles have more
+copies, more of them on loan and more wishlist entries.
+"""
+import itertools
+import random
+import string
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connections, models, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from novalib import popularity, refcache
+from novalib.circulation import month_start
+from novalib.models import (
+    BooksDetail, BooksLog, CirculationEvent, Department, DeveloperNotification, FineBalance, FineLedgerEntry,
+    HoldRequest, Login, Notification, ReturnDesk, Title, User, WishlistEntry,
+)
+
+ADJECTIVES = [
+    'Silent', 'Hidden', 'Broken', 'Golden', 'Distant', 'Quiet', 'Burning', 'Frozen', 'Lost', 'Final',
+    'Secret', 'Ancient', 'Endless', 'Crimson', 'Hollow', 'Wild', 'Bright', 'Dark', 'Gentle', 'Iron',
+    'Applied', 'Modern', 'Practical', 'Advanced', 'Digital', 'Discrete', 'Organic', 'Numerical',
+]
+NOUNS = [
+    'River', 'Garden', 'Empire', 'Machine', 'Ocean', 'Forest', 'Kingdom', 'Signal', 'Algorithm', 'Theory',
+    'Mountain', 'Archive', 'Circuit', 'Harbor', 'Engine', 'Library', 'Frontier', 'Chemistry', 'Physics',
+    'Calculus', 'Networks', 'Economics', 'Mechanics', 'Structures', 'Systems', 'Compilers', 'Biology',
+]
+FIRST_NAMES = [
+    'Aarav', 'Ananya', 'Arjun', 'Bidisha', 'Chandan', 'Deepa', 'Farhan', 'Gita', 'Hrishi', 'Ishita',
+    'Jyoti', 'Kabir', 'Lakshmi', 'Manoj', 'Nandini', 'Pranab', 'Riya', 'Sayan', 'Tanvi', 'Uday',
+    'Vikram', 'Zoya', 'Priya', 'Rahul', 'Sneha', 'Amit', 'Kaushik', 'Meera', 'Nikhil', 'Pooja',
+]
+LAST_NAMES = [
+    'Das', 'Roy', 'Sharma', 'Bora', 'Gogoi', 'Singh', 'Dutta', 'Nath', 'Paul', 'Sen',
+    'Choudhury', 'Barman', 'Deb', 'Saikia', 'Kalita', 'Ahmed', 'Bhattacharjee', 'Sinha', 'Ghosh', 'Kumar',
+]
+DEPARTMENTS = [
+    'Computer Science', 'Electronics', 'Mathematics', 'Physics', 'Chemistry', 'Life Science',
+    'Economics', 'Commerce', 'English', 'History', 'Political Science', 'Mass Communication',
+    'Ecology', 'Statistics', 'Civil Engineering', 'Mechanical Engineering', 'Law', 'Education',
+]
+
+# Popularity exponent: weight of the title ranked r is 1 / r**POPULARITY_SKEW
+POPULARITY_SKEW = 0.9
+
+
+def _next_id(model):
+    return (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _bulk(model, rows, batch_size):
+    created = 0
+    for batch in _batches(rows, batch_size):
+        model.objects.bulk_create(batch, batch_size=batch_size)
+        created += len(batch)
+    return created
+
+
+def _adapter(field, ops):
+    """The backend conversion a value of `field` needs before the driver sees it, or None."""
+    if isinstance(field, models.DateTimeField):
+        return ops.adapt_datetimefield_value
+    if isinstance(field, models.DateField):
+        return ops.adapt_datefield_value
+    if isinstance(field, models.DecimalField):
+        return lambda value: ops.adapt_decimalfield_value(value, field.max_digits, field.decimal_places)
+    if isinstance(field, models.GenericIPAddressField):
+        return ops.adapt_ipaddressfield_value
+    return None
+
+
+def _insert(model, names, rows, batch_size):
+    """
+    INSERT `rows`, tuples of values for the fields (attnames) in `names`,
+    without building model instances. Fields not named get their default,
+    computed once. Returns the number of rows written.
+    """
+    connection = connections[router.db_for_write(model)]
+    ops = connection.ops
+    fields = [model._meta.get_field(name) for name in names]
+    rest = [field for field in model._meta.concrete_fields
+            if field.attname not in names and not field.db_returning]
+    fixed = tuple(field.get_db_prep_save(field.get_default(), connection) for field in rest)
+    adapters = [(i, adapter) for i, field in enumerate(fields) if (adapter := _adapter(field, ops))]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        ops.quote_name(model._meta.db_table),
+        ', '.join(ops.quote_name(field.column) for field in fields + rest),
+        ', '.join(['%s'] * (len(fields) + len(rest))),
+    )
+    created = 0
+    with connection.cursor() as cursor:
+        for batch in _batches(rows, batch_size):
+            params = []
+            for row in batch:
+                row = list(row)
+                for i, adapter in adapters:
+                    row[i] = adapter(row[i])
+                params.append((*row, *fixed))
+            cursor.executemany(sql, params)
+            created += len(batch)
+    return created
+
+
+def _title_ids(keys, batch_size):
+    """Title id for each (title, author) in `keys`, reusing rows an earlier dataset created."""
+    found = {}
+    for batch in _batches(keys, batch_size):
+        rows = Title.objects.filter(book_title__in={title for title, _ in batch})
+        found.update(((title, author), pk) for pk, title, author in rows.values_list('pk', 'book_title', 'auther'))
+    start = _next_id(Title)
+    missing = [key for key in dict.fromkeys(keys) if key not in found]
+    for i, key in enumerate(missing):
+        found[key] = start + i
+    _bulk(Title, (Title(id=found[key], book_title=key[0], auther=key[1]) for key in missing), batch_size)
+    return [found[key] for key in keys]
+
+
+def _stamp(as_of, days_back, seconds):
+    return as_of - timedelta(days=days_back, seconds=seconds)
+
+
+def generate_library(departments=18, users=20000, titles=50000, copies=500000, wishlists=100000,
+                     loan_rate=0.2, fines=40000, logins=100000, notifications=300, seed=42,
+                     prefix='G', as_of=None, batch_size=5000, log=None):
+    """
+    Create a synthetic library and return {table: rows created}. Barcodes,
+    department names and notification ids start with `prefix`; the
+    function refuses to run if rows with that prefix already exist.
+    `as_of` (an aware datetime, default today at midnight) anchors all dates.
+    """
+    if copies < titles:
+        raise ValueError('copies must be at least the number of titles')
+    if BooksDetail.objects.filter(book_barcode__startswith=f'{prefix}B').exists():
+        raise ValueError(f'generated rows with prefix {prefix!r} already exist')
+    rng = random.Random(seed)
+    as_of = as_of or timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    log = log or (lambda message: None)
+    counts = {}
+
+    with transaction.atomic():
+        # Departments and students
+        dept_start = _next_id(Department)
+        dept_ids = list(range(dept_start, dept_start + departments))
+        counts['departments'] = _bulk(Department, (
+            Department(id=pk, name=f'{prefix} {DEPARTMENTS[i % len(DEPARTMENTS)]} {i // len(DEPARTMENTS) + 1}')
+            for i, pk in enumerate(dept_ids)
+        ), batch_size)
+
+        user_start = _next_id(User)
+        user_ids = list(range(user_start, user_start + users))
+
+        def make_users():
+            for i, pk in enumerate(user_ids):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                yield (pk, f'{prefix}U{i:07d}', first, last, f'9{rng.randrange(10 ** 9):09d}',
+                       f'{first.lower()}.{last.lower()}.{i}@example.edu',
+                       rng.choice(dept_ids) if dept_ids else None)
+        counts['users'] = _insert(User, ('id', 'barcode_number', 'first_name', 'last_name', 'phone_number',
+                                         'email', 'department_id'), make_users(), batch_size)
+        log(f"users: {counts['users']}")
+
+        # Titles, ranked by popularity (rank 0 is the most popular)
+        title_start = _next_id(BooksLog)
+        title_keys = []
+        seen = set()
+        for i in range(titles):
+            key = (f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}',
+                   f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}')
+            if key in seen:
+                key = (f'{key[0]} {i}', key[1])
+            seen.add(key)
+            title_keys.append(key)
+        title_ids = _title_ids(title_keys, batch_size)
+        weights = [1 / (rank + 1) ** POPULARITY_SKEW for rank in range(titles)]
+        cumulative = list(itertools.accumulate(weights))
+
+        def pick_titles(k):
+            return rng.choices(range(titles), cum_weights=cumulative, k=k)
+
+        def stamps(k, days):
+            return [_stamp(as_of, day, second)
+                    for day, second in zip(rng.choices(range(days), k=k), rng.choices(range(86400), k=k))]
+
+        # Every title gets one copy; the rest follow popularity
+        copies_per_title = [1] * titles
+        for rank in pick_titles(copies - titles):
+            copies_per_title[rank] += 1
+        top_copies = copies_per_title[0]
+
+        # BooksLog.avalible mirrors whether any copy is on the shelf; filled in below
+        shelf = [False] * titles
+        copy_start = _next_id(BooksDetail)
+        loans = []  # (copy id, title rank, user id, issued on)
+        issue_dates = [(as_of - timedelta(days=days)).date() for days in range(60)]
+
+        def make_copies():
+            pk = copy_start
+            for rank, count in enumerate(copies_per_title):
+                title, author = title_keys[rank]
+                title_id = title_ids[rank]
+                # Popular titles are on loan more often
+                rate = min(0.95, loan_rate * (1 + 3 * (count / top_copies) ** 0.5)) if user_ids else 0
+                for _ in range(count):
+                    barcode = f'{prefix}B{pk - copy_start:08d}'
+                    if rng.random() < rate:
+                        user_id = rng.choice(user_ids)
+                        issued_on = issue_dates[rng.randrange(1, 60)]
+                        loans.append((pk, rank, user_id, issued_on))
+                        yield (pk, barcode, title_id, title, author, False,
+                               user_id, issued_on, issued_on + timedelta(days=14))
+                    else:
+                        shelf[rank] = True
+                        yield pk, barcode, title_id, title, author, True, None, None, None
+                    pk += 1
+        counts['copies'] = _insert(BooksDetail, ('id', 'book_barcode', 'title_id', 'book_title', 'auther', 'avalible',
+                                                 'user_id', 'issued_date', 'return_date'), make_copies(), batch_size)
+        counts['loans'] = len(loans)
+        log(f"copies: {counts['copies']} ({counts['loans']} on loan)")
+
+        counts['titles'] = _insert(BooksLog, ('id', 'book_barcode', 'title_id', 'book_title', 'auther', 'avalible'), (
+            (title_start + rank, f'{prefix}T{rank:07d}', title_ids[rank], title, author, shelf[rank])
+            for rank, (title, author) in enumerate(title_keys)
+        ), batch_size)
+
+        # Wishlists (and the hold queue entry each one implies), skewed to popular titles
+        wanted = wishlists if users else 0
+        links = list(dict.fromkeys(zip(pick_titles(wanted), rng.choices(user_ids, k=wanted))))
+        link_start = _next_id(WishlistEntry)
+        counts['wishlist_links'] = _insert(WishlistEntry, ('id', 'title_id', 'user_id', 'created_at'), (
+            (link_start + i, title_ids[rank], user_id, when)
+            for i, ((rank, user_id), when) in enumerate(zip(links, stamps(len(links), 180)))
+        ), batch_size)
+
+        # Queue after any holds already on the same titles (another dataset's)
+        positions = dict(HoldRequest.objects.values('title_id').annotate(tail=Max('position'))
+                         .values_list('title_id', 'tail'))
+
+        def make_holds():
+            for (rank, user_id), when in zip(links, stamps(len(links), 90)):
+                title_id = title_ids[rank]
+                positions[title_id] = positions.get(title_id, 0) + 1
+                yield user_id, title_id, positions[title_id], when
+        counts['holds'] = _insert(HoldRequest, ('user_id', 'title_id', 'position', 'created_at'),
+                                  make_holds(), batch_size)
+        log(f"wishlist links: {counts['wishlist_links']}")
+
+        # Returns with fines, their ledger charges, some payments and balances
+        desk_start = _next_id(ReturnDesk)
+        charged = fines if users else 0
+        amounts = [Decimal(amount) for amount in (5, 10, 10, 20, 20, 50, 100)]
+        charges = [  # (return desk id, user id, amount, when, title rank)
+            (desk_start + i, user_id, amount, when, rank)
+            for i, (user_id, amount, when, rank) in enumerate(zip(
+                rng.choices(user_ids, k=charged), rng.choices(amounts, k=charged),
+                stamps(charged, 365), pick_titles(charged),
+            ))
+        ]
+        counts['return_desk'] = _insert(ReturnDesk, ('id', 'student_id', 'book', 'fine', 'otp', 'otp_expired'), (
+            (desk_id, user_id, title_keys[rank][0], amount, f'{otp:06d}', True)
+            for (desk_id, user_id, amount, _, rank), otp in zip(charges, rng.choices(range(10 ** 6), k=charged))
+        ), batch_size)
+
+        balances = {}
+
+        def make_ledger():
+            for (desk_id, user_id, amount, when, _), paid in zip(charges, rng.choices((True, False), k=charged)):
+                balances[user_id] = balances.get(user_id, Decimal(0)) + amount
+                yield user_id, FineLedgerEntry.CHARGE, amount, desk_id, 'Generated return', when
+                # About half of the fines have been paid
+                if paid:
+                    balances[user_id] -= amount
+                    yield user_id, FineLedgerEntry.PAYMENT, -amount, None, 'Generated payment', when + timedelta(days=1)
+        counts['fine_entries'] = _insert(FineLedgerEntry, ('user_id', 'kind', 'amount', 'return_desk_id', 'note',
+                                                           'created_at'), make_ledger(), batch_size)
+        counts['fine_balances'] = _insert(FineBalance, ('user_id', 'balance', 'updated_at'), (
+            (user_id, balance, as_of) for user_id, balance in sorted(balances.items())
+        ), batch_size)
+        log(f"fines: {counts['return_desk']}")
+
+        # Circulation history: the current loans and the desk returns
+        event_ids = itertools.count(_next_id(CirculationEvent))
+
+        def make_events():
+            for copy_id, rank, user_id, issued_on in loans:
+                when = timezone.make_aware(datetime.combine(issued_on, time(10)))
+                yield (next(event_ids), CirculationEvent.ISSUE, copy_id, title_ids[rank], user_id, title_keys[rank][0],
+                       issued_on, issued_on + timedelta(days=14), Decimal(0), None, when, month_start(when))
+            for desk_id, user_id, amount, when, rank in charges:
+                yield (next(event_ids), CirculationEvent.RETURN, None, title_ids[rank], user_id, title_keys[rank][0],
+                       None, when.date(), amount, desk_id, when, month_start(when))
+        counts['circulation_events'] = _insert(CirculationEvent, (
+            'id', 'kind', 'copy_id', 'title_id', 'user_id', 'book_title', 'issued_date', 'return_date', 'fine',
+            'return_desk_id', 'occurred_at', 'month',
+        ), make_events(), batch_size)
+
+        # Login history over the last six months
+        attempts = logins if users else 0
+        octets = rng.choices(range(256), k=2 * attempts)
+        counts['logins'] = _insert(Login, ('user_id', 'login_time', 'ip_address', 'authorized'), (
+            (user_id, when, f'10.{octets[2 * i]}.{octets[2 * i + 1]}.{host}', authorized)
+            for i, (user_id, when, host, authorized) in enumerate(zip(
+                rng.choices(user_ids, k=attempts), stamps(attempts, 180),
+                rng.choices(range(1, 255), k=attempts), (rng.random() < 0.9 for _ in range(attempts)),
+            ))
+        ), batch_size)
+        log(f"logins: {counts['logins']}")
+
+        # Notifications from a few staff accounts; created_at is auto_now_add,
+        # so the spread-out dates are written with a second pass
+        Staff = get_user_model()
+        staff = []
+        for i in range(3 if notifications else 0):
+            member, _ = Staff.objects.get_or_create(
+                username=f'{prefix.lower()}-librarian-{i + 1}', defaults={'is_staff': True},
+            )
+            staff.append(member.pk)
+        for model, letter, key in ((Notification, 'N', 'notifications'),
+                                   (DeveloperNotification, 'D', 'developer_notifications')):
+            start = _next_id(model)
+            count = notifications if model is Notification else notifications // 10
+            rows = [model(id=start + i, notification_id=f'{prefix[:1]}{letter}{i:06d}',
+                          title=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} notice',
+                          message=' '.join(rng.choices(string.ascii_lowercase, k=40)),
+                          uploaded_by_id=rng.choice(staff))
+                    for i in range(count)]
+            counts[key] = _bulk(model, rows, batch_size)
+            for row in rows:
+                row.created_at = _stamp(as_of, rng.randrange(120), rng.randrange(86400))
+            model.objects.bulk_update(rows, ['created_at'], batch_size=500)
+
+        # Bulk writes send no signals and skip the popularity counters
+        popularity.rebuild(dict.fromkeys(title_ids), batch_size)
+        refcache.invalidate_all()
+    return counts
@@ -0,0 +1,186 @@
+"""
+Database router that sends reads from read-only API views to replicas.
+
+Views opt in with @replica_reads. Inside such a view, reads go to a
+healthy replica alias unless the request has already written, in which
+case it stays on the primary (so it can read its own writes). Writes
+always go to the primary. A replica lagging more than
+NOVALIB_REPLICA_MAX_LAG seconds, or whose status can't be read, is skipped
+until its next health check.
+
+Health checks query the replicas, so they run when a replica view
+starts (in the thread pool for async views) and the router only reads
+their cached result: db_for_read is also called on the event loop, by
+the async ORM, where no query may run.
+
+Code filling a cache that other requests read (novalib.refcache) wraps
+its queries in primary_reads(), so a lagging replica's rows aren't
+cached past the invalidation that should have replaced them.
+"""
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+PRIMARY = 'default'
+
+# Per-request routing state; a dict so that writes made in a copied context
+# (sync_to_async threads) are still seen by the rest of the request
+_state = ContextVar('novalib_db_route', default=None)
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def max_lag():
+    return getattr(settings, 'NOVALIB_REPLICA_MAX_LAG', 5)
+
+
+def lag_check_interval():
+    return getattr(settings, 'NOVALIB_REPLICA_LAG_CHECK_INTERVAL', 5)
+
+
+def replica_aliases():
+    configured = getattr(settings, 'NOVALIB_REPLICA_DATABASES', None)
+    if configured is not None:
+        return list(configured)
+    return [alias for alias in settings.DATABASES if alias != PRIMARY]
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica is behind its source; None when it isn't
+    replicating. Backends without replication status (e.g. SQLite) can't
+    show they are caught up, so they report None too and reads stay on
+    the primary.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        for statement, column in (('SHOW REPLICA STATUS', 'Seconds_Behind_Source'),
+                                  ('SHOW SLAVE STATUS', 'Seconds_Behind_Master')):
+            try:
+                cursor.execute(statement)
+            except DatabaseError:
+                continue
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            names = [col[0] for col in cursor.description]
+            return dict(zip(names, row)).get(column)
+    return None
+
+
+def _due_replicas():
+    stamp = time.monotonic()
+    interval = lag_check_interval()
+    with _health_lock:
+        return [alias for alias in replica_aliases()
+                if alias not in _health or stamp - _health[alias][0] >= interval]
+
+
+def refresh_replica_health():
+    """
+    Re-run the lag check of replicas last checked
+    NOVALIB_REPLICA_LAG_CHECK_INTERVAL or more seconds ago. Runs queries:
+    call it from sync code only.
+    """
+    for alias in _due_replicas():
+        try:
+            lag = replica_lag(alias)
+            healthy = lag is not None and lag <= max_lag()
+        except DatabaseError:
+            # Stopped or unreachable; anything else is a bug and propagates
+            healthy = False
+        with _health_lock:
+            _health[alias] = (time.monotonic(), healthy)
+
+
+def replica_healthy(alias):
+    """Result of the last health check; unchecked replicas aren't used."""
+    with _health_lock:
+        cached = _health.get(alias)
+    return bool(cached and cached[1])
+
+
+def reset_replica_health():
+    with _health_lock:
+        _health.clear()
+
+
+@contextmanager
+def _routing():
+    token = _state.set({'replica': True, 'wrote': False})
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_replicas():
+    """Route reads in this block to replicas (until the first write)."""
+    refresh_replica_health()
+    with _routing():
+        yield
+
+
+@contextmanager
+def primary_reads():
+    """Route reads in this block to the primary, even inside a replica view."""
+    outer = _state.get()
+    token = _state.set({'replica': False, 'wrote': False})
+    try:
+        yield
+    finally:
+        wrote = _state.get()['wrote']
+        _state.reset(token)
+        if outer and wrote:
+            outer['wrote'] = True
+
+
+def replica_reads(view):
+    """Decorator for read-only views (sync or async) whose reads may use a replica."""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            if _due_replicas():
+                await sync_to_async(refresh_replica_health)()
+            with _routing():
+                return await view(*args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with use_replicas():
+                return view(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if not state or not state['replica'] or state['wrote']:
+            return PRIMARY
+        healthy = [alias for alias in replica_aliases() if replica_healthy(alias)]
+        return random.choice(healthy) if healthy else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state:
+            # Later reads in this request must see this write
+            state['wrote'] = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
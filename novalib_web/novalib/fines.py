@@ -0,0 +1,95 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils.timezone import now
+
+from novalib.models import FineBalance, FineLedgerEntry
+
+ZERO = Decimal('0.00')
+
+
+def post_fine_entry(user_id, amount, kind=FineLedgerEntry.CHARGE, return_desk=None, note=''):
+    """
+    Append a ledger entry and apply it to the user's balance row in the
+    same transaction. `amount` is signed: charges add, payments subtract.
+    """
+    amount = Decimal(amount)
+    with transaction.atomic():
+        entry = FineLedgerEntry.objects.create(
+            user_id=user_id,
+            kind=kind,
+            amount=amount,
+            return_desk=return_desk,
+            note=note,
+        )
+        updated = (FineBalance.objects
+                   .filter(pk=user_id)
+                   .update(balance=F('balance') + amount, updated_at=now()))
+        if not updated:
+            # First entry for this user: create the row, then apply the delta
+            # with the same UPDATE so concurrent first postings don't clobber.
+            FineBalance.objects.get_or_create(user_id=user_id)
+            (FineBalance.objects
+             .filter(pk=user_id)
+             .update(balance=F('balance') + amount, updated_at=now()))
+    return entry
+
+
+def record_fine_charge(user_id, amount, return_desk=None, note=''):
+    return post_fine_entry(user_id, amount, FineLedgerEntry.CHARGE, return_desk, note)
+
+
+def record_fine_payment(user_id, amount, note=''):
+    # Payments are stored negative so the balance is a plain sum
+    return post_fine_entry(user_id, -abs(Decimal(amount)), FineLedgerEntry.PAYMENT, note=note)
+
+
+def get_fine_balance(user_id):
+    """Current balance for a user: a single primary-key read."""
+    balance = FineBalance.objects.filter(pk=user_id).values_list('balance', flat=True).first()
+    return balance if balance is not None else ZERO
+
+
+def reconcile_balances(batch_size=1000, dry_run=False):
+    """
+    Recompute every FineBalance from the ledger in batches of users.
+    Each batch locks its balance rows so concurrent postings wait rather
+    than being overwritten. Returns (checked, corrected).
+    """
+    user_ids = sorted(
+        set(FineLedgerEntry.objects.values_list('user_id', flat=True).distinct())
+        | set(FineBalance.objects.values_list('user_id', flat=True))
+    )
+    checked = corrected = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        with transaction.atomic():
+            balances = {
+                b.user_id: b
+                for b in FineBalance.objects.select_for_update().filter(user_id__in=batch)
+            }
+            totals = dict(
+                FineLedgerEntry.objects
+                .filter(user_id__in=batch)
+                .values('user_id')
+                .annotate(total=Sum('amount'))
+                .values_list('user_id', 'total')
+            )
+            to_create, to_update = [], []
+            stamp = now()
+            for user_id in batch:
+                expected = totals.get(user_id) or ZERO
+                current = balances.get(user_id)
+                if current is None:
+                    to_create.append(FineBalance(user_id=user_id, balance=expected, updated_at=stamp))
+                elif current.balance != expected:
+                    current.balance = expected
+                    current.updated_at = stamp
+                    to_update.append(current)
+            checked += len(batch)
+            corrected += len(to_create) + len(to_update)
+            if not dry_run:
+                FineBalance.objects.bulk_create(to_create, batch_size=batch_size)
+                FineBalance.objects.bulk_update(to_update, ['balance', 'updated_at'], batch_size=batch_size)
+    return checked, corrected
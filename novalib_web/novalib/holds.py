@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from novalib.catalog import record_catalog_change
+from novalib.models import BooksDetail, HoldRequest, Title
+
+def hold_pickup_days():
+    """How long a returned copy stays reserved for the head of the queue."""
+    return getattr(settings, 'NOVALIB_HOLD_PICKUP_DAYS', 3)
+
+
+def enqueue_hold(user_id, title_id):
+    """
+    Put a student at the back of a title's queue. A student already waiting
+    on (or holding a reserved copy of) the title keeps their place.
+
+    Enqueues for one title are serialised on its Title row, which always
+    exists to be locked (an empty queue has no row to lock, and gap locks
+    don't exclude each other). The duplicate check and the tail are then
+    locking reads, which see the latest committed rows rather than the
+    snapshot of a caller's REPEATABLE READ transaction.
+    """
+    with transaction.atomic():
+        Title.objects.select_for_update().get(pk=title_id)
+        queue = HoldRequest.objects.select_for_update().filter(title_id=title_id)
+        existing = queue.filter(user_id=user_id, status__in=HoldRequest.ACTIVE_STATUSES).first()
+        if existing:
+            return existing
+        last = queue.order_by('-position').values_list('position', flat=True).first() or 0
+        return HoldRequest.objects.create(user_id=user_id, title_id=title_id, position=last + 1)
+
+
+def cancel_hold(user_id, title_id):
+    """Drop a student's active hold; a copy reserved for them moves down the queue."""
+    with transaction.atomic():
+        holds = list(HoldRequest.objects
+                     .select_for_update()
+                     .filter(user_id=user_id, title_id=title_id, status__in=HoldRequest.ACTIVE_STATUSES))
+        for hold in holds:
+            hold.status = HoldRequest.CANCELLED
+            hold.save(update_fields=['status'])
+            if hold.copy_id:
+                copy = BooksDetail.objects.select_for_update().get(pk=hold.copy_id)
+                if copy.reserved_for_id == user_id and not copy.user_id:
+                    allocate_copy(copy)
+    return len(holds)
+
+
+def allocate_copy(copy):
+    """
+    Reserve a copy that has just come back for the next waiting student, or
+    release its reservation back to the shelf when nobody is waiting. A copy
+    that wasn't reserved and has nobody waiting is left as the caller saved
+    it. The head of the queue is a single index seek on (title, status,
+    position). Must run inside the caller's transaction (the return or the
+    sweeper).
+    """
+    hold = (HoldRequest.objects
+            .select_for_update()
+            .filter(title_id=copy.title_id, status=HoldRequest.WAITING)
+            .order_by('position')
+            .first()) if copy.title_id else None
+    if hold:
+        stamp = now()
+        hold.status = HoldRequest.READY
+        hold.copy = copy
+        hold.ready_at = stamp
+        hold.expires_at = stamp + timedelta(days=hold_pickup_days())
+        hold.save(update_fields=['status', 'copy', 'ready_at', 'expires_at'])
+        copy.reserved_for_id = hold.user_id
+        copy.avalible = False
+    elif copy.reserved_for_id:
+        copy.reserved_for_id = None
+        copy.avalible = True
+    else:
+        return None
+    # update() rather than save() so this doesn't re-enter BooksDetail.save,
+    # which also skips the post_save catalog hook, so log the change here
+    BooksDetail.objects.filter(pk=copy.pk).update(reserved_for_id=copy.reserved_for_id, avalible=copy.avalible)
+    record_catalog_change(copy.book_title, copy.auther)
+    return hold
+
+
+def fulfil_hold(copy):
+    """The reserved student has collected the copy: close their hold."""
+    HoldRequest.objects.filter(copy=copy, user_id=copy.user_id, status=HoldRequest.READY).update(
+        status=HoldRequest.FULFILLED,
+    )
+    copy.reserved_for_id = None
+    BooksDetail.objects.filter(pk=copy.pk).update(reserved_for_id=None)
+
+
+def expire_holds(batch_size=500):
+    """
+    Release ready holds whose pickup window has passed, a batch per
+    transaction, passing each freed copy to the next student in line.
+    Returns the number of holds expired.
+    """
+    expired = 0
+    while True:
+        ids = list(HoldRequest.objects
+                   .filter(status=HoldRequest.READY, expires_at__lt=now())
+                   .order_by('expires_at')
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return expired
+        with transaction.atomic():
+            holds = list(HoldRequest.objects
+                         .select_for_update()
+                         .filter(id__in=ids, status=HoldRequest.READY))
+            HoldRequest.objects.filter(id__in=[h.id for h in holds]).update(status=HoldRequest.EXPIRED)
+            copy_ids = [h.copy_id for h in holds if h.copy_id]
+            copies = BooksDetail.objects.select_for_update().filter(pk__in=copy_ids, user__isnull=True)
+            by_user = {h.copy_id: h.user_id for h in holds}
+            for copy in copies:
+                if copy.reserved_for_id == by_user.get(copy.pk):
+                    allocate_copy(copy)
+            expired += len(holds)
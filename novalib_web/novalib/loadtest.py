@@ -0,0 +1,116 @@
+"""
+Small closed-loop HTTP load generator used by the `loadtest` command.
+
+Each worker thread keeps one keep-alive connection and sends its next
+request as soon as the previous one completes, cycling through the
+targets. Latencies are recorded per target and summarised as
+throughput and percentiles.
+"""
+import http.client
+import itertools
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def target(path, method='GET', body=None, name=None, headers=None):
+    """A request to drive: `body` (dict/list) is sent as JSON."""
+    return {
+        'name': name or f'{method} {path}',
+        'method': method,
+        'path': path,
+        'body': json.dumps(body).encode('utf-8') if body is not None else None,
+        'headers': headers or {},
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    """Throughput and latency percentiles (ms) for one target or the total."""
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(values) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p90_ms': round(percentile(values, 90) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+def _connect(parts, timeout):
+    cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return cls(parts.hostname, parts.port, timeout=timeout)
+
+
+def run_load(base_url, targets, concurrency=10, duration=10.0, timeout=30.0, keepalive=True):
+    """
+    Drive `targets` against `base_url` from `concurrency` threads for
+    `duration` seconds. A response with status >= 500 or a transport
+    error counts as an error. With keepalive=False every request opens a
+    new connection. Returns {'total': summary, 'targets': {name: summary}}.
+    """
+    parts = urlsplit(base_url)
+    prefix = parts.path.rstrip('/')
+    latencies = {t['name']: [] for t in targets}
+    errors = {t['name']: 0 for t in targets}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        conn = _connect(parts, timeout)
+        local = {name: [] for name in latencies}
+        local_errors = {name: 0 for name in errors}
+        # Stagger the starting target so workers don't move in lockstep
+        cycle = itertools.islice(itertools.cycle(targets), offset % len(targets), None)
+        for t in cycle:
+            if time.perf_counter() >= deadline:
+                break
+            headers = {'Accept-Encoding': 'gzip', **t['headers']}
+            if t['body'] is not None:
+                headers['Content-Type'] = 'application/json'
+            start = time.perf_counter()
+            try:
+                conn.request(t['method'], prefix + t['path'], body=t['body'], headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 500
+                if not keepalive:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = _connect(parts, timeout)
+            if ok:
+                local[t['name']].append(time.perf_counter() - start)
+            else:
+                local_errors[t['name']] += 1
+        conn.close()
+        with lock:
+            for name, values in local.items():
+                latencies[name].extend(values)
+                errors[name] += local_errors[name]
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        'total': summarize(all_latencies, sum(errors.values()), elapsed),
+        'targets': {name: summarize(latencies[name], errors[name], elapsed) for name in latencies},
+    }
@@ -0,0 +1,97 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from novalib.api import get_json_dumps
+from novalib.middleware import brotli, compress, compress_min_size
+
+
+def _book_log_rows(count, rng):
+    # Same shape as /book-log/ rows
+    words = ['Data', 'Systems', 'Organic', 'Chemistry', 'Modern', 'Physics', 'Calculus',
+             'Networks', 'Introduction', 'Advanced', 'Theory', 'Practice', 'Biology']
+    return [{
+        'book_title': ' '.join(rng.choices(words, k=rng.randint(2, 5))),
+        'book_author': f"{rng.choice(['A.', 'R.', 'S.', 'K.'])} {rng.choice(['Sharma', 'Roy', 'Das', 'Smith'])}",
+        'book_barcode': f"BK{rng.randint(100000, 999999)}",
+        'available': rng.random() < 0.6,
+        'issued_date': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'return_date': None,
+        'username': rng.choice(['', 'Sayan Roy', 'Priya Das']),
+    } for _ in range(count)]
+
+
+def _notification_rows(count, rng):
+    # Same shape as the notification feeds, with longer free text
+    sentence = "The central library will remain open until 10 pm during the examination week. "
+    return [{
+        'title': f"Notice {i}",
+        'message': sentence * rng.randint(1, 6),
+        'uploaded_by': 'Library Admin',
+        'uploaded_image': f"https://example.org/media/notifications/N{i:07d}.jpeg",
+        'timestamp': 'Monday 14:30',
+    } for i in range(count)]
+
+
+PAYLOADS = {
+    'book-log': _book_log_rows,
+    'notifications': _notification_rows,
+}
+
+
+class Command(BaseCommand):
+    help = ("Measure bytes saved and CPU time per response for gzip/brotli over "
+            "representative JSON API payloads of increasing size.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='1,5,10,25,100,1000,10000',
+                            help='Comma-separated row counts to benchmark.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Compressions per measurement (CPU time is averaged).')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', dest='json_path',
+                            help='Also write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        dumps = get_json_dumps()
+        encodings = ['gzip'] + (['br'] if brotli is not None else [])
+        row_counts = [int(n) for n in options['rows'].split(',') if n.strip()]
+        repeat = max(1, options['repeat'])
+
+        results = []
+        self.stdout.write(f"{'payload':<14}{'rows':>7}{'raw B':>10}{'enc':>6}{'out B':>10}"
+                          f"{'saved':>8}{'cpu ms':>9}{'ms/KB':>8}")
+        for name, build in PAYLOADS.items():
+            for rows in row_counts:
+                body = dumps(build(rows, rng))
+                for encoding in encodings:
+                    start = time.process_time()
+                    for _ in range(repeat):
+                        out = compress(body, encoding)
+                    cpu_ms = (time.process_time() - start) * 1000 / repeat
+                    result = {
+                        'payload': name,
+                        'rows': rows,
+                        'raw_bytes': len(body),
+                        'encoding': encoding,
+                        'compressed_bytes': len(out),
+                        'saved_bytes': len(body) - len(out),
+                        'cpu_ms': round(cpu_ms, 4),
+                        'cpu_ms_per_kb': round(cpu_ms / (len(body) / 1024), 4),
+                    }
+                    results.append(result)
+                    saved = result['saved_bytes'] / len(body) * 100
+                    self.stdout.write(
+                        f"{name:<14}{rows:>7}{len(body):>10}{encoding:>6}{len(out):>10}"
+                        f"{saved:>7.1f}%{cpu_ms:>9.3f}{result['cpu_ms_per_kb']:>8.3f}"
+                    )
+
+        min_size = compress_min_size()
+        self.stdout.write(f"\nCurrent NOVALIB_COMPRESS_MIN_SIZE: {min_size} bytes")
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump({'min_size': min_size, 'results': results}, fh, indent=2)
+            self.stdout.write(f"Wrote {len(results)} results to {options['json_path']}")
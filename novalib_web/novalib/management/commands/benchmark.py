@@ -0,0 +1,111 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from novalib.benchmark import build_targets, compare, start_server
+from novalib.loadtest import run_load
+from novalib.models import BooksDetail, BooksLog, User
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every API endpoint against a generated dataset "
+        "(`manage.py generate_library`). Boots the app in a child process with an "
+        "in-memory mail backend (or targets --url), drives each endpoint in turn "
+        "and reports throughput and p50/p99 latency. Save runs with --json and "
+        "compare them across commits with --compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Benchmark a running deployment instead of booting one.')
+        parser.add_argument('--server-cmd',
+                            help='Command that serves the app, with {host} and {port} placeholders, '
+                                 'e.g. "gunicorn novalib_web.wsgi -w 4 -b {host}:{port}". '
+                                 'Defaults to runserver.')
+        parser.add_argument('--prefix', default='G', help='Barcode prefix of the generated dataset.')
+        parser.add_argument('--endpoint', action='append',
+                            help='Only run these endpoints (repeatable).')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds to drive each endpoint.')
+        parser.add_argument('--variants', type=int, default=20,
+                            help='Distinct requests (students, titles, terms) per endpoint.')
+        parser.add_argument('--keepalive', action='store_true',
+                            help='Reuse connections. Off by default: the development server '
+                                 "doesn't set TCP_NODELAY, so keep-alive requests stall ~40ms "
+                                 'on delayed ACKs and every endpoint looks the same.')
+        parser.add_argument('--json', dest='json_path', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', dest='compare_path',
+                            help='JSON results of an earlier run to compare against.')
+
+    def handle(self, *args, **options):
+        try:
+            targets = build_targets(prefix=options['prefix'], variants=options['variants'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        selected = options['endpoint'] or list(targets)
+        unknown = set(selected) - set(targets)
+        if unknown:
+            raise CommandError(f"Unknown endpoint(s) {', '.join(sorted(unknown))}; "
+                               f"choose from {', '.join(targets)}")
+
+        process = None
+        base_url = options['url']
+        if not base_url:
+            try:
+                process, base_url = start_server(options['server_cmd'])
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+
+        results = {}
+        try:
+            self.stdout.write(f"{'endpoint':<26}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+            for name in selected:
+                summary = run_load(base_url, targets[name], concurrency=options['concurrency'],
+                                   duration=options['duration'], keepalive=options['keepalive'])['total']
+                results[name] = summary
+                self.stdout.write(f"{name:<26}{summary['rps']:>10.1f}{summary['p50_ms']:>10.2f}"
+                                  f"{summary['p99_ms']:>10.2f}{summary['errors']:>8}")
+        finally:
+            if process:
+                process.terminate()
+                process.wait(timeout=10)
+
+        run = {
+            'commit': _git_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'server': options['url'] or options['server_cmd'] or 'runserver',
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'dataset': {
+                'users': User.objects.count(),
+                'titles': BooksLog.objects.count(),
+                'copies': BooksDetail.objects.count(),
+            },
+            'concurrency': options['concurrency'],
+            'keepalive': options['keepalive'],
+            'duration': options['duration'],
+            'results': results,
+        }
+
+        if options['compare_path']:
+            with open(options['compare_path']) as fh:
+                previous = json.load(fh)
+            self.stdout.write(f"\nCompared with {previous.get('commit') or options['compare_path']}:")
+            for name, metric, old, new, change in compare(previous, run):
+                self.stdout.write(f"  {name:<26}{metric:<8}{old:>10.2f} -> {new:>10.2f} ({change:+.1f}%)")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(run, fh, indent=2)
+            self.stdout.write(f"Wrote results to {options['json_path']}")
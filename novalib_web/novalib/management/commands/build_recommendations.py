@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from novalib import recommendations
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the \"students who wanted this also wanted\" table from every "
+            "wishlist entry and loan. Run nightly; the endpoint only reads the table.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K,
+                            help='Neighbours kept per title.')
+        parser.add_argument('--min-support', type=int, default=recommendations.MIN_SUPPORT,
+                            help='Students a pair of titles needs in common to count.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows per INSERT.')
+
+    def handle(self, *args, **options):
+        try:
+            written = recommendations.build_neighbors(
+                top_k=options['top_k'],
+                min_support=options['min_support'],
+                batch_size=options['batch_size'],
+            )
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Stored {written} title neighbours."))
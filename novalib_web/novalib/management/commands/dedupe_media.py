@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from novalib import refcache
+from novalib.media import ContentAddressedStorage
+from novalib.models import DeveloperNotification, Notification, image_in_use
+
+
+class Command(BaseCommand):
+    help = ("Move notification images saved before content-addressed storage under "
+            "their content hash, so identical images share one file, and delete the "
+            "old copies.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the images that would move without touching them.')
+
+    def handle(self, *args, **options):
+        moved = missing = 0
+        for model in (Notification, DeveloperNotification):
+            storage = model._meta.get_field('uploaded_image').storage
+            prefix = f'{ContentAddressedStorage.directory}/'
+            rows = (model.objects
+                    .exclude(uploaded_image='').exclude(uploaded_image__isnull=True)
+                    .exclude(uploaded_image__startswith=prefix)
+                    .values_list('pk', 'uploaded_image'))
+            for pk, old_name in rows:
+                if not storage.exists(old_name):
+                    missing += 1
+                    self.stderr.write(f'{model.__name__} {pk}: {old_name} is missing')
+                    continue
+                moved += 1
+                if options['dry_run']:
+                    continue
+                with storage.open(old_name) as fh:
+                    new_name = storage.save(old_name, fh)
+                model.objects.filter(pk=pk).update(uploaded_image=new_name)
+                # Names from before content addressing are never uploaded to again
+                if not image_in_use(old_name):
+                    storage.delete(old_name)
+        if moved and not options['dry_run']:
+            # update() sends no signals
+            refcache.invalidate('notification_feeds')
+        verb = 'would move' if options['dry_run'] else 'moved'
+        self.stdout.write(self.style.SUCCESS(f"{verb.capitalize()} {moved} images, {missing} missing."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from novalib.holds import expire_holds
+
+
+class Command(BaseCommand):
+    help = "Expire holds whose pickup window has passed and pass their copies down the queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of holds released per transaction.')
+
+    def handle(self, *args, **options):
+        expired = expire_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} holds."))
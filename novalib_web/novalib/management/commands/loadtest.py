@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from novalib.loadtest import run_load, target
+
+DEFAULT_PATHS = [
+    '/book-log/?search=a',
+    '/book-suggestions/?search=a',
+    '/library-notifications/',
+    '/notifications/',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the read-heavy API endpoints of one or more running deployments at "
+        "increasing concurrency and compare throughput/latency. To compare WSGI "
+        "with ASGI on the same hardware, start e.g. "
+        "`gunicorn novalib_web.wsgi -w 4 -b 127.0.0.1:8000` and "
+        "`uvicorn novalib_web.asgi:application --workers 4 --port 8001`, then run "
+        "`manage.py loadtest --url http://127.0.0.1:8000 --url http://127.0.0.1:8001`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', required=True,
+                            help='Base URL of a deployment (repeat to compare several).')
+        parser.add_argument('--path', action='append',
+                            help='Endpoint path to drive (repeatable). Defaults to the read endpoints.')
+        parser.add_argument('--concurrency', default='10,50,200',
+                            help='Comma-separated concurrency levels.')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds to run each level.')
+        parser.add_argument('--json', dest='json_path',
+                            help='Also write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(n) for n in options['concurrency'].split(',') if n.strip()]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma-separated list of integers')
+        targets = [target(path) for path in options['path'] or DEFAULT_PATHS]
+
+        results = []
+        self.stdout.write(f"{'deployment':<32}{'conc':>6}{'req/s':>10}{'p50 ms':>10}"
+                          f"{'p99 ms':>10}{'errors':>8}")
+        for level in levels:
+            for url in options['url']:
+                summary = run_load(url, targets, concurrency=level, duration=options['duration'])
+                total = summary['total']
+                results.append({'url': url, 'concurrency': level, **summary})
+                self.stdout.write(f"{url:<32}{level:>6}{total['rps']:>10.1f}{total['p50_ms']:>10.2f}"
+                                  f"{total['p99_ms']:>10.2f}{total['errors']:>8}")
+            if len(options['url']) > 1:
+                base, *others = [r for r in results if r['concurrency'] == level]
+                for other in others:
+                    if base['total']['rps']:
+                        ratio = other['total']['rps'] / base['total']['rps']
+                        self.stdout.write(f"  {other['url']} vs {base['url']}: {ratio:.2f}x throughput")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(f"Wrote results to {options['json_path']}")
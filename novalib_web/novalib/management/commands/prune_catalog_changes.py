@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from novalib.catalog import prune_changes
+from novalib.models import CatalogChange
+
+
+class Command(BaseCommand):
+    help = ("Delete catalog change-log rows older than --days. Clients that last "
+            "synced before that are told to download a fresh snapshot.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = now() - timedelta(days=options['days'])
+        first_kept = (CatalogChange.objects
+                      .filter(changed_at__gte=cutoff)
+                      .order_by('version')
+                      .values_list('version', flat=True)
+                      .first())
+        if first_kept is None:
+            first_kept = float('inf')
+        removed = prune_changes(first_kept, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} catalog change rows."))
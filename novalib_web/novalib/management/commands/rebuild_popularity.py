@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from novalib.popularity import rebuild
+
+
+class Command(BaseCommand):
+    help = ("Recompute every title's popularity from its loans and wishlist entries. "
+            "Run once after migrating or after changing the weights; search clicks "
+            "are not logged and start again from zero.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Titles per UPDATE.')
+
+    def handle(self, *args, **options):
+        scored = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Scored {scored} titles."))
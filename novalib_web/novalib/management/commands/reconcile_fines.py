@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from novalib.fines import reconcile_balances
+
+
+class Command(BaseCommand):
+    help = "Recompute every student's FineBalance row from the fine ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of students reconciled per transaction.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted balances without writing them.')
+
+    def handle(self, *args, **options):
+        checked, corrected = reconcile_balances(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        verb = 'would correct' if options['dry_run'] else 'corrected'
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} balances, {verb} {corrected}."
+        ))
@@ -0,0 +1,21 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from novalib.media import ContentAddressedStorage
+from novalib.models import image_in_use
+
+
+class Command(BaseCommand):
+    help = ("Delete stored notification images that no notification refers to any more "
+            "(deleted notifications, replaced images) and that were not used in the last --hours.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24,
+                            help='Leave files written or reused this recently alone.')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            self.stderr.write('The default storage is not content-addressed; nothing to sweep.')
+            return
+        deleted = default_storage.sweep(image_in_use, options['hours'] * 3600)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {len(deleted)} unused images."))
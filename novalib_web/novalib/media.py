@@ -0,0 +1,240 @@
+"""
+Serving of uploaded media (notification images) in production.
+
+Uploads are stored once per distinct content, named by its hash (see
+ContentAddressedStorage), so a URL always means the same bytes and can
+be cached by browsers and CDNs for a year. Older files without a hash
+get NOVALIB_MEDIA_MAX_AGE instead.
+
+Several rows can share a file, and a new upload of the same bytes can
+pick a file up between any reference check and a delete, so files are
+not deleted along with their rows. `manage.py sweep_media` removes the
+ones nothing refers to (deleted notifications, replaced images) once
+they have been left alone for a grace period; see
+ContentAddressedStorage.sweep.
+
+serve_media() only stats the file: it answers conditional requests
+(ETag / Last-Modified) with 304 and hands the transfer itself to the
+front server when NOVALIB_MEDIA_OFFLOAD is set:
+
+- 'x-accel-redirect' (nginx): the response names the file under
+  NOVALIB_MEDIA_ACCEL_PREFIX, which must be an `internal` location
+  aliased to MEDIA_ROOT.
+- 'x-sendfile' (Apache mod_xsendfile, lighttpd): the response names
+  the absolute path.
+
+Without offloading the file goes out as a FileResponse, which WSGI
+servers send with sendfile(). Single byte ranges are answered with 206;
+requests for several ranges get the whole file.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+import tempfile
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import locks
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+MEDIA_OFFLOAD = getattr(settings, 'NOVALIB_MEDIA_OFFLOAD', None)
+MEDIA_ACCEL_PREFIX = getattr(settings, 'NOVALIB_MEDIA_ACCEL_PREFIX', '/protected-media/')
+# For files whose name carries no content hash
+MEDIA_MAX_AGE = getattr(settings, 'NOVALIB_MEDIA_MAX_AGE', 3600)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Shortest hex run taken for a content hash in a name (ContentAddressedStorage
+# writes all 64 digits; names from before it carry 16)
+NAME_HASH_LENGTH = 16
+
+# ".<hash>.<ext>" or "/<hash>.<ext>" at the end of a name
+_HASHED_NAME = re.compile(r'(?:^|[./])([0-9a-f]{%d,})\.[A-Za-z0-9]+$' % NAME_HASH_LENGTH)
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def content_hash(name):
+    """The content hash in a stored file's name, or None for unhashed names."""
+    match = _HASHED_NAME.search(name)
+    return match.group(1) if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that keeps each distinct file once, named by the
+    SHA-256 of its bytes: images/ab/ab12...ef.jpeg. Only the extension of
+    the requested name is kept. The upload is hashed while it is written
+    to a temporary file, which is then moved into place unless the same
+    bytes are already stored, in which case that file's mtime is renewed.
+    Several rows can therefore share a name; sweep() deletes the files
+    nothing refers to.
+    """
+    directory = 'images'
+
+    def get_available_name(self, name, max_length=None):
+        # The final name depends on the content and is picked in _save()
+        return name
+
+    @contextmanager
+    def _locked(self):
+        # Serialises placing a file with sweep()'s check-and-delete, across
+        # processes sharing MEDIA_ROOT
+        path = self.path(f'{self.directory}/.lock')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as fh:
+            locks.lock(fh, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(fh)
+
+    def _save(self, name, content):
+        ext = os.path.splitext(name)[1].lower()
+        tmp_dir = self.path(f'{self.directory}/tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    fh.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            hexdigest = digest.hexdigest()
+            name = f'{self.directory}/{hexdigest[:2]}/{hexdigest}{ext}'
+            full_path = self.path(name)
+            with self._locked():
+                if os.path.exists(full_path):
+                    # The row referring to it isn't committed yet; a fresh
+                    # mtime keeps sweep() off the file meanwhile
+                    os.utime(full_path)
+                else:
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(tmp_path, full_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return name
+
+    def sweep(self, in_use, grace):
+        """
+        Delete the files under `directory` for which `in_use(name)` is false
+        and that haven't been written or reused for `grace` seconds (longer
+        than any transaction saving a notification). Returns the deleted
+        names. Interrupted uploads left in tmp/ go the same way.
+        """
+        cutoff = time.time() - grace
+        deleted = []
+        for root, _, files in os.walk(self.path(self.directory)):
+            for filename in files:
+                full_path = os.path.join(root, filename)
+                name = os.path.relpath(full_path, self.location).replace(os.sep, '/')
+                if name == f'{self.directory}/.lock':
+                    continue
+                with self._locked():
+                    try:
+                        if os.stat(full_path).st_mtime >= cutoff:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    if name.startswith(f'{self.directory}/tmp/') or not in_use(name):
+                        os.remove(full_path)
+                        deleted.append(name)
+        return deleted
+
+
+def _byte_range(header, size):
+    """(start, end) inclusive for a single satisfiable range, None to send everything, False if unsatisfiable."""
+    match = _RANGE.match(header.replace(' ', ''))
+    if not match or match.group(1) == match.group(2) == '':
+        # Several ranges or a malformed header: the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def serve_media(request, path):
+    """GET/HEAD of a file under MEDIA_ROOT."""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        info = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404('No such file')
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404('No such file')
+
+    digest = content_hash(path)
+    etag = f'"{digest}"' if digest else f'"{info.st_size:x}-{info.st_mtime_ns:x}"'
+    if digest:
+        cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = f'public, max-age={MEDIA_MAX_AGE}'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(info.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(info.st_mtime))
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if MEDIA_OFFLOAD == 'x-accel-redirect':
+        # nginx serves ranges and conditional requests for the file itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + quote(path)
+    elif MEDIA_OFFLOAD == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = _file_response(request, full_path, info.st_size, etag, content_type)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def _file_response(request, full_path, size, etag, content_type):
+    byte_range = None
+    range_header = request.headers.get('Range')
+    # A Range is only honoured for the version the client already has part of
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        byte_range = _byte_range(range_header, size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        return FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+    start, end = byte_range
+    if end == size - 1:
+        # Open-ended: a FileResponse from the offset, still sent with sendfile()
+        fh = open(full_path, 'rb')
+        fh.seek(start)
+        response = FileResponse(fh, content_type=content_type, status=206)
+    else:
+        with open(full_path, 'rb') as fh:
+            fh.seek(start)
+            response = HttpResponse(fh.read(end - start + 1), content_type=content_type, status=206)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -0,0 +1,182 @@
+"""
+In-process request metrics in the Prometheus text exposition format.
+
+Each worker keeps fixed-size counters: a latency histogram with static
+buckets, request/error counts and DB time per view, and hit/miss counts
+per cache namespace. Recording is a lock and a few integer increments.
+
+With NOVALIB_METRICS_DIR set, every worker writes its counters to its own
+file in that directory at most every NOVALIB_METRICS_FLUSH_INTERVAL seconds, and
+the /metrics/ endpoint sums all the files, so a scrape sees the whole
+pool. Files are named by pid and start time, so a restarted worker never
+overwrites its predecessor's totals; clear the directory on deploy.
+Without it, the endpoint reports the worker that serves the scrape.
+
+p99 alerting is done in Prometheus from the buckets, e.g.
+histogram_quantile(0.99, sum by (le) (rate(novalib_request_duration_seconds_bucket{view="send_otp"}[5m])))
+"""
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds in seconds; +Inf is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Label values come from URL names, so this only guards against surprises
+MAX_VIEWS = 500
+OTHER_VIEW = '<other>'
+
+_lock = threading.Lock()
+# view -> [bucket counts..., +Inf count, requests, errors, latency sum, db time sum]
+_views = {}
+# namespace -> [hits, misses]
+_caches = {}
+_worker_id = f'{os.getpid()}-{time.time_ns()}'
+_last_flush = [time.monotonic()]
+
+_N = len(LATENCY_BUCKETS) + 1
+_REQUESTS, _ERRORS, _SUM, _DB = _N, _N + 1, _N + 2, _N + 3
+
+
+def observe_request(view, seconds, status, db_seconds=0.0):
+    """Record one request for `view` (a URL name)."""
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        row = _views.get(view)
+        if row is None:
+            if len(_views) >= MAX_VIEWS:
+                view = OTHER_VIEW
+            row = _views.setdefault(view, [0] * _N + [0, 0, 0.0, 0.0])
+        row[index] += 1
+        row[_REQUESTS] += 1
+        if status >= 500:
+            row[_ERRORS] += 1
+        row[_SUM] += seconds
+        row[_DB] += db_seconds
+    _maybe_flush()
+
+
+def record_cache(namespace, hit):
+    """Count a cache lookup in `namespace` as a hit or a miss."""
+    with _lock:
+        row = _caches.setdefault(namespace, [0, 0])
+        row[0 if hit else 1] += 1
+
+
+def local_snapshot():
+    with _lock:
+        return {
+            'views': {view: list(row) for view, row in _views.items()},
+            'caches': {namespace: list(row) for namespace, row in _caches.items()},
+        }
+
+
+def metrics_dir():
+    return getattr(settings, 'NOVALIB_METRICS_DIR', None)
+
+
+def flush_interval():
+    return getattr(settings, 'NOVALIB_METRICS_FLUSH_INTERVAL', 10)
+
+
+def _write_snapshot(directory):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'worker-{_worker_id}.json')
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as fh:
+        json.dump(local_snapshot(), fh)
+    # Readers only ever see a complete file
+    os.replace(tmp, path)
+
+
+def _maybe_flush():
+    directory = metrics_dir()
+    if not directory:
+        return
+    stamp = time.monotonic()
+    if stamp - _last_flush[0] < flush_interval():
+        return
+    _last_flush[0] = stamp
+    try:
+        _write_snapshot(directory)
+    except OSError:
+        # Metrics must never fail a request
+        pass
+
+
+def _merge(total, part):
+    for key in ('views', 'caches'):
+        for name, row in part.get(key, {}).items():
+            current = total[key].get(name)
+            if current is None:
+                total[key][name] = list(row)
+            else:
+                for i, value in enumerate(row):
+                    current[i] += value
+
+
+def collect():
+    """Counters of every worker (or just this one without NOVALIB_METRICS_DIR)."""
+    directory = metrics_dir()
+    if not directory:
+        return local_snapshot()
+    _write_snapshot(directory)
+    total = {'views': {}, 'caches': {}}
+    for path in glob.glob(os.path.join(directory, 'worker-*.json')):
+        try:
+            with open(path) as fh:
+                _merge(total, json.load(fh))
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(snapshot):
+    """Prometheus text exposition (format 0.0.4) of a snapshot."""
+    lines = [
+        '# HELP novalib_request_duration_seconds Request latency by view.',
+        '# TYPE novalib_request_duration_seconds histogram',
+    ]
+    views = sorted(snapshot['views'].items())
+    for view, row in views:
+        label = _label(view)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), row[:_N]):
+            cumulative += count
+            lines.append(f'novalib_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'novalib_request_duration_seconds_sum{{view="{label}"}} {row[_SUM]:.6f}')
+        lines.append(f'novalib_request_duration_seconds_count{{view="{label}"}} {row[_REQUESTS]}')
+
+    for name, index, kind, help_text in (
+        ('novalib_requests_total', _REQUESTS, 'counter', 'Requests by view.'),
+        ('novalib_request_errors_total', _ERRORS, 'counter', 'Responses with a 5xx status by view.'),
+        ('novalib_request_db_seconds_total', _DB, 'counter', 'Time spent in database queries by view.'),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for view, row in views:
+            value = f'{row[index]:.6f}' if isinstance(row[index], float) else row[index]
+            lines.append(f'{name}{{view="{_label(view)}"}} {value}')
+
+    caches = sorted(snapshot['caches'].items())
+    lines.append('# HELP novalib_cache_requests_total Cache lookups by namespace and result.')
+    lines.append('# TYPE novalib_cache_requests_total counter')
+    for namespace, (hits, misses) in caches:
+        label = _label(namespace)
+        lines.append(f'novalib_cache_requests_total{{namespace="{label}",result="hit"}} {hits}')
+        lines.append(f'novalib_cache_requests_total{{namespace="{label}",result="miss"}} {misses}')
+    lines.append('# HELP novalib_cache_hit_ratio Cache hits over lookups since start.')
+    lines.append('# TYPE novalib_cache_hit_ratio gauge')
+    for namespace, (hits, misses) in caches:
+        ratio = hits / (hits + misses) if hits + misses else 0.0
+        lines.append(f'novalib_cache_hit_ratio{{namespace="{_label(namespace)}"}} {ratio:.4f}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,340 @@
+import gzip
+import json
+import logging
+import time
+import zlib
+from contextlib import nullcontext
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from novalib import metrics, profiling
+from novalib.sqlstats import collect_queries, current_stats
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# Compression settings, read when the middleware is created (like Django's
+# own middleware) so override_settings reaches them. Responses smaller than
+# NOVALIB_COMPRESS_MIN_SIZE are sent as-is; the header overhead and CPU
+# cost outweigh the savings. Tune with `manage.py bench_compression`.
+def compress_min_size():
+    return getattr(settings, 'NOVALIB_COMPRESS_MIN_SIZE', 860)
+
+
+def compress_content_types():
+    return getattr(settings, 'NOVALIB_COMPRESS_CONTENT_TYPES', ('application/json',))
+
+
+def gzip_level():
+    return getattr(settings, 'NOVALIB_GZIP_LEVEL', 6)
+
+
+def brotli_quality():
+    return getattr(settings, 'NOVALIB_BROTLI_QUALITY', 5)
+
+
+sql_logger = logging.getLogger('novalib.sql')
+
+
+def accepted_encodings(header):
+    """Parse Accept-Encoding into {coding: q}, dropping codings with q=0."""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header):
+    """Best coding we can produce for this Accept-Encoding, or None."""
+    accepted = accepted_encodings(header)
+    candidates = []
+    if brotli is not None and 'br' in accepted:
+        candidates.append((accepted['br'], 1, 'br'))
+    if 'gzip' in accepted:
+        candidates.append((accepted['gzip'], 0, 'gzip'))
+    if not candidates:
+        return None
+    # Highest q wins; brotli breaks ties because it compresses JSON better
+    return max(candidates)[2]
+
+
+def compress(data, encoding, level=None):
+    """`data` compressed with `encoding`; `level` defaults to the configured one."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality() if level is None else level)
+    return gzip.compress(data, compresslevel=gzip_level() if level is None else level, mtime=0)
+
+
+def _gzip_sequence(sequence, level):
+    # wbits=31 writes a gzip header/trailer; flush per chunk so streamed
+    # rows reach the client as they are produced
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in sequence:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def _agzip_sequence(sequence, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in sequence:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def _brotli_sequence(sequence, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in sequence:
+        yield compressor.process(chunk) + compressor.flush()
+    yield compressor.finish()
+
+
+async def _abrotli_sequence(sequence, quality):
+    compressor = brotli.Compressor(quality=quality)
+    async for chunk in sequence:
+        yield compressor.process(chunk) + compressor.flush()
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Negotiated gzip/brotli compression for JSON API responses.
+
+    Plain responses are compressed when they are at least
+    NOVALIB_COMPRESS_MIN_SIZE bytes and compression actually makes them
+    smaller. Streaming responses (sync or async iterators) are compressed
+    chunk by chunk because their size isn't known up front.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = compress_min_size()
+        self.content_types = compress_content_types()
+        self.levels = {'gzip': gzip_level(), 'br': brotli_quality()}
+        # Native async under ASGI so async views don't hop to a thread here
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in self.content_types:
+            return response
+
+        # The body depends on Accept-Encoding from here on, compressed or not
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                wrap = _abrotli_sequence if encoding == 'br' else _agzip_sequence
+            else:
+                wrap = _brotli_sequence if encoding == 'br' else _gzip_sequence
+            response.streaming_content = wrap(response.streaming_content, self.levels[encoding])
+            del response['Content-Length']
+        else:
+            if len(response.content) < self.min_size:
+                return response
+            compressed = compress(response.content, encoding, self.levels[encoding])
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # A strong ETag would claim the compressed bytes equal the original
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class QueryStatsMiddleware:
+    """
+    Per-request query count, DB time and N+1 detection (see novalib.sqlstats).
+
+    With NOVALIB_QUERY_STATS_HEADERS (default: DEBUG) the numbers are
+    returned as X-DB-* headers. Requests showing an N+1 pattern, taking
+    NOVALIB_SLOW_REQUEST_MS or running NOVALIB_SLOW_REQUEST_QUERIES are
+    always logged as one JSON line to the `novalib.sql` logger. Queries run while a streaming body is consumed
+    happen after the response is returned and aren't counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'NOVALIB_SLOW_REQUEST_MS', 500)
+        self.slow_queries = getattr(settings, 'NOVALIB_SLOW_REQUEST_QUERIES', 50)
+        self.headers = getattr(settings, 'NOVALIB_QUERY_STATS_HEADERS', settings.DEBUG)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with collect_queries() as stats:
+            response = self.get_response(request)
+        return self.process_response(request, response, stats)
+
+    async def __acall__(self, request):
+        with collect_queries() as stats:
+            response = await self.get_response(request)
+        return self.process_response(request, response, stats)
+
+    def process_response(self, request, response, stats):
+        summary = stats.summary()
+        n_plus_one = summary['n_plus_one']
+        if self.headers:
+            response.headers['X-DB-Queries'] = str(summary['queries'])
+            response.headers['X-DB-Time-Ms'] = str(summary['db_time_ms'])
+            response.headers['X-DB-Repeated-Queries'] = str(summary['repeated_queries'])
+            if n_plus_one:
+                response.headers['X-DB-N-Plus-One'] = '; '.join(
+                    f"{item['count']}x {item['site'] or item['sql'][:80]}" for item in n_plus_one
+                ).encode('ascii', 'replace').decode('ascii')
+        if (n_plus_one or summary['duration_ms'] >= self.slow_ms
+                or summary['queries'] >= self.slow_queries):
+            record = {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'view': getattr(getattr(request, 'resolver_match', None), 'view_name', None),
+                **summary,
+            }
+            sql_logger.warning(json.dumps(record, default=str), extra={'sql_stats': record})
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Feeds novalib.metrics: latency, status and DB time per URL name.
+    Sits inside QueryStatsMiddleware so it can read that request's DB time.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start)
+        return response
+
+    def observe(self, request, response, seconds):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unmatched>'
+        stats = current_stats()
+        metrics.observe_request(view, seconds, response.status_code, stats.db_time if stats else 0.0)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests that ask for it (see novalib.profiling) and tags the
+    response with X-Novalib-Profile-Id. Must come after
+    AuthenticationMiddleware, which the staff check needs. Under ASGI the
+    profiler covers the event loop thread, so coroutines of other requests
+    that run meanwhile show up too, and ORM work in the thread pool only
+    appears in the SQL timeline.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        user = request.user if profiling.profile_requested(request) else None
+        if not profiling.wants_profile(request, user):
+            return self.get_response(request)
+        with self.query_stats() as stats:
+            stats.timeline = []
+            profiler = profiling.RequestProfiler(root_code=ProfilingMiddleware.__call__.__code__)
+            start = time.perf_counter()
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+            duration = time.perf_counter() - start
+        return self.save(request, response, profiler, duration, stats, user)
+
+    async def __acall__(self, request):
+        # request.user would load the session user synchronously on the event loop
+        user = await request.auser() if profiling.profile_requested(request) else None
+        if not profiling.wants_profile(request, user):
+            return await self.get_response(request)
+        with self.query_stats() as stats:
+            stats.timeline = []
+            profiler = profiling.RequestProfiler(root_code=ProfilingMiddleware.__acall__.__code__)
+            start = time.perf_counter()
+            profiler.start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.stop()
+            duration = time.perf_counter() - start
+        # Summarising the profile and the cache writes stay off the event loop
+        return await sync_to_async(self.save)(request, response, profiler, duration, stats, user)
+
+    def query_stats(self):
+        # Reuse QueryStatsMiddleware's collector when it is installed
+        stats = current_stats()
+        if stats is None:
+            return collect_queries()
+        return nullcontext(stats)
+
+    def save(self, request, response, profiler, duration, stats, user):
+        response.headers['X-Novalib-Profile-Id'] = profiling.save_profile(request, response, profiler, duration, stats, user)
+        return response
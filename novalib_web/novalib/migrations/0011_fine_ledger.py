@@ -0,0 +1,119 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_fine_ledger(apps, schema_editor):
+    # Seed one charge per existing ReturnDesk fine, then materialize balances
+    ReturnDesk = apps.get_model("novalib", "ReturnDesk")
+    FineLedgerEntry = apps.get_model("novalib", "FineLedgerEntry")
+    FineBalance = apps.get_model("novalib", "FineBalance")
+
+    entries = []
+    for row in ReturnDesk.objects.exclude(fine=0).values("id", "student_id", "fine", "book").iterator(chunk_size=2000):
+        entries.append(
+            FineLedgerEntry(
+                user_id=row["student_id"],
+                kind="charge",
+                amount=row["fine"],
+                return_desk_id=row["id"],
+                note=f"Return desk: {row['book']}"[:255],
+            )
+        )
+        if len(entries) >= 2000:
+            FineLedgerEntry.objects.bulk_create(entries)
+            entries = []
+    FineLedgerEntry.objects.bulk_create(entries)
+
+    totals = FineLedgerEntry.objects.values("user_id").annotate(total=Sum("amount"))
+    FineBalance.objects.bulk_create(
+        [FineBalance(user_id=t["user_id"], balance=t["total"]) for t in totals],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0010_booksdetail_user"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FineBalance",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="fine_balance",
+                        serialize=False,
+                        to="novalib.user",
+                    ),
+                ),
+                (
+                    "balance",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "db_table": "fine_balance",
+            },
+        ),
+        migrations.CreateModel(
+            name="FineLedgerEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("charge", "Charge"), ("payment", "Payment")],
+                        max_length=10,
+                    ),
+                ),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("note", models.CharField(blank=True, max_length=255)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "return_desk",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="fine_entries",
+                        to="novalib.returndesk",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="fine_entries",
+                        to="novalib.user",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "fine_ledger",
+                "indexes": [
+                    models.Index(
+                        fields=["user", "created_at"], name="fine_ledger_user_created"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_fine_ledger, migrations.RunPython.noop),
+    ]
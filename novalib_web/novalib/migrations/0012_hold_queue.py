@@ -0,0 +1,125 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_holds_from_wishlist(apps, schema_editor):
+    # Existing wishlist links become waiting holds, queued in link order per title
+    BooksLog = apps.get_model("novalib", "BooksLog")
+    HoldRequest = apps.get_model("novalib", "HoldRequest")
+    Through = BooksLog.wishlist.through
+
+    positions = {}
+    seen = set()
+    holds = []
+    links = Through.objects.order_by("id").values_list("user_id", "bookslog__book_title", "bookslog__auther")
+    for user_id, title, author in links.iterator(chunk_size=2000):
+        key = (title, author)
+        if (user_id, key) in seen:
+            continue
+        seen.add((user_id, key))
+        positions[key] = positions.get(key, 0) + 1
+        holds.append(
+            HoldRequest(user_id=user_id, book_title=title, auther=author, position=positions[key])
+        )
+        if len(holds) >= 2000:
+            HoldRequest.objects.bulk_create(holds)
+            holds = []
+    HoldRequest.objects.bulk_create(holds)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0011_fine_ledger"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booksdetail",
+            name="reserved_for",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="reserved_copies",
+                to="novalib.user",
+            ),
+        ),
+        migrations.CreateModel(
+            name="HoldRequest",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("book_title", models.CharField(max_length=255)),
+                ("auther", models.CharField(max_length=255)),
+                ("position", models.PositiveBigIntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("waiting", "Waiting"),
+                            ("ready", "Ready for pickup"),
+                            ("fulfilled", "Fulfilled"),
+                            ("expired", "Expired"),
+                            ("cancelled", "Cancelled"),
+                        ],
+                        default="waiting",
+                        max_length=10,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("ready_at", models.DateTimeField(blank=True, null=True)),
+                ("expires_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "copy",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="holds",
+                        to="novalib.booksdetail",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="holds",
+                        to="novalib.user",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "hold_queue",
+                "indexes": [
+                    models.Index(
+                        fields=["book_title", "auther", "status", "position"],
+                        name="hold_queue_title_status_pos",
+                    ),
+                    models.Index(
+                        fields=["status", "expires_at"], name="hold_queue_status_expiry"
+                    ),
+                    models.Index(
+                        fields=["user", "status"], name="hold_queue_user_status"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("book_title", "auther", "position"),
+                        name="hold_queue_unique_position",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_holds_from_wishlist, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0012_hold_queue"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="developer_notifications_seen_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="notifications_seen_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
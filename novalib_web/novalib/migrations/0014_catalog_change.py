@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0013_user_notifications_seen_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("book_title", models.CharField(max_length=255)),
+                ("auther", models.CharField(max_length=255)),
+                (
+                    "changed_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "catalog_change",
+            },
+        ),
+    ]
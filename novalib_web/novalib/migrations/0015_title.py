@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def link_titles(apps, schema_editor):
+    # One Title per distinct (book_title, auther), then point every BooksLog
+    # and BooksDetail row at its Title one primary-key range at a time, so
+    # no statement touches more than BATCH_SIZE rows
+    Title = apps.get_model("novalib", "Title")
+    for model_name in ("BooksLog", "BooksDetail"):
+        model = apps.get_model("novalib", model_name)
+        pairs = model.objects.order_by().values_list("book_title", "auther").distinct()
+        batch = []
+        for book_title, auther in pairs.iterator(chunk_size=BATCH_SIZE):
+            batch.append(Title(book_title=book_title, auther=auther))
+            if len(batch) >= BATCH_SIZE:
+                Title.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        Title.objects.bulk_create(batch, ignore_conflicts=True)
+
+    for model_name in ("BooksLog", "BooksDetail"):
+        model = apps.get_model("novalib", model_name)
+        title_id = Subquery(
+            Title.objects.filter(book_title=OuterRef("book_title"), auther=OuterRef("auther")).values("pk")[:1]
+        )
+        last = model.objects.aggregate(last=Max("pk"))["last"] or 0
+        for start in range(0, last + 1, BATCH_SIZE):
+            model.objects.filter(pk__gte=start, pk__lt=start + BATCH_SIZE).update(title_id=title_id)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0014_catalog_change"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Title",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("book_title", models.CharField(max_length=255)),
+                ("auther", models.CharField(max_length=255)),
+            ],
+            options={
+                "db_table": "book_titles",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("book_title", "auther"), name="book_titles_unique_title"
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="booksdetail",
+            name="title",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="copies",
+                to="novalib.title",
+            ),
+        ),
+        migrations.AddField(
+            model_name="bookslog",
+            name="title",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="log_entries",
+                to="novalib.title",
+            ),
+        ),
+        migrations.RunPython(link_titles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+
+def merge_wishlist_links(apps, schema_editor):
+    # Collapse the per-BooksLog M2M links into one entry per (user, title);
+    # a student linked to several entries of the same title keeps one
+    BooksLog = apps.get_model("novalib", "BooksLog")
+    WishlistEntry = apps.get_model("novalib", "WishlistEntry")
+    links = (BooksLog.wishlist.through.objects
+             .filter(bookslog__title__isnull=False)
+             .order_by("pk")
+             .values_list("user_id", "bookslog__title_id"))
+    batch = []
+    for user_id, title_id in links.iterator(chunk_size=BATCH_SIZE):
+        batch.append(WishlistEntry(user_id=user_id, title_id=title_id))
+        if len(batch) >= BATCH_SIZE:
+            WishlistEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    WishlistEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0015_title"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WishlistEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "title",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="wishlist_entries",
+                        to="novalib.title",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="wishlist_entries",
+                        to="novalib.user",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "wishlist entries",
+                "db_table": "wishlist",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "title"), name="wishlist_unique_user_title"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(merge_wishlist_links, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="bookslog",
+            name="wishlist",
+        ),
+    ]
@@ -0,0 +1,158 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Min
+from django.utils import timezone
+
+BATCH_SIZE = 2000
+
+
+def backfill_from_return_desk(apps, schema_editor):
+    # One return event per ReturnDesk row. The row has no timestamp, so the
+    # time of its first fine charge is used (or now). Titles are (title,
+    # author) pairs and the row only names the book, so the title is set
+    # when exactly one pair has that name. The returned copy isn't recorded
+    # anywhere (whatever the student holds now is a later loan), so copy
+    # stays null
+    ReturnDesk = apps.get_model("novalib", "ReturnDesk")
+    Title = apps.get_model("novalib", "Title")
+    FineLedgerEntry = apps.get_model("novalib", "FineLedgerEntry")
+    CirculationEvent = apps.get_model("novalib", "CirculationEvent")
+
+    stamp = timezone.now()
+    last_id = 0
+    while True:
+        rows = list(ReturnDesk.objects.filter(pk__gt=last_id).order_by("pk")
+                    .values("id", "student_id", "book", "fine")[:BATCH_SIZE])
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        # One Title row per (book_title, auther) pair
+        matches = {}
+        for title_id, book_title in (Title.objects.filter(book_title__in={row["book"] for row in rows})
+                                     .values_list("pk", "book_title")):
+            matches.setdefault(book_title, []).append(title_id)
+        titles = {book_title: ids[0] for book_title, ids in matches.items() if len(ids) == 1}
+        charged = dict(FineLedgerEntry.objects
+                       .filter(return_desk_id__in=[row["id"] for row in rows])
+                       .values_list("return_desk_id")
+                       .annotate(first=Min("created_at")))
+        events = []
+        for row in rows:
+            title_id = titles.get(row["book"])
+            when = charged.get(row["id"], stamp)
+            events.append(CirculationEvent(
+                kind="return",
+                title_id=title_id,
+                user_id=row["student_id"],
+                book_title=row["book"],
+                fine=row["fine"],
+                return_desk_id=row["id"],
+                occurred_at=when,
+                month=timezone.localtime(when).date().replace(day=1),
+            ))
+        CirculationEvent.objects.bulk_create(events)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0016_wishlist_entry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CirculationEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("issue", "Issue"), ("return", "Return")],
+                        max_length=10,
+                    ),
+                ),
+                ("book_title", models.CharField(blank=True, max_length=255)),
+                ("issued_date", models.DateField(blank=True, null=True)),
+                ("return_date", models.DateField(blank=True, null=True)),
+                (
+                    "fine",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "occurred_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("month", models.DateField(editable=False)),
+                (
+                    "copy",
+                    models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="circulation",
+                        to="novalib.booksdetail",
+                    ),
+                ),
+                (
+                    "return_desk",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="circulation_events",
+                        to="novalib.returndesk",
+                    ),
+                ),
+                (
+                    "title",
+                    models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="circulation",
+                        to="novalib.title",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="circulation",
+                        to="novalib.user",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "circulation_event",
+                "indexes": [
+                    models.Index(
+                        fields=["month", "kind"], name="circulation_month_kind"
+                    ),
+                    models.Index(
+                        fields=["title", "month"], name="circulation_title_month"
+                    ),
+                    models.Index(
+                        fields=["copy", "occurred_at"], name="circulation_copy_time"
+                    ),
+                    models.Index(
+                        fields=["user", "occurred_at"], name="circulation_user_time"
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_from_return_desk, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0017_circulation_event"),
+    ]
+
+    operations = [
+        # Composite indexes first: on MySQL a foreign key's own index can only
+        # be dropped once another index starting with that column exists
+        migrations.AddIndex(
+            model_name="booksdetail",
+            index=models.Index(
+                fields=["user", "avalible"], name="booksdetail_user_avalible"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="booksdetail",
+            index=models.Index(
+                fields=["title", "user", "avalible"],
+                name="booksdetail_title_user_avail",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="login",
+            index=models.Index(fields=["user", "login_time"], name="login_user_time"),
+        ),
+        migrations.AlterField(
+            model_name="booksdetail",
+            name="title",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="copies",
+                to="novalib.title",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="booksdetail",
+            name="user",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="book_details",
+                to="novalib.user",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="developernotification",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="login",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="novalib.user",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="email",
+            field=models.EmailField(db_index=True, max_length=254),
+        ),
+    ]
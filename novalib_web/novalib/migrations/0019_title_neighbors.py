@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0018_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TitleNeighbor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("score", models.FloatField()),
+                ("support", models.PositiveIntegerField()),
+                (
+                    "neighbor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="novalib.title",
+                    ),
+                ),
+                (
+                    "title",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbors",
+                        to="novalib.title",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "title_neighbors",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("title", "rank"), name="title_neighbors_unique_rank"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0019_title_neighbors"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="title",
+            name="popularity",
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="title",
+            index=models.Index(
+                fields=["-popularity", "id"], name="book_titles_popularity"
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:05
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_changes(apps, schema_editor):
+    # Existing rows keep their id as version, and the counter continues from there
+    CatalogChange = apps.get_model("novalib", "CatalogChange")
+    CatalogVersion = apps.get_model("novalib", "CatalogVersion")
+    CatalogChange.objects.update(version=F("id"))
+    latest = CatalogChange.objects.aggregate(v=Max("id"))["v"] or 0
+    CatalogVersion.objects.update_or_create(pk=1, defaults={"value": latest})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0020_title_popularity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("value", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "catalog_version",
+            },
+        ),
+        migrations.AddField(
+            model_name="catalogchange",
+            name="version",
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(number_existing_changes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="catalogchange",
+            name="version",
+            field=models.BigIntegerField(unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0021_catalog_version"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="bookslog",
+            name="book_barcode",
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
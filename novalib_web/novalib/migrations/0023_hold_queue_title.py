@@ -0,0 +1,106 @@
+# Generated by Django 5.2.18 on 2026-10-20 01:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def link_hold_titles(apps, schema_editor):
+    # Queues were keyed on (book_title, auther); make sure each pair has a
+    # Title (a hold can outlive the copies that created it), then point the
+    # holds at it one primary-key range at a time
+    Title = apps.get_model("novalib", "Title")
+    HoldRequest = apps.get_model("novalib", "HoldRequest")
+    pairs = HoldRequest.objects.order_by().values_list("book_title", "auther").distinct()
+    batch = []
+    for book_title, auther in pairs.iterator(chunk_size=BATCH_SIZE):
+        batch.append(Title(book_title=book_title, auther=auther))
+        if len(batch) >= BATCH_SIZE:
+            Title.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    Title.objects.bulk_create(batch, ignore_conflicts=True)
+
+    title_id = Subquery(
+        Title.objects.filter(book_title=OuterRef("book_title"), auther=OuterRef("auther")).values("pk")[:1]
+    )
+    last = HoldRequest.objects.aggregate(last=Max("pk"))["last"] or 0
+    for start in range(0, last + 1, BATCH_SIZE):
+        HoldRequest.objects.filter(pk__gte=start, pk__lt=start + BATCH_SIZE).update(title_id=title_id)
+
+
+def unlink_hold_titles(apps, schema_editor):
+    Title = apps.get_model("novalib", "Title")
+    HoldRequest = apps.get_model("novalib", "HoldRequest")
+    for column in ("book_title", "auther"):
+        HoldRequest.objects.update(**{column: Subquery(
+            Title.objects.filter(pk=OuterRef("title_id")).values(column)[:1]
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("novalib", "0022_bookslog_barcode_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="holdrequest",
+            name="title",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="holds",
+                to="novalib.title",
+            ),
+        ),
+        # Nullable while unused, so migrating back can re-add them before refilling them
+        migrations.AlterField(
+            model_name="holdrequest",
+            name="book_title",
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name="holdrequest",
+            name="auther",
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(link_hold_titles, unlink_hold_titles),
+        migrations.RemoveConstraint(
+            model_name="holdrequest",
+            name="hold_queue_unique_position",
+        ),
+        migrations.RemoveIndex(
+            model_name="holdrequest",
+            name="hold_queue_title_status_pos",
+        ),
+        migrations.AlterField(
+            model_name="holdrequest",
+            name="title",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="holds",
+                to="novalib.title",
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="holdrequest",
+            name="book_title",
+        ),
+        migrations.RemoveField(
+            model_name="holdrequest",
+            name="auther",
+        ),
+        migrations.AddConstraint(
+            model_name="holdrequest",
+            constraint=models.UniqueConstraint(fields=("title", "position"), name="hold_queue_unique_position"),
+        ),
+        migrations.AddIndex(
+            model_name="holdrequest",
+            index=models.Index(fields=["title", "status", "position"], name="hold_queue_title_status_pos"),
+        ),
+    ]
@@ -1,11 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.utils.timezone import now
 from django.conf import settings
 import random
 import string
 import os
-from django.db.models.signals import post_delete
+from decimal import Decimal
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
 
@@ -14,17 +15,49 @@ class User(models.Model):
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=15)
-    email = models.EmailField()
+    email = models.EmailField(db_index=True)
     department = models.ForeignKey('Department', on_delete=models.SET_NULL, null=True, blank=True)
     otp = models.CharField(max_length=7, blank=True, null=True)
     otp_created_at = models.DateTimeField(blank=True, null=True)
+    # Last time the student opened each notification feed (drives unread counts)
+    notifications_seen_at = models.DateTimeField(blank=True, null=True)
+    developer_notifications_seen_at = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.barcode_number})"
 
+class Title(models.Model):
+    """
+    One row per distinct (book_title, auther) pair. BooksLog entries and
+    BooksDetail copies point here, so the copies of a title are found with
+    an indexed integer join instead of comparing both 255-char strings.
+    The string columns stay on those tables as the displayed values and
+    the FK follows them on every save (see assign_title).
+
+    `popularity` is the time-decayed count of loans, wishlist adds and
+    search clicks, kept on the rescaled clock of novalib.popularity; its
+    index lets searches read titles best first and stop at the page size.
+    """
+    book_title = models.CharField(max_length=255)
+    auther = models.CharField(max_length=255)
+    popularity = models.FloatField(default=0, editable=False)
+
+    class Meta:
+        db_table = 'book_titles'
+        constraints = [
+            models.UniqueConstraint(fields=['book_title', 'auther'], name='book_titles_unique_title'),
+        ]
+        indexes = [
+            models.Index(fields=['-popularity', 'id'], name='book_titles_popularity'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_title} ({self.auther})"
+
 class BooksLog(models.Model):
-    book_barcode = models.CharField(max_length=100)
-    wishlist = models.ManyToManyField(User, related_name='wishlist_books', blank=True)  # Changed to ManyToManyField
+    # Indexed: wishlists, search clicks and recommendations resolve titles by it
+    book_barcode = models.CharField(max_length=100, db_index=True)
+    title = models.ForeignKey(Title, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='log_entries')
     book_title = models.CharField(max_length=255)
     auther = models.CharField(max_length=255)
     avalible = models.BooleanField(default=True)
@@ -38,14 +71,39 @@ class BooksLog(models.Model):
         # Removed logic for avalible based on user
         super().save(*args, **kwargs)
 
+class WishlistEntry(models.Model):
+    """
+    A student's interest in a title, stored once per (user, title). The
+    unique index leads with user, so a student's wishlist is one range scan
+    of it (see novalib.wishlists).
+    """
+    # The unique index below covers lookups by user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wishlist_entries', db_index=False)
+    title = models.ForeignKey(Title, on_delete=models.CASCADE, related_name='wishlist_entries')
+    created_at = models.DateTimeField(default=now)
+
+    class Meta:
+        db_table = 'wishlist'
+        verbose_name_plural = 'wishlist entries'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'title'], name='wishlist_unique_user_title'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.title}"
+
 class Login(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # (user, login_time) below serves both the FK and latest('login_time')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     login_time = models.DateTimeField(default=now)
     ip_address = models.GenericIPAddressField()
     authorized = models.BooleanField(default=False)  # Ensure this field exists
 
     class Meta:
         db_table = 'login'
+        indexes = [
+            models.Index(fields=['user', 'login_time'], name='login_user_time'),
+        ]
 
     def __str__(self):
         return f"Login: {self.user.barcode_number} at {self.login_time}"
@@ -63,6 +121,34 @@ class ReturnDesk(models.Model):
     def __str__(self):
         return f"{self.student.barcode_number} - {self.student.first_name} {self.student.last_name} - {self.book}"
 
+    def save(self, *args, **kwargs):
+        # Keep the fine ledger in step with this row: post the change in fine
+        # (or move it between students) in the same transaction as the save.
+        from novalib.circulation import record_desk_return
+        from novalib.fines import record_fine_charge
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = ReturnDesk.objects.filter(pk=self.pk).values('student_id', 'fine').first()
+            super().save(*args, **kwargs)
+            fine = Decimal(self.fine or 0)
+            if previous and previous['student_id'] != self.student_id:
+                if previous['fine']:
+                    record_fine_charge(previous['student_id'], -previous['fine'], self, note='Return desk fine moved')
+                previous = None
+            delta = fine - (previous['fine'] if previous else 0)
+            if delta:
+                record_fine_charge(self.student_id, delta, self, note=f'Return desk: {self.book}'[:255])
+            record_desk_return(self)
+
+@receiver(post_delete, sender=ReturnDesk)
+def reverse_return_desk_fine(sender, instance, origin=None, **kwargs):
+    # Skip when the student themselves is being deleted; their ledger goes too
+    if isinstance(origin, User) or not instance.fine:
+        return
+    from novalib.fines import record_fine_charge
+    record_fine_charge(instance.student_id, -Decimal(instance.fine), note=f'Return desk removed: {instance.book}'[:255])
+
 class Department(models.Model):
     name = models.CharField(max_length=100, unique=True)
 
@@ -73,7 +159,8 @@ class Department(models.Model):
         return self.name
 
 def notification_image_upload_path(instance, filename):
-    # Use .jpeg extension regardless of original file extension
+    # Use .jpeg extension regardless of original file extension. The default
+    # storage keeps only the extension and names the file by its content
     notification_id = instance.notification_id or 'temp'
     return f'notifications/{notification_id}.jpeg'
 
@@ -85,7 +172,7 @@ class Notification(models.Model):
     )
     message = models.TextField()
     uploaded_image = models.ImageField(upload_to=notification_image_upload_path, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return self.title
@@ -100,20 +187,18 @@ class Notification(models.Model):
                 if not Notification.objects.filter(notification_id=new_id).exists():
                     self.notification_id = new_id
                     break
-        # If the uploaded_image exists and its name does not match the notification_id, re-save it
-        if self.uploaded_image and self.uploaded_image.name != f'notifications/{self.notification_id}.jpeg':
-            from django.core.files.base import ContentFile
-            img_content = self.uploaded_image.read()
-            self.uploaded_image.save(f'{self.notification_id}.jpeg', ContentFile(img_content), save=False)
         super().save(*args, **kwargs)
 
-@receiver(post_delete, sender=Notification)
-def delete_notification_image(sender, instance, **kwargs):
-    if instance.uploaded_image and instance.uploaded_image.storage.exists(instance.uploaded_image.name):
-        instance.uploaded_image.delete(save=False)
+def image_in_use(name):
+    """
+    Whether a notification of either kind refers to the stored image `name`.
+    Identical uploads share one file (novalib.media.ContentAddressedStorage),
+    so files are only deleted by `manage.py sweep_media`, never with a row.
+    """
+    return any(model.objects.filter(uploaded_image=name).exists() for model in (Notification, DeveloperNotification))
 
 def developer_notification_image_upload_path(instance, filename):
-    # Use .jpeg extension regardless of original file extension
+    # Use .jpeg extension regardless of original file extension (see notification_image_upload_path)
     notification_id = instance.notification_id or 'temp'
     return f'developer_notifications/{notification_id}.jpeg'
 
@@ -125,7 +210,7 @@ class DeveloperNotification(models.Model):
     )
     message = models.TextField()
     uploaded_image = models.ImageField(upload_to=developer_notification_image_upload_path, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return self.title
@@ -140,26 +225,325 @@ class DeveloperNotification(models.Model):
                 if not DeveloperNotification.objects.filter(notification_id=new_id).exists():
                     self.notification_id = new_id
                     break
-        # If the uploaded_image exists and its name does not match the notification_id, re-save it
-        if self.uploaded_image and self.uploaded_image.name != f'developer_notifications/{self.notification_id}.jpeg':
-            from django.core.files.base import ContentFile
-            img_content = self.uploaded_image.read()
-            self.uploaded_image.save(f'{self.notification_id}.jpeg', ContentFile(img_content), save=False)
         super().save(*args, **kwargs)
 
-@receiver(post_delete, sender=DeveloperNotification)
-def delete_developer_notification_image(sender, instance, **kwargs):
-    if instance.uploaded_image and instance.uploaded_image.storage.exists(instance.uploaded_image.name):
-        instance.uploaded_image.delete(save=False)
-
 class BooksDetail(models.Model):
     book_barcode = models.CharField(max_length=100, unique=True)
+    # The composite indexes in Meta lead with title and user, and cover both FKs
+    title = models.ForeignKey(Title, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='copies', db_index=False)
     book_title = models.CharField(max_length=255)
     auther = models.CharField(max_length=255)
     avalible = models.BooleanField(default=True)
     issued_date = models.DateField(null=True, blank=True)
     return_date = models.DateField(null=True, blank=True)
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='book_details')  # added user FK
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='book_details', db_index=False)  # added user FK
+    reserved_for = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='reserved_copies')
+
+    class Meta:
+        indexes = [
+            # A student's issued copies
+            models.Index(fields=['user', 'avalible'], name='booksdetail_user_avalible'),
+            # Copy and shelf counts per title
+            models.Index(fields=['title', 'user', 'avalible'], name='booksdetail_title_user_avail'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_title} ({self.book_barcode})"
+
+    def save(self, *args, **kwargs):
+        # A copy going from "issued to someone" to "no user" is a return: hand
+        # it to the next hold in the title's queue within the same transaction.
+        # Every change of hands is also written to the circulation history.
+        from novalib.circulation import record_issue, record_return
+        from novalib.holds import allocate_copy, fulfil_hold
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = BooksDetail.objects.filter(pk=self.pk).values('user_id', 'issued_date').first()
+            previous_user_id = previous['user_id'] if previous else None
+            super().save(*args, **kwargs)
+            if previous_user_id != self.user_id:
+                if previous_user_id:
+                    record_return(self, previous_user_id, previous['issued_date'])
+                if self.user_id:
+                    record_issue(self)
+            if previous_user_id and not self.user_id:
+                allocate_copy(self)
+            elif self.user_id and self.reserved_for_id == self.user_id:
+                fulfil_hold(self)
+
+class HoldRequest(models.Model):
+    """
+    A student's place in the FIFO queue for a title. `position` only ever
+    grows per title, so the head of the queue is the lowest waiting
+    position and is found through the composite index.
+    """
+    WAITING = 'waiting'
+    READY = 'ready'
+    FULFILLED = 'fulfilled'
+    EXPIRED = 'expired'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (EXPIRED, 'Expired'),
+        (CANCELLED, 'Cancelled'),
+    ]
+    ACTIVE_STATUSES = (WAITING, READY)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+    # The composite indexes in Meta lead with title and cover the FK
+    title = models.ForeignKey(Title, on_delete=models.CASCADE, related_name='holds', db_index=False)
+    position = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    copy = models.ForeignKey('BooksDetail', on_delete=models.SET_NULL, null=True, blank=True, related_name='holds')
+    created_at = models.DateTimeField(default=now)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'hold_queue'
+        constraints = [
+            models.UniqueConstraint(fields=['title', 'position'], name='hold_queue_unique_position'),
+        ]
+        indexes = [
+            models.Index(fields=['title', 'status', 'position'], name='hold_queue_title_status_pos'),
+            models.Index(fields=['status', 'expires_at'], name='hold_queue_status_expiry'),
+            models.Index(fields=['user', 'status'], name='hold_queue_user_status'),
+        ]
+
+    def __str__(self):
+        return f"{self.title_id} #{self.position} - {self.user_id} ({self.status})"
+
+
+class FineLedgerEntry(models.Model):
+    """Append-only record of every change to a student's fine balance.
+
+    Charges are stored as positive amounts and payments as negative amounts,
+    so a student's balance is always the sum of their entries.
+    """
+    CHARGE = 'charge'
+    PAYMENT = 'payment'
+    KIND_CHOICES = [
+        (CHARGE, 'Charge'),
+        (PAYMENT, 'Payment'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='fine_entries')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    return_desk = models.ForeignKey(ReturnDesk, on_delete=models.SET_NULL, null=True, blank=True, related_name='fine_entries')
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=now)
+
+    class Meta:
+        db_table = 'fine_ledger'
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='fine_ledger_user_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.kind} {self.amount}"
+
+    def save(self, *args, **kwargs):
+        # Ledger rows are never edited once written; corrections are new entries
+        if self.pk and not kwargs.get('force_insert'):
+            raise ValueError("Fine ledger entries are append-only")
+        super().save(*args, **kwargs)
+
+
+class FineBalance(models.Model):
+    """Materialized running total of a student's fine ledger (keyed by user)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='fine_balance')
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(default=now)
+
+    class Meta:
+        db_table = 'fine_balance'
+
+    def __str__(self):
+        return f"{self.user_id}: {self.balance}"
+
+
+class CirculationEvent(models.Model):
+    """
+    Issue and return history of copies. `month` is the first day of the
+    month the event happened in; it leads the reporting index, so a month's
+    activity is a range scan. Copy, title and student histories each have
+    their own (key, occurred_at) index. Returns taken at the return desk
+    carry the desk row and its fine.
+    """
+    ISSUE = 'issue'
+    RETURN = 'return'
+    KIND_CHOICES = [
+        (ISSUE, 'Issue'),
+        (RETURN, 'Return'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # The composite indexes below cover lookups by copy, title and user
+    copy = models.ForeignKey(BooksDetail, on_delete=models.SET_NULL, null=True, blank=True, related_name='circulation', db_index=False)
+    title = models.ForeignKey(Title, on_delete=models.SET_NULL, null=True, blank=True, related_name='circulation', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='circulation', db_index=False)
+    # Title as recorded at the time, for rows whose copy or title is gone
+    book_title = models.CharField(max_length=255, blank=True)
+    issued_date = models.DateField(null=True, blank=True)
+    return_date = models.DateField(null=True, blank=True)
+    fine = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    return_desk = models.ForeignKey(ReturnDesk, on_delete=models.CASCADE, null=True, blank=True, related_name='circulation_events')
+    occurred_at = models.DateTimeField(default=now)
+    month = models.DateField(editable=False)
+
+    class Meta:
+        db_table = 'circulation_event'
+        indexes = [
+            models.Index(fields=['month', 'kind'], name='circulation_month_kind'),
+            models.Index(fields=['title', 'month'], name='circulation_title_month'),
+            models.Index(fields=['copy', 'occurred_at'], name='circulation_copy_time'),
+            models.Index(fields=['user', 'occurred_at'], name='circulation_user_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.book_title} - {self.user_id} ({self.occurred_at:%Y-%m-%d})"
+
+    def save(self, *args, **kwargs):
+        from novalib.circulation import month_start
+        self.month = month_start(self.occurred_at)
+        super().save(*args, **kwargs)
+
+
+class TitleNeighbor(models.Model):
+    """
+    "Students who wanted this also wanted": the top neighbours of a title
+    by co-wishlist and co-loan similarity, ranked from 0. Rebuilt in full
+    by `manage.py build_recommendations` (novalib.recommendations); the
+    unique (title, rank) index makes a title's list one ordered range scan.
+    """
+    # The unique index below covers lookups by title
+    title = models.ForeignKey(Title, on_delete=models.CASCADE, related_name='neighbors', db_index=False)
+    neighbor = models.ForeignKey(Title, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    # Cosine similarity of the two titles' student sets
+    score = models.FloatField()
+    # Students who wanted or borrowed both
+    support = models.PositiveIntegerField()
+
+    class Meta:
+        db_table = 'title_neighbors'
+        constraints = [
+            models.UniqueConstraint(fields=['title', 'rank'], name='title_neighbors_unique_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.title_id} #{self.rank}: {self.neighbor_id} ({self.score:.3f})"
+
+
+class CatalogChange(models.Model):
+    """
+    Change log behind the offline catalog sync: one row each time a title's
+    catalog entry or availability may have changed. `version` is the
+    catalog version clients sync from, taken from CatalogVersion.
+    """
+    version = models.BigIntegerField(unique=True)
+    book_title = models.CharField(max_length=255)
+    auther = models.CharField(max_length=255)
+    changed_at = models.DateTimeField(default=now, db_index=True)
+
+    class Meta:
+        db_table = 'catalog_change'
+
+    def __str__(self):
+        return f"v{self.version}: {self.book_title} ({self.auther})"
+
+class CatalogVersion(models.Model):
+    """
+    The latest catalog version, in a single row (pk=1). Bumping it locks
+    the row until the bumping transaction ends, so versions become visible
+    in the order they are handed out (see novalib.catalog).
+    """
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'catalog_version'
 
     def __str__(self):
-        return f"{self.book_title} ({self.book_barcode})"
\ No newline at end of file
+        return f"v{self.value}"
+
+@receiver(pre_save, sender=BooksLog)
+@receiver(pre_save, sender=BooksDetail)
+def remember_catalog_title(sender, instance, raw=False, **kwargs):
+    # Keep the title the row had before saving, so a rename logs both keys
+    instance._catalog_previous = None
+    if instance.pk and not raw:
+        instance._catalog_previous = (sender.objects
+                                      .filter(pk=instance.pk)
+                                      .values_list('book_title', 'auther')
+                                      .first())
+
+@receiver(pre_save, sender=BooksLog)
+@receiver(pre_save, sender=BooksDetail)
+def assign_title(sender, instance, raw=False, **kwargs):
+    # Runs after remember_catalog_title, so a row whose title and author
+    # didn't change keeps its Title without another query
+    if raw:
+        return
+    key = (instance.book_title, instance.auther)
+    if instance.title_id:
+        cached = sender._meta.get_field('title').get_cached_value(instance, None)
+        if key == getattr(instance, '_catalog_previous', None) or (cached and key == (cached.book_title, cached.auther)):
+            return
+    instance.title, _ = Title.objects.get_or_create(book_title=key[0], auther=key[1])
+
+@receiver(post_save, sender=BooksLog)
+@receiver(post_save, sender=BooksDetail)
+@receiver(post_delete, sender=BooksLog)
+@receiver(post_delete, sender=BooksDetail)
+def log_catalog_change(sender, instance, **kwargs):
+    from novalib.catalog import record_catalog_change
+    keys = {(instance.book_title, instance.auther)}
+    previous = getattr(instance, '_catalog_previous', None)
+    if previous:
+        keys.add(previous)
+    for title, author in keys:
+        record_catalog_change(title, author)
+
+# Invalidation of the reference data cached in novalib.refcache
+_USER_IDENTITY_FIELDS = {'barcode_number', 'email', 'first_name', 'last_name'}
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def invalidate_department_names(sender, **kwargs):
+    from novalib.refcache import invalidate
+    invalidate('departments')
+
+@receiver(post_save, sender=Title)
+@receiver(post_delete, sender=Title)
+@receiver(post_save, sender=BooksLog)
+@receiver(post_delete, sender=BooksLog)
+def invalidate_title_choices(sender, instance, created=False, **kwargs):
+    from novalib.refcache import invalidate
+    # Catalog entries only matter when one appears, goes or moves to another title
+    previous = getattr(instance, '_catalog_previous', None)
+    if sender is BooksLog and kwargs.get('signal') is post_save and not created \
+            and previous == (instance.book_title, instance.auther):
+        return
+    invalidate('title_choices')
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+@receiver(post_save, sender=DeveloperNotification)
+@receiver(post_delete, sender=DeveloperNotification)
+def invalidate_notification_feeds(sender, **kwargs):
+    from novalib.refcache import invalidate
+    invalidate('notification_feeds')
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_ids(sender, created=False, update_fields=None, **kwargs):
+    from novalib.refcache import invalidate
+    # Lookups only resolve to existing students, so a new one can't make an entry wrong;
+    # saves of other columns (OTP, seen-at stamps) leave the identity alone
+    if created or (update_fields is not None and not _USER_IDENTITY_FIELDS & set(update_fields)):
+        return
+    invalidate('user_ids')
@@ -0,0 +1,110 @@
+"""
+Time-decayed popularity of titles, ranking search and suggestions.
+
+Each loan, wishlist add and search click adds its weight to the title's
+score, and the score halves every HALF_LIFE_DAYS. Decaying every row on
+a schedule would rewrite the whole table; instead scores are kept on a
+clock that runs the other way: an event at time t adds
+
+    weight * 2 ** ((t - EPOCH) / HALF_LIFE)
+
+so later events count for more and the stored values never change on
+their own. The order of titles by stored value is their order by decayed
+score at any moment, so the index on Title.popularity serves "most
+popular first" directly, and each event is a single
+`UPDATE ... SET popularity = popularity + x`. decayed() turns a stored
+value into the score as of now.
+
+The growth factor doubles every half-life; a float holds 1024 doublings,
+which with the 30-day default is over 80 years past EPOCH.
+
+Clicks are only counted, not logged, so rebuild() (after migrating, or
+to change the weights) recomputes scores from loans and wishlists alone.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from novalib.models import BooksDetail, BooksLog, CirculationEvent, Title, WishlistEntry
+
+HALF_LIFE = timedelta(days=getattr(settings, 'NOVALIB_POPULARITY_HALF_LIFE_DAYS', 30))
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+LOAN = 'loan'
+WISHLIST = 'wishlist'
+CLICK = 'click'
+WEIGHTS = {LOAN: 3.0, WISHLIST: 2.0, CLICK: 1.0}
+
+
+def growth(moment=None):
+    """The factor events at `moment` (default now) are stored with."""
+    return 2 ** (((moment or timezone.now()) - EPOCH).total_seconds() / HALF_LIFE.total_seconds())
+
+
+def decayed(stored, moment=None):
+    """The score a stored popularity value amounts to at `moment` (default now)."""
+    return stored / growth(moment)
+
+
+def record(kind, moment=None, **lookup):
+    """
+    Count one `kind` event at `moment` for the titles matching `lookup`
+    (Title filter arguments). One UPDATE; returns the number of titles.
+    """
+    return Title.objects.filter(**lookup).update(
+        popularity=F('popularity') + WEIGHTS[kind] * growth(moment))
+
+
+def record_click(book_barcode=None, book_title=None, auther=None):
+    """
+    A search result was opened. Search returns copies and suggestions
+    return (title, author), so either a catalog or copy barcode or the
+    pair identifies the title.
+    """
+    if book_barcode:
+        return record(CLICK, pk__in=Title.objects.filter(
+            Exists(BooksLog.objects.filter(title=OuterRef('pk'), book_barcode=book_barcode)) |
+            Exists(BooksDetail.objects.filter(title=OuterRef('pk'), book_barcode=book_barcode))
+        ).values('pk'))
+    return record(CLICK, book_title=book_title, auther=auther)
+
+
+def _history_scores(title_ids=None):
+    """{title id: stored score} from loans and wishlist entries."""
+    scores = defaultdict(float)
+    loans = CirculationEvent.objects.filter(kind=CirculationEvent.ISSUE, title__isnull=False)
+    wishes = WishlistEntry.objects.all()
+    if title_ids is not None:
+        loans = loans.filter(title_id__in=title_ids)
+        wishes = wishes.filter(title_id__in=title_ids)
+    for kind, rows in ((LOAN, loans.values_list('title_id', 'occurred_at')),
+                       (WISHLIST, wishes.values_list('title_id', 'created_at'))):
+        for title_id, moment in rows.iterator(chunk_size=10000):
+            scores[title_id] += WEIGHTS[kind] * growth(moment)
+    return scores
+
+
+def rebuild(title_ids=None, batch_size=1000):
+    """
+    Recompute the scores of `title_ids` (default every title) from their
+    loans and wishlist entries. Returns the number of titles with a score.
+    """
+    if title_ids is None:
+        batches = [None]
+    else:
+        title_ids = list(title_ids)
+        batches = [title_ids[i:i + batch_size] for i in range(0, len(title_ids), batch_size)]
+    scored = 0
+    with transaction.atomic():
+        for batch in batches:
+            scores = _history_scores(batch)
+            titles = Title.objects.all() if batch is None else Title.objects.filter(pk__in=batch)
+            titles.filter(~Q(popularity=0)).update(popularity=0)
+            rows = [Title(pk=pk, popularity=score) for pk, score in scores.items()]
+            Title.objects.bulk_update(rows, ['popularity'], batch_size=batch_size)
+            scored += len(rows)
+    return scored
@@ -0,0 +1,210 @@
+"""
+On-demand profiling of single requests for staff.
+
+A request is profiled when a staff user sends the PROFILE_HEADER header,
+or carries ?_profile=<token> with a token that user minted in the admin
+for that path (signed, valid for PROFILE_TOKEN_MAX_AGE seconds), so
+links opened where headers can't be set are profiled too. A leaked
+token is useless without the staff user's session. The view runs under
+cProfile and a stack sampler, and every query is timed. The call tree,
+the functions with the most own time and the SQL timeline go
+into a ring buffer of PROFILE_BUFFER_SIZE slots in the Django cache,
+shared by all workers when the cache is, and are browsed from the admin
+next to LoginAdmin's other custom pages.
+"""
+import cProfile
+import pstats
+import sys
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils.timezone import now
+
+PROFILE_HEADER = 'X-Novalib-Profile'
+PROFILE_PARAM = '_profile'
+PROFILE_BUFFER_SIZE = getattr(settings, 'NOVALIB_PROFILE_BUFFER_SIZE', 50)
+PROFILE_TOKEN_MAX_AGE = getattr(settings, 'NOVALIB_PROFILE_TOKEN_MAX_AGE', 3600)
+# Entries outlive their slot being reused only if the buffer is idle this long
+PROFILE_TTL = 7 * 24 * 3600
+# Call-tree nodes under this share of the request's time are left out
+PROFILE_MIN_SHARE = 0.005
+PROFILE_MAX_DEPTH = 40
+
+_INDEX_KEY = 'novalib:profile:index'
+_SLOT_KEY = 'novalib:profile:slot:{}'
+_SALT = 'novalib.profiling'
+# Only one profiler can be active per thread
+_active = threading.local()
+
+
+def make_token(path, user):
+    """Signed ?_profile= value that lets `user` profile requests to `path`."""
+    return signing.dumps([path, user.pk], salt=_SALT, compress=True)
+
+
+def profile_url(path, user):
+    """`path` (may include a query string) with a fresh profiling token for `user`."""
+    separator = '&' if '?' in path else '?'
+    return f'{path}{separator}{PROFILE_PARAM}={make_token(path.split("?", 1)[0], user)}'
+
+
+def profile_requested(request):
+    """
+    Whether the request asks to be profiled at all; cheap, so the user is
+    only loaded (request.user, or await request.auser() under ASGI) for
+    wants_profile() when it does.
+    """
+    if getattr(_active, 'on', False):
+        return False
+    return bool(request.GET.get(PROFILE_PARAM) or request.headers.get(PROFILE_HEADER))
+
+
+def wants_profile(request, user):
+    """Staff `user` (the request's) asking through the header or with their own token for this path."""
+    if not (profile_requested(request) and user and user.is_active and user.is_staff):
+        return False
+    token = request.GET.get(PROFILE_PARAM)
+    if token:
+        try:
+            return signing.loads(token, salt=_SALT, max_age=PROFILE_TOKEN_MAX_AGE) == [request.path, user.pk]
+        except signing.BadSignature:
+            return False
+    return True
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built-ins: pstats stores them as ('~', 0, '<built-in method ...>')
+        return name
+    for marker in ('/site-packages/', '/novalib_web/', '/lib/python'):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            break
+    return f'{filename}:{line}({name})'
+
+
+class RequestProfiler:
+    """
+    Profiles the calling thread between start() and stop() two ways:
+    cProfile for exact per-function call counts and own time, and a
+    sampler thread that records the full stack every PROFILE_INTERVAL
+    seconds for the call tree (cProfile only keeps caller/callee pairs,
+    which can't tell the nested middleware layers apart).
+    """
+    interval = 0.001
+
+    def __init__(self, root_code=None):
+        # Frames above root_code (server, handler) are left out of the tree
+        self.root_code = root_code
+        self.profile = cProfile.Profile()
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread_id = None
+        self._sampler = None
+
+    def start(self):
+        _active.on = True
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self._stop.set()
+        self._sampler.join()
+        _active.on = False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                if frame.f_code is self.root_code:
+                    break
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def call_tree(self, duration):
+        """
+        Indented text call tree from the samples: each line is the estimated
+        ms and share of the request, children sorted by time. Nodes under
+        PROFILE_MIN_SHARE or deeper than PROFILE_MAX_DEPTH are left out.
+        """
+        total = sum(self.samples.values())
+        if not total:
+            return ''
+        tree = {}
+        for stack, count in self.samples.items():
+            children = tree
+            for code in stack[:PROFILE_MAX_DEPTH]:
+                node = children.setdefault(code, [0, {}])
+                node[0] += count
+                children = node[1]
+        lines = []
+
+        def walk(children, depth):
+            for code, (count, grandchildren) in sorted(children.items(), key=lambda item: item[1][0], reverse=True):
+                share = count / total
+                if share < PROFILE_MIN_SHARE:
+                    continue
+                label = _label((code.co_filename, code.co_firstlineno, code.co_name))
+                lines.append(f"{share * duration * 1000:9.2f}ms {share * 100:5.1f}%  {'  ' * depth}{label}")
+                walk(grandchildren, depth + 1)
+
+        walk(tree, 0)
+        return '\n'.join(lines)
+
+    def top_functions(self, limit=30):
+        """The functions with the most own time: [(label, calls, own ms, cumulative ms)]."""
+        stats = pstats.Stats(self.profile).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        return [(_label(func), calls, round(own * 1000, 3), round(cumulative * 1000, 3))
+                for func, (_, calls, own, cumulative, _) in rows]
+
+
+def save_profile(request, response, profiler, duration, stats, user=None):
+    """Store one result for `user`'s request in the ring buffer and return its id."""
+    entry = {
+        'id': uuid.uuid4().hex[:12],
+        'created_at': now(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'user': str(user or ''),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'queries': stats.count if stats else None,
+        'db_time_ms': round(stats.db_time * 1000, 2) if stats else None,
+        'tree': profiler.call_tree(duration),
+        'top': profiler.top_functions(),
+        'sql': [
+            {'start_ms': round(start * 1000, 2), 'ms': round(seconds * 1000, 3), 'sql': sql}
+            for start, seconds, sql in (stats.timeline or [])
+        ] if stats else [],
+    }
+    cache.add(_INDEX_KEY, 0, None)
+    try:
+        slot = cache.incr(_INDEX_KEY) % PROFILE_BUFFER_SIZE
+    except ValueError:
+        # The counter was evicted between add() and incr()
+        cache.set(_INDEX_KEY, 1, None)
+        slot = 1
+    cache.set(_SLOT_KEY.format(slot), entry, PROFILE_TTL)
+    return entry['id']
+
+
+def recent_profiles():
+    """Stored results, newest first."""
+    entries = cache.get_many([_SLOT_KEY.format(slot) for slot in range(PROFILE_BUFFER_SIZE)])
+    return sorted(entries.values(), key=lambda entry: entry['created_at'], reverse=True)
+
+
+def get_profile(profile_id):
+    return next((entry for entry in recent_profiles() if entry['id'] == profile_id), None)
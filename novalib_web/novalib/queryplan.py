@@ -0,0 +1,83 @@
+"""
+Query plan inspection for the plan regression tests: runs EXPLAIN for a
+queryset and reports the tables it reads in full and whether it sorts
+the whole result. Understands the plans of SQLite, MySQL/MariaDB and
+PostgreSQL.
+"""
+import json
+
+from django.db import connections
+
+
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item)
+
+
+def _sqlite_scans(plan):
+    # Each line is "id parent notused detail"; an unindexed read is
+    # "SCAN <table>", an index-ordered one "SCAN <table> USING INDEX ..."
+    for line in plan.splitlines():
+        parts = line.split(' ', 3)
+        detail = parts[3] if len(parts) == 4 else line
+        words = detail.split()
+        if words[:1] == ['SCAN'] and len(words) > 1 and 'USING' not in words and words[1] != 'CONSTANT':
+            yield words[1]
+
+
+def full_table_scans(queryset):
+    """Names (or query aliases) of the tables `queryset` reads without an index."""
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        return sorted(set(_sqlite_scans(queryset.explain())))
+    if vendor == 'mysql':
+        plan = json.loads(queryset.explain(format='json'))
+        return sorted({node['table_name'] for node in _walk(plan)
+                       if node.get('access_type') == 'ALL' and 'table_name' in node})
+    if vendor == 'postgresql':
+        plan = json.loads(queryset.explain(format='json'))
+        return sorted({node['Relation Name'] for node in _walk(plan)
+                       if node.get('Node Type') == 'Seq Scan'})
+    raise NotImplementedError(f'no plan reader for {vendor}')
+
+
+def sorts_all_rows(queryset):
+    """
+    Whether `queryset` sorts its whole result instead of reading rows in
+    index order. Sorting only the trailing ORDER BY keys within each group
+    of the leading ones (SQLite's "RIGHT PART", PostgreSQL's Incremental
+    Sort) doesn't count.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        return any(line.endswith('USE TEMP B-TREE FOR ORDER BY') for line in queryset.explain().splitlines())
+    if vendor == 'mysql':
+        plan = json.loads(queryset.explain(format='json'))
+        return any(node.get('using_filesort') for node in _walk(plan))
+    if vendor == 'postgresql':
+        plan = json.loads(queryset.explain(format='json'))
+        return any(node.get('Node Type') == 'Sort' for node in _walk(plan))
+    raise NotImplementedError(f'no plan reader for {vendor}')
+
+
+def sorts_by_group(alias='default'):
+    """
+    Whether the backend can sort rows a group at a time while reading the
+    leading ORDER BY keys from an index; MySQL sorts the whole result as
+    soon as one key isn't covered.
+    """
+    return connections[alias].vendor != 'mysql'
+
+
+def iexact_uses_index(alias='default'):
+    """
+    Whether __iexact lookups can be served by a plain index: on MySQL they
+    are LIKE against a case-insensitive collation, while SQLite's LIKE and
+    PostgreSQL's UPPER() comparisons can't use one.
+    """
+    return connections[alias].vendor == 'mysql'
@@ -0,0 +1,139 @@
+"""
+"Students who wanted this also wanted" recommendations.
+
+A batch job (`manage.py build_recommendations`) reads every wishlist
+entry and loan into a sparse student x title matrix of 0/1 interest,
+computes item-item cosine similarity from the co-occurrence counts with
+NumPy, and replaces the TitleNeighbor table with the top-k neighbours of
+each title. The endpoint only reads that table (see neighbors()).
+
+The sparse product XᵀX is built without materialising X: interactions
+are sorted by student, every pair of titles a student touched is
+generated with vectorised index arithmetic, and equal pairs are counted
+with np.unique. Work grows with the square of a student's interactions,
+so students with more than MAX_USER_TITLES (staff test accounts, bulk
+loans) are left out, and pairs are produced in chunks of at most
+PAIR_CHUNK.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from novalib.models import BooksLog, CirculationEvent, TitleNeighbor, WishlistEntry
+
+try:
+    import numpy as np
+except ImportError:  # only the batch job needs it
+    np = None
+
+TOP_K = getattr(settings, 'NOVALIB_RECOMMENDATIONS_TOP_K', 20)
+# Pairs seen for fewer students than this are noise, not taste
+MIN_SUPPORT = getattr(settings, 'NOVALIB_RECOMMENDATIONS_MIN_SUPPORT', 2)
+MAX_USER_TITLES = 500
+PAIR_CHUNK = 5_000_000
+
+
+def interactions():
+    """(user ids, title ids) arrays, one pair per student interested in a title."""
+    wished = WishlistEntry.objects.values_list('user_id', 'title_id')
+    borrowed = (CirculationEvent.objects
+                .filter(kind=CirculationEvent.ISSUE, title__isnull=False)
+                .values_list('user_id', 'title_id'))
+    pairs = np.array(list(wished.iterator(chunk_size=10000)) + list(borrowed.iterator(chunk_size=10000)),
+                     dtype=np.int64).reshape(-1, 2)
+    # A title borrowed and wished for (or borrowed twice) still counts once
+    pairs = np.unique(pairs, axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def cooccurrence(user_ids, title_ids):
+    """
+    (titles, popularity, left, right, support): `titles` maps matrix
+    columns to title ids and `popularity` counts each column's students.
+    Each (left, right) column pair with left != right was wanted by
+    `support` students; both orders of a pair are included.
+    """
+    titles, columns = np.unique(title_ids, return_inverse=True)
+    _, rows = np.unique(user_ids, return_inverse=True)
+    order = np.argsort(rows, kind='stable')
+    rows, columns = rows[order], columns[order]
+    keep = np.bincount(rows)[rows] <= MAX_USER_TITLES
+    rows, columns = rows[keep], columns[keep]
+    per_user = np.bincount(rows)
+    starts = np.cumsum(per_user) - per_user
+    n = len(titles)
+
+    # Interaction i pairs with each of its student's per_user[rows[i]] interactions
+    pair_counts = per_user[rows]
+    cumulative = np.cumsum(pair_counts)
+    chunk_keys, chunk_support = [], []
+    begin = 0
+    while begin < len(rows):
+        done = cumulative[begin - 1] if begin else 0
+        end = max(int(np.searchsorted(cumulative, done + PAIR_CHUNK, side='right')), begin + 1)
+        counts = pair_counts[begin:end]
+        left = np.repeat(columns[begin:end], counts)
+        # Position of each generated pair within its student's run of interactions
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        right = columns[np.repeat(starts[rows[begin:end]], counts) + offsets]
+        distinct = left != right
+        keys, support = np.unique(left[distinct] * n + right[distinct], return_counts=True)
+        chunk_keys.append(keys)
+        chunk_support.append(support)
+        begin = end
+
+    popularity = np.bincount(columns, minlength=n)
+    if not chunk_keys:
+        empty = np.array([], dtype=np.int64)
+        return titles, popularity, empty, empty, empty
+    keys, inverse = np.unique(np.concatenate(chunk_keys), return_inverse=True)
+    support = np.bincount(inverse, weights=np.concatenate(chunk_support)).astype(np.int64)
+    return titles, popularity, keys // n, keys % n, support
+
+
+def top_neighbors(user_ids, title_ids, top_k=TOP_K, min_support=MIN_SUPPORT):
+    """(title id, neighbour id, rank, score, support) of each title's top_k neighbours."""
+    titles, popularity, left, right, support = cooccurrence(user_ids, title_ids)
+    keep = support >= min_support
+    left, right, support = left[keep], right[keep], support[keep]
+    scores = support / np.sqrt(popularity[left] * popularity[right])
+    # By title, best score first; ties go to the better supported, then the older title
+    order = np.lexsort((right, -support, -scores, left))
+    left, right, scores, support = left[order], right[order], scores[order], support[order]
+    rank = np.arange(len(left)) - np.searchsorted(left, left)
+    keep = rank < top_k
+    return zip(titles[left[keep]].tolist(), titles[right[keep]].tolist(), rank[keep].tolist(),
+               scores[keep].tolist(), support[keep].tolist())
+
+
+def build_neighbors(top_k=TOP_K, min_support=MIN_SUPPORT, batch_size=5000):
+    """Recompute the whole TitleNeighbor table; returns the number of rows written."""
+    if np is None:
+        raise RuntimeError('build_recommendations needs NumPy (pip install numpy)')
+    user_ids, title_ids = interactions()
+    rows = [
+        TitleNeighbor(title_id=title, neighbor_id=neighbor, rank=rank, score=score, support=support)
+        for title, neighbor, rank, score, support in top_neighbors(user_ids, title_ids, top_k, min_support)
+    ]
+    # Readers keep seeing the previous lists until the swap commits
+    with transaction.atomic():
+        TitleNeighbor.objects.all().delete()
+        TitleNeighbor.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def neighbors(title_id=None, book_barcode=None, limit=TOP_K):
+    """
+    The stored neighbours of a title, given by id or by the barcode of one
+    of its catalog entries, with a catalog entry of each (one on the shelf
+    when there is one). One query: the barcode is resolved in a subquery.
+    """
+    if title_id is None:
+        title_id = Subquery(BooksLog.objects.filter(book_barcode=book_barcode).values('title_id')[:1])
+    log = BooksLog.objects.filter(title=OuterRef('neighbor_id')).order_by('-avalible', 'pk')
+    return (TitleNeighbor.objects
+            .filter(title_id=title_id)
+            .order_by('rank')
+            .annotate(book_barcode=Subquery(log.values('book_barcode')[:1]),
+                      avalible=Subquery(log.values('avalible')[:1]))
+            .values('neighbor__book_title', 'neighbor__auther', 'book_barcode', 'avalible', 'score')[:limit])
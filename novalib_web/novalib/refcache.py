@@ -0,0 +1,233 @@
+"""
+Two-tier cache for reference data: rows read on most requests but
+changed rarely (department names, the title choices of the copy form,
+notification feeds, student lookups).
+
+The first tier is a bounded LRU per process and namespace, the second the
+shared Django cache (settings.CACHES). Every key embeds its namespace's
+version, a counter kept in the shared cache; the receivers in models.py
+bump it when a row the namespace depends on changes, which orphans all of
+the namespace's shared entries at once. A process re-reads the version
+at most every NOVALIB_REFCACHE_LOCAL_TTL seconds, so another worker's LRU
+can serve an old entry for that long; the process that made the change
+drops its LRU immediately. Values are always computed from the primary
+database: a replica that hasn't caught up with the change behind an
+invalidation would put the old rows back under the new version.
+
+A missing value is computed once: threads of one process queue on a
+per-key lock, and processes race for a short lock in the shared cache,
+the losers polling for the winner's value. Shared entries go stale after
+`timeout` but are kept for `stale_for` more seconds, during which one
+caller refreshes them while the others keep getting the old value.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from novalib.db_router import primary_reads
+from novalib.metrics import record_cache
+
+# A process computing a value holds the shared lock at most this long
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+# Threads of one process computing different keys rarely share a stripe
+_LOCK_STRIPES = 32
+
+_namespaces = {}
+_MISSING = object()
+
+
+def local_max_entries():
+    return getattr(settings, 'NOVALIB_REFCACHE_LOCAL_ENTRIES', 1000)
+
+
+def local_ttl():
+    return getattr(settings, 'NOVALIB_REFCACHE_LOCAL_TTL', 5)
+
+
+class Namespace:
+    """One kind of cached data, invalidated as a whole."""
+
+    def __init__(self, name, timeout=300, stale_for=60, max_entries=None):
+        self.name = name
+        self.timeout = timeout
+        self.stale_for = stale_for
+        # None follows NOVALIB_REFCACHE_LOCAL_ENTRIES
+        self.max_entries = max_entries
+        # full key -> (fresh until, value), least recently used first
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        self._version = None
+        self._version_read = 0.0
+        self.stats = Counter()
+        _namespaces[name] = self
+
+    @property
+    def _version_key(self):
+        return f'novalib:ref:{self.name}:version'
+
+    def version(self):
+        stamp = time.monotonic()
+        if self._version is None or stamp - self._version_read >= local_ttl():
+            version = cache.get(self._version_key)
+            if version is None:
+                # First use, or evicted: start from the clock so no old key comes back
+                cache.add(self._version_key, time.time_ns(), None)
+                version = cache.get(self._version_key, 0)
+            self._version, self._version_read = version, stamp
+        return self._version
+
+    def invalidate(self):
+        """Orphan every entry, in this process now and in the others within the local TTL."""
+        try:
+            cache.incr(self._version_key)
+        except ValueError:
+            cache.set(self._version_key, time.time_ns(), None)
+        with self._lock:
+            self._local.clear()
+            self._version = None
+            self.stats['invalidations'] += 1
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+            self._version = None
+
+    def _count(self, outcome, hit, local_hit=False):
+        with self._lock:
+            self.stats[outcome] += 1
+        record_cache(self.name, hit)
+        record_cache(f'{self.name}:local', local_hit)
+
+    def _local_get(self, full_key):
+        with self._lock:
+            entry = self._local.get(full_key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.time():
+                del self._local[full_key]
+                return _MISSING
+            self._local.move_to_end(full_key)
+            return entry[1]
+
+    def _local_set(self, full_key, fresh_until, value):
+        with self._lock:
+            self._local[full_key] = (fresh_until, value)
+            self._local.move_to_end(full_key)
+            limit = self.max_entries or local_max_entries()
+            while len(self._local) > limit:
+                self._local.popitem(last=False)
+
+    def get_or_set(self, key, compute):
+        """
+        The value cached for `key` (any repr-able value) or, on a miss,
+        compute() stored in both tiers. Values must be picklable. None is
+        returned but not stored, so a lookup that found nothing is retried.
+        """
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        full_key = f'novalib:ref:{self.name}:{self.version()}:{digest}'
+        value = self._local_get(full_key)
+        if value is not _MISSING:
+            self._count('local_hits', True, local_hit=True)
+            return value
+
+        lock_key = f'{full_key}:lock'
+        entry = cache.get(full_key)
+        if entry is not None:
+            fresh_until, value = entry
+            if fresh_until > time.time():
+                self._local_set(full_key, fresh_until, value)
+                self._count('shared_hits', True)
+                return value
+            if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+                # Another caller is refreshing it; the old value will do until then
+                self._count('stale_hits', True)
+                return value
+            return self._compute(full_key, lock_key, compute)
+
+        with self._stripes[hash(full_key) % _LOCK_STRIPES]:
+            # Filled by the thread that held the lock before us
+            value = self._local_get(full_key)
+            if value is not _MISSING:
+                self._count('local_hits', True, local_hit=True)
+                return value
+            if cache.add(lock_key, 1, LOCK_TIMEOUT):
+                return self._compute(full_key, lock_key, compute)
+            # Another process is computing it: wait for its value
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                found = cache.get_many([full_key, lock_key])
+                if full_key in found:
+                    self._local_set(full_key, *found[full_key])
+                    self._count('waited_hits', True)
+                    return found[full_key][1]
+                if lock_key not in found:
+                    # Released without a value (None or an error): compute it here
+                    break
+            return self._compute(full_key, None, compute)
+
+    def _compute(self, full_key, lock_key, compute):
+        self._count('misses', False)
+        try:
+            with primary_reads():
+                value = compute()
+            if value is None:
+                return None
+            fresh_until = time.time() + self.timeout
+            cache.set(full_key, (fresh_until, value), self.timeout + self.stale_for)
+            self._local_set(full_key, fresh_until, value)
+        finally:
+            if lock_key:
+                cache.delete(lock_key)
+        return value
+
+
+def invalidate(*names):
+    """Invalidate namespaces now and again when the current transaction commits."""
+    for name in names:
+        _namespaces[name].invalidate()
+    if transaction.get_connection().in_atomic_block:
+        # A reader elsewhere may have cached the pre-commit rows under the new version
+        transaction.on_commit(lambda: [_namespaces[name].invalidate() for name in names])
+
+
+def invalidate_all():
+    invalidate(*_namespaces)
+
+
+def clear_local():
+    for namespace in _namespaces.values():
+        namespace.clear_local()
+
+
+def stats():
+    """{namespace: {outcome: count}} for this process."""
+    return {name: dict(namespace.stats) for name, namespace in sorted(_namespaces.items())}
+
+
+DEPARTMENT_NAMES = Namespace('departments', timeout=3600)
+TITLE_CHOICES = Namespace('title_choices', timeout=600)
+NOTIFICATION_FEEDS = Namespace('notification_feeds', timeout=60, stale_for=30)
+USER_IDS = Namespace('user_ids', timeout=600, max_entries=10000)
+
+
+def department_names():
+    """{department id: name}."""
+    from novalib.models import Department
+    return DEPARTMENT_NAMES.get_or_set('all', lambda: dict(Department.objects.values_list('id', 'name')))
+
+
+def title_choices():
+    """(id, label) of every Title that has a catalog entry, as the copy form lists them."""
+    from novalib.models import Title
+    return TITLE_CHOICES.get_or_set('all', lambda: [
+        (title.pk, str(title))
+        for title in Title.objects.filter(log_entries__isnull=False).distinct().order_by('book_title', 'auther')
+    ])
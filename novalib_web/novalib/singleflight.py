@@ -0,0 +1,192 @@
+"""
+Single-flight execution of identical concurrent reads.
+
+When many students run the same search at once (a reading list was just
+announced), only the first request runs the query; the others wait for
+it and return its result, so database load follows the number of
+distinct queries instead of the number of users. Nothing is cached: a
+request arriving after the flight has landed runs the query again.
+
+Requests are coalesced at two levels. Threads (or coroutines) of one
+process wait on the leader's event. Across processes the leader holds a
+short lock in the shared cache (settings.CACHES); processes that find
+it taken flag that they are waiting and poll, and only then does the
+leader publish its result, for RESULT_TTL seconds. With a per-process
+cache backend only the first level applies. Waiters give up after
+NOVALIB_SINGLEFLIGHT_TIMEOUT seconds, or as soon as the leader is interrupted without a
+result (a cancelled coroutine), and run the query themselves.
+
+Coalesced requests are counted in novalib.metrics as cache hits of the
+`flight:<name>` namespace.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from novalib.metrics import record_cache
+
+RESULT_TTL = 5
+POLL_INTERVAL = 0.02
+
+_lock = threading.Lock()
+# (name, key) -> _Flight of the thread computing it
+_flights = {}
+# (event loop, name, key) -> future of the coroutine computing it
+_async_flights = {}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.landed = False
+
+
+def _lock_key(name, key):
+    return f'novalib:flight:{name}:{hashlib.sha1(repr(key).encode()).hexdigest()}'
+
+
+def wait_timeout():
+    return getattr(settings, 'NOVALIB_SINGLEFLIGHT_TIMEOUT', 10)
+
+
+def do(name, key, compute):
+    """
+    compute() for the first caller with this (name, key); concurrent
+    callers get the same result (or exception). `key` must be repr-able
+    and identify the query completely; the result must be picklable.
+    """
+    with _lock:
+        flight = _flights.get((name, key))
+        leader = flight is None
+        if leader:
+            flight = _flights[(name, key)] = _Flight()
+    if not leader:
+        if flight.done.wait(wait_timeout()) and (flight.landed or flight.error is not None):
+            record_cache(f'flight:{name}', True)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        record_cache(f'flight:{name}', False)
+        return compute()
+
+    try:
+        flight.result = _across_processes(name, key, compute)
+        flight.landed = True
+        return flight.result
+    except Exception as exc:
+        flight.error = exc
+        raise
+    finally:
+        with _lock:
+            del _flights[(name, key)]
+        flight.done.set()
+
+
+def _across_processes(name, key, compute):
+    lock_key = _lock_key(name, key)
+    token = uuid.uuid4().hex
+    timeout = wait_timeout()
+    if cache.add(lock_key, token, timeout):
+        record_cache(f'flight:{name}', False)
+        try:
+            result = compute()
+            # Published only when another process is waiting; most flights have none
+            if cache.get(f'{lock_key}:{token}:waiting'):
+                cache.set(f'{lock_key}:{token}', result, RESULT_TTL)
+            return result
+        finally:
+            # Only our own lock: it may have expired and been taken by a slower query's successor
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    leader = cache.get(lock_key)
+    if leader is not None:
+        cache.set(f'{lock_key}:{leader}:waiting', 1, timeout)
+    deadline = time.monotonic() + timeout
+    while leader is not None and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        found = cache.get_many([f'{lock_key}:{leader}', lock_key])
+        if f'{lock_key}:{leader}' in found:
+            record_cache(f'flight:{name}', True)
+            return found[f'{lock_key}:{leader}']
+        if found.get(lock_key) != leader:
+            # The leader failed without a result
+            break
+    record_cache(f'flight:{name}', False)
+    return compute()
+
+
+async def ado(name, key, compute):
+    """do() for async views; `compute` is a coroutine function."""
+    flight_key = (asyncio.get_running_loop(), name, key)
+    future = _async_flights.get(flight_key)
+    if future is not None:
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), wait_timeout())
+        except asyncio.TimeoutError:
+            record_cache(f'flight:{name}', False)
+            return await compute()
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # This request was cancelled, not the leader
+                raise
+            record_cache(f'flight:{name}', False)
+            return await compute()
+        record_cache(f'flight:{name}', True)
+        return result
+
+    future = _async_flights[flight_key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await _aacross_processes(name, key, compute)
+    except Exception as exc:
+        future.set_exception(exc)
+        # Retrieved here so a flight nobody joined doesn't log "exception never retrieved"
+        future.exception()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del _async_flights[flight_key]
+        # Interrupted by a BaseException, usually CancelledError when the
+        # leader's client went away: release the waiters now
+        if not future.done():
+            future.cancel()
+
+
+async def _aacross_processes(name, key, compute):
+    lock_key = _lock_key(name, key)
+    token = uuid.uuid4().hex
+    timeout = wait_timeout()
+    if await cache.aadd(lock_key, token, timeout):
+        record_cache(f'flight:{name}', False)
+        try:
+            result = await compute()
+            if await cache.aget(f'{lock_key}:{token}:waiting'):
+                await cache.aset(f'{lock_key}:{token}', result, RESULT_TTL)
+            return result
+        finally:
+            if await cache.aget(lock_key) == token:
+                await cache.adelete(lock_key)
+
+    leader = await cache.aget(lock_key)
+    if leader is not None:
+        await cache.aset(f'{lock_key}:{leader}:waiting', 1, timeout)
+    deadline = time.monotonic() + timeout
+    while leader is not None and time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        found = await cache.aget_many([f'{lock_key}:{leader}', lock_key])
+        if f'{lock_key}:{leader}' in found:
+            record_cache(f'flight:{name}', True)
+            return found[f'{lock_key}:{leader}']
+        if found.get(lock_key) != leader:
+            break
+    record_cache(f'flight:{name}', False)
+    return await compute()
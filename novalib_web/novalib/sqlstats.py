@@ -0,0 +1,145 @@
+"""
+Per-request SQL accounting.
+
+A wrapper installed on every database connection records each query's
+time and fingerprint into the stats of the request being served (a
+ContextVar, so it follows the request into sync_to_async threads). The
+fingerprint is the SQL with its parameter lists collapsed, so the same
+lookup run for every row of a list, the N+1 pattern, counts as one
+repeated fingerprint. Outside a request nothing is recorded.
+"""
+import re
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# A fingerprint executed this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = getattr(settings, 'NOVALIB_N_PLUS_ONE_THRESHOLD', 5)
+
+_current = ContextVar('novalib_sql_stats', default=None)
+
+_IN_LIST = re.compile(r'\((?:%s|\?)(?:\s*,\s*(?:%s|\?))+\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def fingerprint(sql):
+    """SQL with literals and IN lists normalised, so only the query shape is left."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _IN_LIST.sub('(...)', sql)
+
+
+# Our own plumbing sits on every request's stack; skip it when attributing
+_SKIP_SITES = ('/novalib/sqlstats.py', '/novalib/middleware.py')
+
+
+def _call_site():
+    """Innermost project frame (outside Django and the stdlib) that ran the query."""
+    for frame in reversed(traceback.extract_stack()):
+        path = frame.filename.replace('\\', '/')
+        if '/novalib/' in path and not path.endswith(_SKIP_SITES):
+            short = path[path.rindex('/novalib/') + 1:]
+            return f'{short}:{frame.lineno} in {frame.name}'
+    return None
+
+
+class QueryStats:
+    """Query count, DB time and per-fingerprint counts for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.db_time = 0.0
+        # fingerprint -> [executions, seconds, sample sql, call site]
+        self.fingerprints = {}
+        # (start offset, seconds, sql) per query, when a profiler asks for it
+        self.timeline = None
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.db_time += duration
+        if self.timeline is not None:
+            self.timeline.append((time.perf_counter() - self.started - duration, duration, sql))
+        key = fingerprint(sql)
+        entry = self.fingerprints.get(key)
+        if entry is None:
+            self.fingerprints[key] = [1, duration, sql, None]
+            return
+        entry[0] += 1
+        entry[1] += duration
+        # Walk the stack once per repeated shape, not per query
+        if entry[0] == 2:
+            entry[3] = _call_site()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def repeated(self):
+        """Executions that repeated a fingerprint already seen in this request."""
+        return sum(entry[0] - 1 for entry in self.fingerprints.values())
+
+    def n_plus_one(self, threshold=None):
+        """Fingerprints run at least `threshold` times, most frequent first."""
+        threshold = threshold or N_PLUS_ONE_THRESHOLD
+        found = [
+            {'count': count, 'time_ms': round(seconds * 1000, 2), 'sql': sql[:300], 'site': site}
+            for count, seconds, sql, site in self.fingerprints.values()
+            if count >= threshold
+        ]
+        return sorted(found, key=lambda item: item['count'], reverse=True)
+
+    def summary(self):
+        return {
+            'queries': self.count,
+            'db_time_ms': round(self.db_time * 1000, 2),
+            'duration_ms': round(self.elapsed * 1000, 2),
+            'repeated_queries': self.repeated,
+            'n_plus_one': self.n_plus_one(),
+        }
+
+
+@contextmanager
+def collect_queries():
+    """Record every query run in this block (and threads it hands off to)."""
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def current_stats():
+    return _current.get()
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record(sql, time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # Fires again on reconnect; the wrapper list lives on the connection object
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# Connections opened before this module was imported (management commands, shell)
+for _connection in connections.all(initialized_only=True):
+    install_query_recorder(None, _connection)
@@ -1,3 +1,1591 @@
-from django.test import TestCase
+import asyncio
+import glob
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import SynchronousOnlyOperation
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, router, transaction
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, path
+from django.utils import timezone
+
+from novalib import api, async_views, catalog, db_router, media, metrics, middleware, popularity, profiling, queryplan, refcache, singleflight, views
+from novalib.circulation import monthly_report, user_history
+from novalib.datagen import generate_library
+from novalib.fines import (
+    get_fine_balance, post_fine_entry, reconcile_balances, record_fine_charge, record_fine_payment,
+)
+from novalib.holds import cancel_hold, enqueue_hold, expire_holds, hold_pickup_days
+from novalib.middleware import CompressionMiddleware, QueryStatsMiddleware, choose_encoding
+from novalib.models import (
+    BooksDetail, BooksLog, CatalogChange, CirculationEvent, Department, DeveloperNotification, FineBalance, FineLedgerEntry,
+    HoldRequest, Login, Notification, ReturnDesk, Title, TitleNeighbor, User, WishlistEntry,
+    image_in_use,
+)
+from novalib.recommendations import neighbors
+from novalib.sqlstats import collect_queries, current_stats, fingerprint
+from novalib.views import BOOK_LOG_PARAMS, _book_log_query, _flight_key, _suggestion_query
+from novalib.wishlists import add_to_wishlist, wishers, wishlist_entries
+
+
+class ReplicaRouterTests(TestCase):
+    """Routing decisions; replica aliases are patched so no replica DB is needed."""
+
+    def setUp(self):
+        db_router.reset_replica_health()
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=['replica1'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(db_router.reset_replica_health)
+
+    def test_reads_use_primary_outside_replica_views(self):
+        self.assertEqual(router.db_for_read(BooksLog), 'default')
+
+    def test_reads_use_replica_inside_replica_views(self):
+        with mock.patch.object(db_router, 'replica_lag', return_value=0):
+            with db_router.use_replicas():
+                self.assertEqual(router.db_for_read(BooksLog), 'replica1')
+
+    def test_reads_after_write_stay_on_primary(self):
+        with mock.patch.object(db_router, 'replica_lag', return_value=0):
+            with db_router.use_replicas():
+                self.assertEqual(router.db_for_write(Department), 'default')
+                self.assertEqual(router.db_for_read(BooksLog), 'default')
+            # The next request starts clean
+            with db_router.use_replicas():
+                self.assertEqual(router.db_for_read(BooksLog), 'replica1')
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with mock.patch.object(db_router, 'replica_lag', return_value=db_router.max_lag() + 1):
+            with db_router.use_replicas():
+                self.assertEqual(router.db_for_read(BooksLog), 'default')
+
+    def test_lag_limit_is_read_at_check_time(self):
+        with mock.patch.object(db_router, 'replica_lag', return_value=8), \
+                override_settings(NOVALIB_REPLICA_MAX_LAG=10):
+            with db_router.use_replicas():
+                self.assertEqual(router.db_for_read(BooksLog), 'replica1')
+
+    def test_primary_reads_inside_replica_views(self):
+        with mock.patch.object(db_router, 'replica_lag', return_value=0):
+            with db_router.use_replicas():
+                with db_router.primary_reads():
+                    self.assertEqual(router.db_for_read(BooksLog), 'default')
+                    router.db_for_write(Department)
+                self.assertEqual(router.db_for_read(BooksLog), 'default')
+
+    def test_stopped_or_unreachable_replica_falls_back_to_primary(self):
+        for side_effect in ([None], OperationalError('connection refused')):
+            db_router.reset_replica_health()
+            with mock.patch.object(db_router, 'replica_lag', side_effect=side_effect):
+                with db_router.use_replicas():
+                    self.assertEqual(router.db_for_read(BooksLog), 'default')
+
+    def test_sqlite_is_not_a_replica(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        # No replication status to read, so no claim of being caught up
+        self.assertIsNone(db_router.replica_lag('default'))
+        with mock.patch.object(db_router, 'replica_aliases', return_value=['default']):
+            db_router.refresh_replica_health()
+        self.assertFalse(db_router.replica_healthy('default'))
+
+    def test_programming_errors_are_not_an_unhealthy_replica(self):
+        with mock.patch.object(db_router, 'replica_lag', side_effect=SynchronousOnlyOperation):
+            with self.assertRaises(SynchronousOnlyOperation):
+                with db_router.use_replicas():
+                    pass
+        self.assertFalse(db_router._health)
+
+    def test_health_check_is_cached(self):
+        with mock.patch.object(db_router, 'replica_lag', return_value=0) as lag:
+            with db_router.use_replicas():
+                router.db_for_read(BooksLog)
+                router.db_for_read(BooksLog)
+        self.assertEqual(lag.call_count, 1)
+
+
+class ReplicaViewTests(TransactionTestCase):
+    """End to end against a second database (NOVALIB_SQLITE=1 provides replica1)."""
+    databases = '__all__'
+
+    def setUp(self):
+        if 'replica1' not in settings.DATABASES:
+            self.skipTest('no replica1 database configured')
+        db_router.reset_replica_health()
+        self.addCleanup(db_router.reset_replica_health)
+        # The test mirror is never behind, but only MySQL can report that
+        patcher = mock.patch.object(db_router, 'replica_lag', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_suggestions_read_from_replica(self):
+        with CaptureQueriesContext(connections['replica1']) as replica:
+            response = self.client.get('/book-suggestions/?search=dune')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(replica.captured_queries), 1)
+
+    def test_wishlist_reads_stay_on_primary(self):
+        with CaptureQueriesContext(connections['replica1']) as replica:
+            self.client.get('/user-wishlist/?barcode=B1')
+        self.assertEqual(len(replica.captured_queries), 0)
+
+    def test_async_views_read_from_replica(self):
+        def lag(alias):
+            # Touches the connection like the MySQL status query does, which
+            # raises SynchronousOnlyOperation on the event loop
+            connections[alias].ensure_connection()
+            return 0
+
+        with mock.patch.object(db_router, 'replica_lag', side_effect=lag):
+            with override_settings(ROOT_URLCONF=AsyncUrlconf), \
+                    CaptureQueriesContext(connections['replica1']) as replica:
+                response = async_to_sync(self.async_client.get)('/book-suggestions/?search=dune')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(replica.captured_queries), 1)
+        self.assertTrue(db_router.replica_healthy('replica1'))
+
+
+SMALL_LIBRARY = dict(departments=3, users=40, titles=30, copies=200, wishlists=60,
+                     fines=25, logins=50, notifications=5)
+
+
+class GenerateLibraryTests(TestCase):
+    def test_generates_consistent_library(self):
+        counts = generate_library(**SMALL_LIBRARY)
+        self.assertEqual(counts['copies'], 200)
+        self.assertEqual(BooksLog.objects.count(), 30)
+        self.assertEqual(counts['holds'], counts['wishlist_links'])
+        # Balances agree with the ledger
+        self.assertEqual(reconcile_balances(dry_run=True)[1], 0)
+        # Loaned copies have a borrower, shelf copies don't
+        self.assertFalse(BooksDetail.objects.filter(avalible=False, user__isnull=True).exists())
+        self.assertFalse(BooksDetail.objects.filter(avalible=True, user__isnull=False).exists())
+        # Hold positions run 1..n per title
+        for title_id in BooksLog.objects.values_list('title_id', flat=True):
+            positions = list(HoldRequest.objects.filter(title_id=title_id)
+                             .order_by('position').values_list('position', flat=True))
+            self.assertEqual(positions, list(range(1, len(positions) + 1)))
+
+    def test_same_seed_same_data(self):
+        generate_library(prefix='A', **SMALL_LIBRARY)
+        generate_library(prefix='B', **SMALL_LIBRARY)
+
+        def dataset(prefix):
+            return list(BooksDetail.objects.filter(book_barcode__startswith=f'{prefix}B')
+                        .order_by('book_barcode')
+                        .values_list('book_title', 'auther', 'avalible', 'issued_date'))
+        self.assertEqual(dataset('A'), dataset('B'))
+        # Both datasets share the Title rows of their common names
+        self.assertEqual(Title.objects.count(), 30)
+        for model in (BooksLog, BooksDetail):
+            self.assertFalse(model.objects.exclude(title__book_title=F('book_title'), title__auther=F('auther')).exists())
+
+    def test_refuses_to_generate_twice(self):
+        generate_library(**SMALL_LIBRARY)
+        with self.assertRaises(ValueError):
+            generate_library(**SMALL_LIBRARY)
+
+
+class FineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refcache.clear_local()
+        self.addCleanup(refcache.clear_local)
+        self.student = User.objects.create(barcode_number='S1', first_name='Asha', last_name='Das',
+                                           phone_number='1', email='asha@example.edu')
+
+    def test_postings_update_the_balance(self):
+        record_fine_charge(self.student.pk, '50.00', note='Late')
+        payment = record_fine_payment(self.student.pk, '20.00')
+        self.assertEqual(payment.amount, Decimal('-20.00'))
+        self.assertEqual(get_fine_balance(self.student.pk), Decimal('30.00'))
+        self.assertEqual(get_fine_balance(self.student.pk + 1), Decimal('0.00'))
+
+    def test_return_desk_fines_follow_the_row(self):
+        desk = ReturnDesk.objects.create(student=self.student, book='Dune', fine=20, otp='123456')
+        desk.fine = 50
+        desk.save()
+        self.assertEqual(get_fine_balance(self.student.pk), Decimal('50.00'))
+        desk.delete()
+        self.assertEqual(get_fine_balance(self.student.pk), Decimal('0.00'))
+        self.assertEqual(FineLedgerEntry.objects.filter(user=self.student).count(), 3)
+
+    def test_entries_are_append_only(self):
+        entry = post_fine_entry(self.student.pk, '10.00')
+        entry.amount = Decimal('1.00')
+        with self.assertRaises(ValueError):
+            entry.save()
+        entry.refresh_from_db()
+        self.assertEqual(entry.amount, Decimal('10.00'))
+
+    def test_reconcile_corrects_drifted_balances(self):
+        other = User.objects.create(barcode_number='S2', first_name='Ben', last_name='Roy',
+                                    phone_number='2', email='ben@example.edu')
+        post_fine_entry(self.student.pk, '40.00')
+        post_fine_entry(other.pk, '15.00')
+        FineBalance.objects.filter(pk=self.student.pk).update(balance=999)
+        FineBalance.objects.filter(pk=other.pk).delete()
+        self.assertEqual(reconcile_balances(dry_run=True), (2, 2))
+        self.assertEqual(get_fine_balance(self.student.pk), Decimal('999.00'))
+        self.assertEqual(reconcile_balances(batch_size=1), (2, 2))
+        self.assertEqual((get_fine_balance(self.student.pk), get_fine_balance(other.pk)),
+                         (Decimal('40.00'), Decimal('15.00')))
+        self.assertEqual(reconcile_balances(), (2, 0))
+
+    def test_fine_balance_view(self):
+        post_fine_entry(self.student.pk, '12.50')
+        response = self.client.get('/api/fine-balance/?barcode=s1')
+        self.assertEqual(response.json(), {'user_id': self.student.pk, 'due_fine': '12.50'})
+        self.assertEqual(self.client.get('/api/fine-balance/?barcode=missing').status_code, 404)
+        self.assertEqual(self.client.get('/api/fine-balance/').status_code, 404)
+        self.assertEqual(self.client.post('/api/fine-balance/?barcode=S1').status_code, 400)
+
+
+class HoldTests(TestCase):
+    def setUp(self):
+        self.students = [User.objects.create(barcode_number=f'S{i}', first_name='S', last_name=str(i),
+                                             phone_number=str(i), email=f's{i}@example.edu') for i in range(3)]
+        self.copy = BooksDetail.objects.create(book_barcode='C1', book_title='Dune', auther='Herbert')
+        # On loan to the third student while the others queue
+        self.copy.user = self.students[2]
+        self.copy.save()
+
+    def enqueue(self, student):
+        return enqueue_hold(student.pk, self.copy.title_id)
+
+    def give_back(self):
+        self.copy.user = None
+        self.copy.save()
+        self.copy.refresh_from_db()
+
+    def test_queue_is_first_come_first_served(self):
+        first, second = self.enqueue(self.students[0]), self.enqueue(self.students[1])
+        self.assertEqual((first.position, second.position), (1, 2))
+        with transaction.atomic():
+            # Enqueueing again, even inside a caller's transaction, keeps the place
+            self.assertEqual(self.enqueue(self.students[0]).pk, first.pk)
+        self.assertEqual(HoldRequest.objects.count(), 2)
+        self.assertEqual(cancel_hold(self.students[0].pk, self.copy.title_id), 1)
+        self.assertEqual(self.enqueue(self.students[0]).position, 3)
+
+    def test_returned_copy_goes_down_the_queue(self):
+        first, second = self.enqueue(self.students[0]), self.enqueue(self.students[1])
+        self.give_back()
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.copy_id), (HoldRequest.READY, self.copy.pk))
+        self.assertEqual((self.copy.reserved_for_id, self.copy.avalible), (self.students[0].pk, False))
+        self.assertEqual(first.expires_at - first.ready_at, timedelta(days=hold_pickup_days()))
+
+        # The first student gives up: the copy is the second's now
+        cancel_hold(self.students[0].pk, self.copy.title_id)
+        second.refresh_from_db()
+        self.copy.refresh_from_db()
+        self.assertEqual((second.status, self.copy.reserved_for_id), (HoldRequest.READY, self.students[1].pk))
+
+        self.copy.user = self.students[1]
+        self.copy.save()
+        second.refresh_from_db()
+        self.copy.refresh_from_db()
+        self.assertEqual((second.status, self.copy.reserved_for_id), (HoldRequest.FULFILLED, None))
+
+    def test_expired_pickups_pass_the_copy_on(self):
+        first, second = self.enqueue(self.students[0]), self.enqueue(self.students[1])
+        self.give_back()
+        HoldRequest.objects.filter(pk=first.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('expire_holds', stdout=io.StringIO())
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.copy.refresh_from_db()
+        self.assertEqual((first.status, second.status), (HoldRequest.EXPIRED, HoldRequest.READY))
+        self.assertEqual(self.copy.reserved_for_id, self.students[1].pk)
+
+        # Nobody left waiting: back on the shelf
+        HoldRequest.objects.filter(pk=second.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(expire_holds(), 1)
+        self.copy.refresh_from_db()
+        self.assertEqual((self.copy.reserved_for_id, self.copy.avalible), (None, True))
+
+    def test_return_with_nobody_waiting_is_saved_as_is(self):
+        # Taken off the shelf for repair on its way back
+        self.copy.avalible = False
+        self.give_back()
+        self.assertEqual((self.copy.reserved_for_id, self.copy.avalible), (None, False))
+
+    def test_pickup_window_follows_settings(self):
+        first = self.enqueue(self.students[0])
+        with override_settings(NOVALIB_HOLD_PICKUP_DAYS=7):
+            self.give_back()
+        first.refresh_from_db()
+        self.assertEqual(first.expires_at - first.ready_at, timedelta(days=7))
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create(barcode_number='S1', first_name='Asha', last_name='Das',
+                                           phone_number='1', email='asha@example.edu')
+        for i, name in enumerate(['Dune', 'Emma', 'Ulysses']):
+            copy = BooksDetail.objects.create(book_barcode=f'C{i}', book_title=name, auther='X')
+            copy.user = self.student
+            copy.save()
+            log = BooksLog.objects.create(book_barcode=f'T{i}', book_title=f'{name} II', auther='X')
+            WishlistEntry.objects.create(user=self.student, title=log.title)
+            enqueue_hold(self.student.pk, log.title_id)
+        post_fine_entry(self.student.pk, '5.00')
+        librarian = get_user_model().objects.create_user('librarian')
+        Notification.objects.create(notification_id='N1', title='Closed', message='Closed on Monday',
+                                    uploaded_by=librarian)
+
+    def test_fixed_number_of_queries(self):
+        # The user with their balance, three prefetches and two unread counts
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/dashboard/?barcode=S1')
+        body = response.json()
+        self.assertEqual([len(body[key]) for key in ('issued_books', 'wishlist', 'holds')], [3, 3, 3])
+        self.assertEqual((body['due_fine'], body['unread_notifications']), ('5.00', {'library': 1, 'developer': 0}))
+
+    def test_unknown_student(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/dashboard/?barcode=missing').status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/dashboard/').status_code, 404)
+
+
+class ApiTests(TestCase):
+    FIELDS = {
+        'title': 'book_title',
+        'author': 'auther',
+        'available': (('avalible',), lambda row: bool(row['avalible'])),
+    }
+
+    def test_selected_fields(self):
+        self.assertEqual(api.selected_fields({'fields': 'available, nope,title,available'}, self.FIELDS),
+                         ['available', 'title'])
+        # Nothing valid asked for: the default set
+        self.assertEqual(api.selected_fields({'fields': 'nope'}, self.FIELDS), list(self.FIELDS))
+        self.assertEqual(api.selected_fields({}, self.FIELDS, default=['title']), ['title'])
+
+    def test_project_reads_only_the_selected_columns(self):
+        BooksLog.objects.create(book_barcode='T1', book_title='Dune', auther='Herbert', avalible=False)
+        with CaptureQueriesContext(connection) as queries:
+            rows = api.project(BooksLog.objects.all(), self.FIELDS, ['available'])
+        self.assertEqual(rows, [{'available': False}])
+        sql = queries.captured_queries[0]['sql']
+        self.assertIn('avalible', sql)
+        self.assertNotIn('book_title', sql)
+        self.assertNotIn('auther', sql)
+
+    def test_encoders_agree(self):
+        data = {
+            'at': datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc),
+            'on': date(2026, 1, 2),
+            'fine': Decimal('1.50'),
+        }
+        expected = {'at': '2026-01-02T03:04:05.678Z', 'on': '2026-01-02', 'fine': '1.50'}
+        self.assertEqual(json.loads(api.stdlib_dumps(data)), expected)
+        if api.orjson is None:
+            self.skipTest('orjson is not installed')
+        self.assertEqual(json.loads(api.orjson_dumps(data)), expected)
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refcache.clear_local()
+        self.addCleanup(refcache.clear_local)
+        self.student = User.objects.create(barcode_number='S1', first_name='Asha', last_name='Das',
+                                           phone_number='1', email='asha@example.edu')
+        self.dune = BooksLog.objects.create(book_barcode='T1', book_title='Dune', auther='Herbert')
+        self.emma = BooksLog.objects.create(book_barcode='T2', book_title='Emma', auther='Austen')
+
+    def post(self, body):
+        return self.client.post('/api/batch/', json.dumps(body), content_type='application/json')
+
+    def test_a_failed_operation_is_rolled_back_alone(self):
+        def fail_after_writing(user, op):
+            WishlistEntry.objects.create(user=user, title=self.emma.title)
+            raise RuntimeError('SELECT secret FROM somewhere')
+
+        with mock.patch.dict(views.BATCH_OPERATIONS, {'fail': fail_after_writing}), \
+                self.assertLogs('novalib.views', 'ERROR') as logs:
+            response = self.post({'barcode': 'S1', 'requests': [
+                {'id': 1, 'op': 'wishlist.add', 'book_barcode': 'T1'},
+                {'id': 2, 'op': 'fail'},
+                {'id': 3, 'op': 'nope'},
+                {'id': 4, 'op': 'wishlist.list', 'fields': 'book_title'},
+            ]})
+        results = response.json()
+        self.assertEqual([(row['id'], row['status']) for row in results], [(1, 200), (2, 500), (3, 400), (4, 200)])
+        self.assertEqual(results[1]['body'], {'error': 'Internal error'})
+        self.assertIn('SELECT secret', logs.output[0])
+        self.assertEqual(results[3]['body'], [{'book_title': 'Dune'}])
+        self.assertEqual(list(WishlistEntry.objects.values_list('title__book_title', flat=True)), ['Dune'])
+
+    def test_operation_limit(self):
+        response = self.post([{'op': 'suggestions', 'search': 'a'}] * (views.BATCH_MAX_OPERATIONS + 1))
+        self.assertEqual(response.status_code, 400)
+        # The same operation over and over runs the same query each time, which the query log reports
+        with self.assertLogs('novalib.sql', 'WARNING') as logs:
+            response = self.post([{'op': 'suggestions', 'search': 'du'}] * views.BATCH_MAX_OPERATIONS)
+        self.assertEqual(len(response.json()), views.BATCH_MAX_OPERATIONS)
+        repeated = logs.records[0].sql_stats['n_plus_one']
+        self.assertEqual([item['count'] for item in repeated], [views.BATCH_MAX_OPERATIONS])
+        self.assertIn('_unique_suggestions', repeated[0]['site'])
+
+    def test_malformed_bodies(self):
+        for body in (5, 'x', None, {'requests': {'op': 'suggestions'}}, [1], [{'op': ['a']}], [{}],
+                     {'barcode': 123, 'requests': []}, {'email': ['a'], 'requests': []}):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+        response = self.client.post('/api/batch/', 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/batch/').status_code, 400)
+
+
+class CompressionTests(TestCase):
+    BODY = json.dumps([{'book_title': 'Organic Chemistry', 'available': True}] * 50).encode()
+
+    def respond(self, response, accept='gzip, deflate'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_negotiation(self):
+        self.assertEqual(choose_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(choose_encoding('GZIP;q=0.8'), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0, deflate'))
+        self.assertIsNone(choose_encoding(''))
+        self.assertEqual(choose_encoding('br;q=1, gzip;q=0.5'), 'br' if middleware.brotli else 'gzip')
+
+    def test_large_json_is_compressed(self):
+        response = self.respond(HttpResponse(self.BODY, content_type='application/json', headers={'ETag': '"v1"'}))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.BODY)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        # The compressed bytes differ from what a strong ETag would promise
+        self.assertEqual(response['ETag'], 'W/"v1"')
+
+    def test_left_alone(self):
+        small = self.respond(HttpResponse(b'{"ok": true}', content_type='application/json'))
+        self.assertFalse(small.has_header('Content-Encoding'))
+        # Whether it was compressed depends on Accept-Encoding either way
+        self.assertEqual(small['Vary'], 'Accept-Encoding')
+        refused = self.respond(HttpResponse(self.BODY, content_type='application/json'), accept='identity')
+        self.assertEqual(refused.content, self.BODY)
+        html = self.respond(HttpResponse(self.BODY, content_type='text/html'))
+        self.assertFalse(html.has_header('Content-Encoding') or html.has_header('Vary'))
+
+    @override_settings(NOVALIB_COMPRESS_MIN_SIZE=len(BODY) + 1)
+    def test_threshold_setting(self):
+        response = self.respond(HttpResponse(self.BODY, content_type='application/json'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_responses_are_compressed_per_chunk(self):
+        chunks = [self.BODY[:100], self.BODY[100:]]
+        response = self.respond(StreamingHttpResponse(iter(chunks), content_type='application/json'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        compressed = list(response.streaming_content)
+        # One piece per chunk plus the trailer, so rows go out as they are produced
+        self.assertEqual(len(compressed), 3)
+        self.assertEqual(gzip.decompress(b''.join(compressed)), self.BODY)
+
+    async def test_async_streaming_responses(self):
+        async def chunks():
+            yield self.BODY[:100]
+            yield self.BODY[100:]
+
+        async def get_response(request):
+            return StreamingHttpResponse(chunks(), content_type='application/json')
+
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = await CompressionMiddleware(get_response)(request)
+        compressed = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(gzip.decompress(b''.join(compressed)), self.BODY)
+
+
+class AsyncUrlconf:
+    """novalib.urls as served with NOVALIB_ASYNC_VIEWS on."""
+    urlpatterns = [
+        path('api/send-otp/', async_views.send_otp),
+        path('notifications/', async_views.DeveloperNotifications),
+        path('library-notifications/', async_views.notifications),
+        path('book-log/', async_views.book_log_list),
+        path('user-wishlist/', async_views.user_wishlist),
+        path('book-suggestions/', async_views.book_suggestions),
+    ]
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refcache.clear_local()
+        self.addCleanup(refcache.clear_local)
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        generate_library(**SMALL_LIBRARY)
+        self.barcode = WishlistEntry.objects.values_list('user__barcode_number', flat=True).first()
+        self.term = BooksLog.objects.values_list('book_title', flat=True).first().split()[0]
+
+    async def test_same_payloads_as_sync_views(self):
+        paths = [
+            '/book-log/',
+            f'/book-log/?barcode={self.barcode}&fields=book_title,auther',
+            f'/user-wishlist/?barcode={self.barcode}',
+            f'/user-wishlist/?barcode={self.barcode}&fields=book_title,wishlist_users',
+            '/user-wishlist/?barcode=nobody',
+            f'/book-suggestions/?search={self.term}',
+            '/book-suggestions/?search=',
+            '/notifications/',
+            '/library-notifications/',
+        ]
+        for url in paths:
+            with self.subTest(url=url):
+                expected = await sync_to_async(self.client.get)(url)
+                with override_settings(ROOT_URLCONF=AsyncUrlconf):
+                    response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.json(), expected.json())
+
+    async def test_otp_mail_is_sent_off_the_event_loop(self):
+        senders = []
+
+        def send(message, fail_silently=False):
+            try:
+                asyncio.get_running_loop()
+                senders.append('event loop')
+            except RuntimeError:
+                senders.append('thread')
+            return 1
+
+        body = json.dumps({'barcode': self.barcode})
+        logins = await Login.objects.filter(user__barcode_number=self.barcode).acount()
+        with mock.patch.object(EmailMessage, 'send', autospec=True, side_effect=send):
+            expected = await sync_to_async(self.client.post)('/api/send-otp/', body, content_type='application/json')
+            with override_settings(ROOT_URLCONF=AsyncUrlconf):
+                response = await self.async_client.post('/api/send-otp/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(senders, ['thread', 'thread'])
+        user = await User.objects.aget(barcode_number=self.barcode)
+        self.assertIsNotNone(user.otp)
+        self.assertEqual(await Login.objects.filter(user=user).acount(), logins + 2)
+
+
+class QueryStatsTests(TestCase):
+    def setUp(self):
+        self.students = [User.objects.create(barcode_number=f'S{i}') for i in range(6)]
+
+    def lookups(self, request=None):
+        # One query per student: the N+1 shape
+        for student in self.students:
+            User.objects.filter(pk=student.pk).first()
+        return HttpResponse('ok')
+
+    def respond(self, get_response):
+        return QueryStatsMiddleware(get_response)(RequestFactory().get('/students/'))
+
+    def test_fingerprint_ignores_literals_and_list_lengths(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE id = 12 AND name = 'O''Hara'"),
+                         'SELECT * FROM t WHERE id = ? AND name = ?')
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+                         fingerprint('SELECT * FROM t WHERE id IN (%s, %s)'))
+
+    def test_repeated_shapes_are_reported_with_their_call_site(self):
+        with collect_queries() as stats:
+            self.lookups()
+        self.assertEqual(stats.count, 6)
+        self.assertEqual(stats.repeated, 5)
+        [found] = stats.n_plus_one()
+        self.assertEqual(found['count'], 6)
+        self.assertRegex(found['site'], r'^novalib/tests\.py:\d+ in lookups$')
+        self.assertEqual(stats.n_plus_one(threshold=7), [])
+        # Nothing is recorded outside a request
+        self.assertIsNone(current_stats())
+
+    @override_settings(NOVALIB_QUERY_STATS_HEADERS=True)
+    def test_headers_and_log_record(self):
+        with self.assertLogs('novalib.sql', 'WARNING') as logs:
+            response = self.respond(self.lookups)
+        self.assertEqual(response['X-DB-Queries'], '6')
+        self.assertEqual(response['X-DB-Repeated-Queries'], '5')
+        self.assertRegex(response['X-DB-N-Plus-One'], r'^6x novalib/tests\.py:\d+ in lookups$')
+        [record] = logs.records
+        self.assertEqual(json.loads(record.getMessage()), record.sql_stats)
+        self.assertEqual(record.sql_stats['path'], '/students/')
+        self.assertEqual(record.sql_stats['status'], 200)
+        self.assertEqual(record.sql_stats['n_plus_one'][0]['count'], 6)
+
+    def test_quiet_requests_are_not_logged(self):
+        def one_query(request):
+            User.objects.count()
+            return HttpResponse('ok')
+
+        with self.assertNoLogs('novalib.sql'):
+            response = self.respond(one_query)
+        self.assertFalse(response.has_header('X-DB-Queries'))
+        with override_settings(NOVALIB_SLOW_REQUEST_QUERIES=1), self.assertLogs('novalib.sql', 'WARNING'):
+            self.respond(one_query)
+        with override_settings(NOVALIB_SLOW_REQUEST_MS=0), self.assertLogs('novalib.sql', 'WARNING'):
+            self.respond(one_query)
+
+
+@override_settings(NOVALIB_METRICS_DIR=None)
+class MetricsTests(TestCase):
+    SAMPLE = re.compile(r'^[a-z_]+(\{[a-z]+="(?:[^"\\]|\\.)*"(?:,[a-z]+="(?:[^"\\]|\\.)*")*\})? [0-9.]+$')
+
+    def setUp(self):
+        for patcher in (mock.patch.dict(metrics._views, clear=True), mock.patch.dict(metrics._caches, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_latency_buckets(self):
+        for seconds, status in ((0.005, 200), (0.3, 200), (0.5, 200), (20.0, 503)):
+            metrics.observe_request('dashboard', seconds, status, db_seconds=0.001)
+        text = metrics.render(metrics.collect())
+        # Bounds are inclusive and counts cumulative
+        self.assertIn('novalib_request_duration_seconds_bucket{view="dashboard",le="0.005"} 1\n', text)
+        self.assertIn('novalib_request_duration_seconds_bucket{view="dashboard",le="0.25"} 1\n', text)
+        self.assertIn('novalib_request_duration_seconds_bucket{view="dashboard",le="0.5"} 3\n', text)
+        self.assertIn('novalib_request_duration_seconds_bucket{view="dashboard",le="10.0"} 3\n', text)
+        self.assertIn('novalib_request_duration_seconds_bucket{view="dashboard",le="+Inf"} 4\n', text)
+        self.assertIn('novalib_request_duration_seconds_count{view="dashboard"} 4\n', text)
+        self.assertIn('novalib_request_duration_seconds_sum{view="dashboard"} 20.805000\n', text)
+        self.assertIn('novalib_request_errors_total{view="dashboard"} 1\n', text)
+        self.assertIn('novalib_request_db_seconds_total{view="dashboard"} 0.004000\n', text)
+
+    def test_workers_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = [0] * (len(metrics.LATENCY_BUCKETS) + 1) + [2, 1, 3.0, 0.5]
+        other[0] = 2
+        with open(os.path.join(directory, 'worker-1-1.json'), 'w') as fh:
+            json.dump({'views': {'dashboard': other}, 'caches': {'refcache': [1, 1]}}, fh)
+        with open(os.path.join(directory, 'worker-2-2.json'), 'w') as fh:
+            fh.write('{"views": ')  # a worker that died mid-write is skipped
+        metrics.observe_request('dashboard', 0.001, 200)
+        metrics.record_cache('refcache', hit=True)
+        with override_settings(NOVALIB_METRICS_DIR=directory):
+            total = metrics.collect()
+            # This worker's own file is written on collection
+            self.assertEqual(len(glob.glob(os.path.join(directory, 'worker-*.json'))), 3)
+        self.assertEqual(total['views']['dashboard'][0], 3)
+        self.assertEqual(total['views']['dashboard'][metrics._REQUESTS], 3)
+        self.assertEqual(total['views']['dashboard'][metrics._ERRORS], 1)
+        self.assertEqual(total['caches']['refcache'], [2, 1])
+
+    def test_exposition_format(self):
+        metrics.observe_request('say "hi"\\now', 0.01, 200)
+        metrics.record_cache('refcache', hit=True)
+        metrics.record_cache('refcache', hit=False)
+        text = metrics.render(metrics.collect())
+        self.assertTrue(text.endswith('\n'))
+        declared = set()
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                declared.add(line.split()[2])
+            elif not line.startswith('# HELP '):
+                self.assertRegex(line, self.SAMPLE)
+                family = re.sub(r'_(bucket|sum|count)$', '', line.split('{')[0])
+                self.assertIn(family, declared)
+        self.assertIn('novalib_requests_total{view="say \\"hi\\"\\\\now"} 1\n', text)
+        self.assertIn('novalib_cache_hit_ratio{namespace="refcache"} 0.5000\n', text)
+
+    def test_endpoint(self):
+        self.client.get('/book-suggestions/?search=')
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('novalib_requests_total{view="book_suggestions"} 1\n', response.content.decode())
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.5').status_code, 403)
+        with override_settings(NOVALIB_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+            self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.5',
+                                             HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class TitleTests(TestCase):
+    def test_saves_link_rows_to_their_title(self):
+        log = BooksLog.objects.create(book_barcode='T1', book_title='Dune', auther='Herbert')
+        copy = BooksDetail.objects.create(book_barcode='C1', book_title='Dune', auther='Herbert')
+        self.assertEqual(copy.title_id, log.title_id)
+        copy.book_title = 'Dune Messiah'
+        copy.save()
+        self.assertEqual(copy.title, Title.objects.get(book_title='Dune Messiah', auther='Herbert'))
+
+    def test_admin_counts_copies_by_title(self):
+        log = BooksLog.objects.create(book_barcode='T1', book_title='Dune', auther='Herbert')
+        BooksDetail.objects.create(book_barcode='C1', book_title='Dune', auther='Herbert')
+        BooksDetail.objects.create(book_barcode='C2', book_title='Dune', auther='Herbert', avalible=False)
+        BooksDetail.objects.create(book_barcode='C3', book_title='Dune', auther='Someone Else')
+        model_admin = admin.site._registry[BooksLog]
+        self.assertEqual((model_admin.book_count(log), model_admin.available_count(log)), (2, 1))
+
+
+class WishlistTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.student = User.objects.create(barcode_number='S1', first_name='Asha', last_name='Das',
+                                           phone_number='1', email='asha@example.edu')
+        # Two catalog entries of one title, only the second on the shelf
+        BooksLog.objects.create(book_barcode='T1', book_title='Dune', auther='Herbert', avalible=False)
+        BooksLog.objects.create(book_barcode='T2', book_title='Dune', auther='Herbert')
+
+    def wish(self, method, book_barcode):
+        body = json.dumps({'user_barcode': 'S1', 'book_barcode': book_barcode})
+        return getattr(self.client, method)('/api/wishlist/', body, content_type='application/json')
+
+    def test_one_entry_per_title(self):
+        self.wish('post', 'T1')
+        self.wish('post', 'T2')
+        self.assertEqual(WishlistEntry.objects.filter(user=self.student).count(), 1)
+        rows = self.client.get('/user-wishlist/?barcode=S1&fields=book_title,book_barcode,available,wishlist_users').json()
+        self.assertEqual(rows, [{'book_title': 'Dune', 'book_barcode': 'T2', 'available': True,
+                                 'wishlist_users': ['Asha Das']}])
+        self.wish('delete', 'T1')
+        self.assertFalse(WishlistEntry.objects.exists())
+
+    def test_students_are_resolved_like_other_endpoints(self):
+        # A bare "barcode" names the student only when no book_barcode is sent
+        body = {'barcode': 'S1', 'title': 'Dune', 'author': 'Herbert'}
+        response = self.client.post('/api/wishlist/', json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        for body in ({'email': 'ASHA@example.edu', 'book_barcode': 'T1'}, {'username': 'Asha Das', 'book_barcode': 'T1'}):
+            response = self.client.post('/api/wishlist/', json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 200, body)
+        # Without an identifier nobody is picked
+        response = self.client.post('/api/wishlist/', json.dumps({'book_barcode': 'T1'}), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+class CirculationTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create(barcode_number='S1', first_name='Asha', last_name='Das',
+                                           phone_number='1', email='asha@example.edu')
+        self.copy = BooksDetail.objects.create(book_barcode='C1', book_title='Dune', auther='Herbert')
+
+    def test_issue_and_return_are_recorded(self):
+        self.copy.user = self.student
+        self.copy.save()
+        self.copy.user = None
+        self.copy.save()
+        events = CirculationEvent.objects.filter(copy=self.copy).order_by('pk')
+        self.assertEqual([event.kind for event in events], ['issue', 'return'])
+        self.assertEqual({event.title_id for event in events}, {self.copy.title_id})
+        self.assertEqual(events[0].month, events[0].occurred_at.date().replace(day=1))
+
+    def test_desk_return_and_copy_return_are_one_event(self):
+        self.copy.user = self.student
+        self.copy.save()
+        desk = ReturnDesk.objects.create(student=self.student, book='Dune', fine=20, otp='123456')
+        self.copy.user = None
+        self.copy.save()
+        returns = CirculationEvent.objects.filter(kind='return')
+        self.assertEqual(returns.count(), 1)
+        self.assertEqual((returns[0].copy, returns[0].return_desk, returns[0].fine), (self.copy, desk, 20))
+        row = monthly_report(returns[0].occurred_at).get()
+        self.assertEqual((row['issues'], row['returns'], row['fines']), (1, 1, 20))
+
+    def test_copy_return_then_desk_return_are_one_event(self):
+        self.copy.user = self.student
+        self.copy.save()
+        self.copy.user = None
+        self.copy.save()
+        desk = ReturnDesk.objects.create(student=self.student, book='Dune', fine=20, otp='123456')
+        returns = CirculationEvent.objects.filter(kind='return')
+        self.assertEqual(returns.count(), 1)
+        self.assertEqual((returns[0].copy, returns[0].return_desk, returns[0].fine), (self.copy, desk, 20))
+        # Later edits of the desk row update that event
+        desk.fine = 30
+        desk.save()
+        self.assertEqual(returns.get().fine, 30)
+        row = monthly_report(returns[0].occurred_at).get()
+        self.assertEqual((row['issues'], row['returns'], row['fines']), (1, 1, 30))
+
+    def test_desk_return_of_an_ambiguous_title(self):
+        BooksLog.objects.create(book_barcode='E1', book_title='Emma', auther='Austen')
+        BooksLog.objects.create(book_barcode='E2', book_title='Emma', auther='Tennant')
+        ReturnDesk.objects.create(student=self.student, book='Emma', otp='123456')
+        ReturnDesk.objects.create(student=self.student, book='Dune', otp='123456')
+        titles = dict(CirculationEvent.objects.values_list('book_title', 'title_id'))
+        self.assertEqual(titles, {'Emma': None, 'Dune': self.copy.title_id})
+
+    def test_backfill_from_return_desk(self):
+        backfill = import_module('novalib.migrations.0017_circulation_event').backfill_from_return_desk
+        BooksLog.objects.create(book_barcode='E1', book_title='Emma', auther='Austen')
+        BooksLog.objects.create(book_barcode='E2', book_title='Emma', auther='Tennant')
+        ReturnDesk.objects.create(student=self.student, book='Emma', otp='123456')
+        ReturnDesk.objects.create(student=self.student, book='Dune', fine=20, otp='123456')
+        # The student has since borrowed another copy of Dune
+        self.copy.user = self.student
+        self.copy.save()
+        CirculationEvent.objects.all().delete()
+        backfill(django_apps, None)
+        events = CirculationEvent.objects.order_by('return_desk_id')
+        self.assertEqual([(event.book_title, event.title_id, event.copy_id, event.fine) for event in events],
+                         [('Emma', None, None, 0), ('Dune', self.copy.title_id, None, 20)])
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.titles = {}
+        for name in 'ABCD':
+            log = BooksLog.objects.create(book_barcode=f'T{name}', book_title=name, auther='X')
+            self.titles[name] = log.title
+        students = [User.objects.create(barcode_number=f'S{i}', first_name='S', last_name=str(i),
+                                        phone_number=str(i), email=f's{i}@example.edu') for i in range(5)]
+        wanted = ['ABD', 'AB', 'AC', 'AC', 'B']
+        for student, names in zip(students, wanted):
+            for name in names:
+                WishlistEntry.objects.create(user=student, title=self.titles[name])
+        # Borrowing a wished-for title still counts the student once
+        copy = BooksDetail.objects.create(book_barcode='CC', book_title='C', auther='X')
+        copy.user = students[2]
+        copy.save()
+
+    def test_neighbours_are_ranked_by_cosine_similarity(self):
+        call_command('build_recommendations', stdout=io.StringIO())
+        # A-C: 2 of 4 and 2 students; A-B: 2 of 4 and 3; A-D has a single student
+        rows = self.client.get('/api/recommendations/?book_barcode=TA').json()
+        self.assertEqual([row['book_title'] for row in rows], ['C', 'B'])
+        self.assertEqual(rows[0], {'book_title': 'C', 'book_author': 'X', 'book_barcode': 'TC',
+                                   'available': True, 'score': round(2 / (4 * 2) ** 0.5, 4)})
+        by_id = self.client.get(f'/api/recommendations/?title_id={self.titles["A"].pk}').json()
+        self.assertEqual(by_id, rows)
+        self.assertEqual(self.client.get('/api/recommendations/?book_barcode=missing').json(), [])
+        self.assertEqual(self.client.get('/api/recommendations/').status_code, 400)
+
+    def test_rebuild_replaces_the_table(self):
+        call_command('build_recommendations', '--min-support=1', '--top-k=1', stdout=io.StringIO())
+        self.assertEqual(TitleNeighbor.objects.filter(title=self.titles['A']).count(), 1)
+        # D's one student also wanted A (4 students) and B (3): the rarer B is closer
+        self.assertEqual(TitleNeighbor.objects.filter(title=self.titles['D']).get().neighbor, self.titles['B'])
+        WishlistEntry.objects.all().delete()
+        call_command('build_recommendations', stdout=io.StringIO())
+        self.assertFalse(TitleNeighbor.objects.exists())
+
+
+
+class PopularityTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.student = User.objects.create(barcode_number='S1', first_name='Asha', last_name='Das',
+                                           phone_number='1', email='asha@example.edu')
+        self.dune = BooksLog.objects.create(book_barcode='T1', book_title='Dune', auther='Herbert').title
+        self.emma = BooksLog.objects.create(book_barcode='T2', book_title='Emma', auther='Austen').title
+        self.copy = BooksDetail.objects.create(book_barcode='C1', book_title='Emma', auther='Austen')
+        BooksDetail.objects.create(book_barcode='C2', book_title='Dune', auther='Herbert')
+
+    def suggestions(self):
+        return [row['book_title'] for row in self.client.get('/book-suggestions/?search=e').json()]
+
+    def click(self, **body):
+        return self.client.post('/api/search-click/', json.dumps(body), content_type='application/json')
+
+    def test_events_reorder_suggestions(self):
+        add_to_wishlist(self.student.pk, self.dune.pk)
+        self.dune.refresh_from_db()
+        wished = self.dune.popularity
+        # Adding again is a no-op and doesn't count twice
+        add_to_wishlist(self.student.pk, self.dune.pk)
+        self.dune.refresh_from_db()
+        self.assertEqual(self.dune.popularity, wished)
+        self.assertEqual(self.suggestions(), ['Dune', 'Emma'])
+
+        self.copy.user = self.student
+        self.copy.save()
+        self.assertEqual(self.suggestions(), ['Emma', 'Dune'])
+        rows = self.client.get('/book-log/?search=e&fields=book_title').json()
+        self.assertEqual([row['book_title'] for row in rows], ['Emma', 'Dune'])
+
+        self.assertEqual(self.click(book_barcode='T1').status_code, 200)
+        self.assertEqual(self.click(book_title='Dune', book_author='Herbert').status_code, 200)
+        self.assertEqual(self.suggestions(), ['Dune', 'Emma'])
+        self.assertEqual(self.click(book_barcode='missing').status_code, 404)
+        self.assertEqual(self.click().status_code, 400)
+
+    def test_scores_decay(self):
+        earlier = timezone.now() - 2 * popularity.HALF_LIFE
+        popularity.record(popularity.LOAN, earlier, pk=self.dune.pk)
+        popularity.record(popularity.CLICK, pk=self.emma.pk)
+        self.dune.refresh_from_db()
+        self.assertAlmostEqual(popularity.decayed(self.dune.popularity), popularity.WEIGHTS['loan'] / 4, places=3)
+        # 3/4 of a loan two half-lives ago is less than a click now
+        self.assertEqual(self.suggestions(), ['Emma', 'Dune'])
+
+    def test_rebuild_recomputes_from_history(self):
+        add_to_wishlist(self.student.pk, self.dune.pk)
+        self.copy.user = self.student
+        self.copy.save()
+        expected = dict(Title.objects.values_list('pk', 'popularity'))
+        popularity.record(popularity.CLICK, pk=self.dune.pk)
+        call_command('rebuild_popularity', stdout=io.StringIO())
+        for pk, score in Title.objects.values_list('pk', 'popularity'):
+            self.assertAlmostEqual(score, expected[pk], delta=expected[pk] * 1e-9)
+
+
+class RefCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refcache.clear_local()
+        self.addCleanup(refcache.clear_local)
+        self.namespace = refcache.Namespace('test', timeout=60)
+
+    def test_second_read_is_a_local_hit(self):
+        compute = mock.Mock(return_value=['a'])
+        self.assertEqual(self.namespace.get_or_set('k', compute), ['a'])
+        self.assertEqual(self.namespace.get_or_set('k', compute), ['a'])
+        # Another process: nothing local, the shared tier has it
+        self.namespace.clear_local()
+        self.assertEqual(self.namespace.get_or_set('k', compute), ['a'])
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(self.namespace.stats, {'misses': 1, 'local_hits': 1, 'shared_hits': 1})
+
+    def test_local_tier_size_follows_settings(self):
+        with override_settings(NOVALIB_REFCACHE_LOCAL_ENTRIES=2):
+            for key in 'abc':
+                self.namespace.get_or_set(key, lambda: key)
+        self.assertEqual(len(self.namespace._local), 2)
+
+    def test_values_are_computed_on_the_primary(self):
+        # A lagging replica would put rows from before an invalidation back in the shared tier
+        db_router.reset_replica_health()
+        self.addCleanup(db_router.reset_replica_health)
+        with mock.patch.object(db_router, 'replica_aliases', return_value=['replica1']), \
+                mock.patch.object(db_router, 'replica_lag', return_value=0), db_router.use_replicas():
+            self.assertEqual(router.db_for_read(Department), 'replica1')
+            self.assertEqual(self.namespace.get_or_set('k', lambda: router.db_for_read(Department)), 'default')
+
+    def test_none_is_not_stored(self):
+        compute = mock.Mock(return_value=None)
+        self.namespace.get_or_set('k', compute)
+        self.namespace.get_or_set('k', compute)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_stale_value_served_while_another_caller_refreshes(self):
+        namespace = refcache.Namespace('test_stale', timeout=0, stale_for=60)
+        namespace.get_or_set('k', lambda: 'old')
+        namespace.clear_local()
+        # The refresh lock is held elsewhere
+        with mock.patch.object(refcache.cache, 'add', return_value=False):
+            self.assertEqual(namespace.get_or_set('k', lambda: 'new'), 'old')
+        self.assertEqual(namespace.get_or_set('k', lambda: 'new'), 'new')
+        self.assertEqual(namespace.stats['stale_hits'], 1)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.namespace.get_or_set('k', compute)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, ['value'] * 8))
+
+    def test_saves_invalidate_department_names(self):
+        department = Department.objects.create(name='Physics')
+        self.assertEqual(refcache.department_names(), {department.pk: 'Physics'})
+        department.name = 'Applied Physics'
+        department.save()
+        self.assertEqual(refcache.department_names(), {department.pk: 'Applied Physics'})
+
+    def test_user_lookup_follows_barcode_changes_only(self):
+        student = User.objects.create(barcode_number='S1', first_name='Asha', last_name='Das',
+                                      phone_number='1', email='asha@example.edu')
+        self.assertEqual(self.client.get('/api/fine-balance/?barcode=S1').json()['user_id'], student.pk)
+        student.otp = '123456'
+        student.save(update_fields=['otp'])
+        with self.assertNumQueries(1):
+            self.client.get('/api/fine-balance/?barcode=S1')
+        student.barcode_number = 'S2'
+        student.save()
+        self.assertEqual(self.client.get('/api/fine-balance/?barcode=S1').status_code, 404)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_concurrently(self, count, call):
+        results, errors = [], []
+
+        def run():
+            try:
+                results.append(call())
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_one_computation(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return ['dune']
+
+        results, _ = self.run_concurrently(8, lambda: singleflight.do('test', 'dune', compute))
+        self.assertEqual((len(calls), results), (1, [['dune']] * 8))
+        # Landed: the next call runs the query again
+        singleflight.do('test', 'dune', compute)
+        self.assertEqual(len(calls), 2)
+
+    def test_waiters_get_the_leaders_error(self):
+        def compute():
+            time.sleep(0.1)
+            raise ValueError('boom')
+
+        results, errors = self.run_concurrently(4, lambda: singleflight.do('test', 'boom', compute))
+        self.assertEqual((results, [str(error) for error in errors]), ([], ['boom'] * 4))
+
+    def test_interrupted_leader_releases_waiters(self):
+        class Interrupted(BaseException):
+            pass
+
+        started, calls = threading.Event(), []
+
+        def leader():
+            def compute():
+                started.set()
+                time.sleep(0.1)
+                raise Interrupted
+
+            try:
+                singleflight.do('test', 'dune', compute)
+            except Interrupted:
+                calls.append('interrupted')
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        started.wait()
+        self.assertEqual(singleflight.do('test', 'dune', lambda: ['own']), ['own'])
+        thread.join()
+        self.assertEqual(calls, ['interrupted'])
+
+    async def test_cancelled_async_leader_releases_waiters(self):
+        started = asyncio.Event()
+
+        async def stuck():
+            started.set()
+            await asyncio.sleep(60)
+
+        async def own():
+            return ['own']
+
+        leader = asyncio.create_task(singleflight.ado('test', 'dune', stuck))
+        await started.wait()
+        waiter = asyncio.create_task(singleflight.ado('test', 'dune', own))
+        await asyncio.sleep(0)
+        leader.cancel()
+        # Well before the wait timeout
+        self.assertEqual(await asyncio.wait_for(waiter, 1), ['own'])
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+
+    async def test_cancelled_async_waiter_leaves_the_flight(self):
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return ['dune']
+
+        leader = asyncio.create_task(singleflight.ado('test', 'dune', compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(singleflight.ado('test', 'dune', compute))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        self.assertEqual(await leader, ['dune'])
+
+    def test_waits_for_a_leader_in_another_process(self):
+        lock_key = singleflight._lock_key('test', 'dune')
+        cache.add(lock_key, 'other', 10)
+
+        def other_process():
+            time.sleep(0.1)
+            self.assertEqual(cache.get(f'{lock_key}:other:waiting'), 1)
+            cache.set(f'{lock_key}:other', ['from elsewhere'], 5)
+            cache.delete(lock_key)
+
+        thread = threading.Thread(target=other_process)
+        thread.start()
+        self.assertEqual(singleflight.do('test', 'dune', lambda: ['local']), ['from elsewhere'])
+        thread.join()
+
+    def test_key_ignores_case_whitespace_and_unrelated_parameters(self):
+        self.assertEqual(_flight_key({'search': ' dune ', '_': '123', 'email': ''}, BOOK_LOG_PARAMS),
+                         _flight_key({'search': 'dune'}, BOOK_LOG_PARAMS))
+        self.assertNotEqual(_flight_key({'search': 'dune', 'fields': 'book_title'}, BOOK_LOG_PARAMS),
+                            _flight_key({'search': 'dune'}, BOOK_LOG_PARAMS))
+        # Searches are case-insensitive, so case doesn't split a flight
+        self.assertEqual(_flight_key({'search': 'DUNE '}, BOOK_LOG_PARAMS),
+                         _flight_key({'search': 'dune'}, BOOK_LOG_PARAMS))
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.staff = get_user_model().objects.create_user('librarian', password='x', is_staff=True)
+
+    def upload(self, content=b'0123456789'):
+        notification = Notification.objects.create(
+            title='Closed on Friday', message='-', uploaded_by=self.staff,
+            uploaded_image=SimpleUploadedFile('poster.jpg', content),
+        )
+        return notification.uploaded_image.name
+
+    def test_identical_uploads_share_one_file(self):
+        name = self.upload()
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        self.assertEqual(name, f'images/{digest[:2]}/{digest}.jpeg')
+        self.assertEqual(media.content_hash(name), digest)
+        self.assertIsNone(media.content_hash('developer_notifications/WVY17251.jpeg'))
+        other = DeveloperNotification.objects.create(
+            title='Closed on Friday', message='-', uploaded_by=self.staff,
+            uploaded_image=SimpleUploadedFile('copy.jpeg', b'0123456789'),
+        )
+        self.assertEqual(other.uploaded_image.name, name)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'images', digest[:2])), [f'{digest}.jpeg'])
+
+        # Swept once the last notification that refers to it is gone
+        self.age(name)
+        Notification.objects.get().delete()
+        self.assertEqual(self.sweep(), [])
+        other.delete()
+        self.assertEqual(self.sweep(), [name])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+    def age(self, name, hours=48):
+        stamp = time.time() - hours * 3600
+        os.utime(os.path.join(self.media_root, name), (stamp, stamp))
+
+    def sweep(self):
+        return default_storage.sweep(image_in_use, 24 * 3600)
+
+    def test_replaced_image_is_swept(self):
+        notification = Notification.objects.get(uploaded_image=self.upload())
+        old_name = notification.uploaded_image.name
+        notification.uploaded_image = SimpleUploadedFile('new.jpeg', b'new poster')
+        notification.save()
+        self.age(old_name)
+        self.age(notification.uploaded_image.name)
+        out = io.StringIO()
+        call_command('sweep_media', stdout=out)
+        self.assertIn('Deleted 1 unused images.', out.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, old_name)))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, notification.uploaded_image.name)))
+
+    def test_recent_files_are_left_alone(self):
+        name = self.upload()
+        Notification.objects.all().delete()
+        # Not yet referenced by a committed row, as during another upload
+        self.assertEqual(self.sweep(), [])
+        self.age(name)
+        # Uploading the same bytes again renews the file before its row exists
+        self.upload()
+        Notification.objects.all().delete()
+        self.assertEqual(self.sweep(), [])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_dedupe_media_moves_older_files(self):
+        for model, name in ((Notification, 'notifications/AAA11111.jpeg'),
+                            (DeveloperNotification, 'developer_notifications/AAA11111.jpeg')):
+            os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as fh:
+                fh.write(b'poster')
+            model.objects.create(title='-', message='-', uploaded_by=self.staff, uploaded_image=name)
+        call_command('dedupe_media', stdout=io.StringIO())
+        names = {model.objects.get().uploaded_image.name for model in (Notification, DeveloperNotification)}
+        self.assertEqual(names, {f'images/{hashlib.sha256(b"poster").hexdigest()[:2]}/'
+                                 f'{hashlib.sha256(b"poster").hexdigest()}.jpeg'})
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'notifications')), [])
+
+    def test_hashed_files_are_immutable(self):
+        name = self.upload()
+        response = self.client.get(f'/media/{name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], f'"{media.content_hash(name)}"')
+        response = self.client.get(f'/media/{name}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        name = self.upload()
+        response = self.client.get(f'/media/{name}', HTTP_RANGE='bytes=2-5')
+        self.assertEqual((response.status_code, response.content), (206, b'2345'))
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        response = self.client.get(f'/media/{name}', HTTP_RANGE='bytes=-3')
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (206, b'789'))
+        self.assertEqual(response['Content-Length'], '3')
+        response = self.client.get(f'/media/{name}', HTTP_RANGE='bytes=20-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+        # A range of an older version is ignored
+        response = self.client.get(f'/media/{name}', HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_offload_to_the_front_server(self):
+        name = self.upload()
+        with mock.patch.object(media, 'MEDIA_OFFLOAD', 'x-accel-redirect'):
+            response = self.client.get(f'/media/{name}')
+        self.assertEqual((response.content, response['X-Accel-Redirect']), (b'', f'/protected-media/{name}'))
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_paths_outside_media_root_are_not_served(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/notifications/').status_code, 404)
+
+# Query budgets per request, including the session and auth lookups of
+# admin pages. Placeholders are filled from the generated library.
+VIEW_BUDGETS = {
+    'send_otp': ('post', '/api/send-otp/', {'barcode': '{student}'}, 3),
+    'verify_otp': ('post', '/api/verify-otp/', {'barcode': '{student}', 'otp': '000000'}, 1),
+    # with the title lock of enqueue_hold and the popularity UPDATE
+    'wishlist': ('post', '/wishlist/', {'user_barcode': '{student}', 'book_barcode': '{title}'}, 11),
+    'api_wishlist': ('delete', '/api/wishlist/', {'user_barcode': '{wisher}', 'book_barcode': '{wished}'}, 8),
+    'developer_notifications': ('get', '/notifications/', None, 1),
+    'library_notifications': ('get', '/library-notifications/', None, 1),
+    'book_log_list': ('get', '/book-log/?barcode={borrower}', None, 1),
+    'book_log_search': ('get', '/book-log/?search=a', None, 1),
+    'book_log_wishlist': ('get', '/book-log/?barcode={wisher}&wishlist=1', None, 1),
+    'user_wishlist': ('get', '/user-wishlist/?barcode={wisher}&fields=book_title,wishlist_users', None, 2),
+    'book_suggestions': ('get', '/book-suggestions/?search=a', None, 1),
+    'search_click': ('post', '/api/search-click/', {'book_barcode': '{title}'}, 1),
+    'book_recommendations': ('get', '/api/recommendations/?book_barcode={title}', None, 1),
+    'fine_balance': ('get', '/api/fine-balance/?barcode={fined}', None, 2),
+    'dashboard': ('get', '/api/dashboard/?barcode={borrower}', None, 6),
+    'mark_notifications_read': ('post', '/api/notifications/mark-read/', {'barcode': '{student}'}, 2),
+    'batch': ('post', '/api/batch/', {'barcode': '{wisher}', 'requests': [
+        {'op': 'wishlist.list'}, {'op': 'issued.list'}, {'op': 'books.search', 'search': 'a'},
+        {'op': 'suggestions', 'search': 'a'},
+    ]}, 15),  # the user, then a savepoint, query and release per operation
+    'catalog_snapshot': ('get', '/api/catalog/snapshot/', None, 3),
+    'catalog_changes': ('get', '/api/catalog/changes/?since=0', None, 3),
+    'metrics': ('get', '/metrics/', None, 0),
+}
+
+# Changelist and add-form budgets for every registered admin
+ADMIN_BUDGETS = {
+    'auth.group': (5, 4),
+    'auth.user': (6, 3),
+    'novalib.user': (7, 4),  # department names, once per process (novalib.refcache)
+    'novalib.bookslog': (5, 4),
+    'novalib.login': (4, 4),
+    'novalib.returndesk': (5, 5),
+    'novalib.department': (5, 3),
+    'novalib.notification': (5, 4),
+    'novalib.developernotification': (5, 4),
+    'novalib.booksdetail': (4, 6),
+    'novalib.fineledgerentry': (5, 3),
+    'novalib.holdrequest': (5, 3),
+    'novalib.wishlistentry': (5, 3),
+    'novalib.circulationevent': (6, 3),  # date_hierarchy reads the month range
+}
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every view and admin page runs a fixed number of queries. Run at two
+    library sizes so a budget that only holds for small pages fails.
+    """
+    library = SMALL_LIBRARY
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_library(**cls.library)
+        cls.staff = get_user_model().objects.create_superuser('budget', 'budget@example.edu', 'pw')
+        wished = WishlistEntry.objects.select_related('user').first()
+        cls.params = {
+            'student': User.objects.order_by('id').values_list('barcode_number', flat=True).first(),
+            'borrower': BooksDetail.objects.filter(user__isnull=False)
+                        .values_list('user__barcode_number', flat=True).first(),
+            'wisher': wished.user.barcode_number,
+            'wished': BooksLog.objects.filter(title=wished.title_id).values_list('book_barcode', flat=True).first(),
+            'title': BooksLog.objects.order_by('-id').values_list('book_barcode', flat=True).first(),
+            'fined': FineBalance.objects.values_list('user__barcode_number', flat=True).first(),
+        }
+
+    def setUp(self):
+        # Count everything on the primary, where the fixture lives
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fill(self, value):
+        if isinstance(value, str):
+            return value.format(**self.params)
+        if isinstance(value, dict):
+            return {key: self.fill(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.fill(item) for item in value]
+        return value
+
+    def assertWithinBudget(self, label, budget, method, path, body=None):
+        kwargs = {'content_type': 'application/json', 'data': json.dumps(self.fill(body))} if body else {}
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(self.fill(path), **kwargs)
+        self.assertLess(response.status_code, 500, label)
+        if len(queries) > budget:
+            self.fail(f"{label}: {len(queries)} queries, budget {budget}:\n" +
+                      "\n".join(query['sql'] for query in queries.captured_queries))
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in get_resolver('novalib.urls').url_patterns}
+        self.assertEqual(names - set(VIEW_BUDGETS), set())
+
+    def test_view_budgets(self):
+        for label, (method, path, body, budget) in VIEW_BUDGETS.items():
+            with self.subTest(label):
+                self.assertWithinBudget(label, budget, method, path, body)
+
+    def test_admin_budgets(self):
+        self.client.force_login(self.staff)
+        registered = {model._meta.label_lower for model in admin.site._registry}
+        self.assertEqual(registered - set(ADMIN_BUDGETS), set())
+        for label, (changelist, add) in ADMIN_BUDGETS.items():
+            app_label, model_name = label.split('.')
+            url = f'/admin/{app_label}/{model_name}/'
+            with self.subTest(label):
+                self.assertWithinBudget(f'{label} changelist', changelist, 'get', url)
+                self.assertWithinBudget(f'{label} add', add, 'get', url + 'add/')
+
+
+class LargerLibraryQueryBudgetTests(QueryBudgetTests):
+    # More than one admin page (100 rows) of students and titles
+    library = dict(departments=6, users=250, titles=180, copies=1500, wishlists=600,
+                   fines=150, logins=400, notifications=40)
+
+
+class CatalogSyncTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.student = User.objects.create(barcode_number='S1')
+        BooksLog.objects.create(book_barcode='T1', book_title='Dune', auther='Herbert')
+        self.copy = BooksDetail.objects.create(book_barcode='C1', book_title='Dune', auther='Herbert')
+        BooksDetail.objects.create(book_barcode='C2', book_title='Dune', auther='Herbert', user=self.student,
+                                   avalible=False)
+
+    def changes(self, since):
+        response = self.client.get(f'/api/catalog/changes/?since={since}')
+        return response.status_code, response.json()
+
+    def test_snapshot(self):
+        snapshot = self.client.get('/api/catalog/snapshot/').json()
+        self.assertEqual(snapshot['version'], catalog.current_version())
+        self.assertEqual(snapshot['titles'], [['Dune', 'Herbert', 1, 2]])
+        unchanged = self.client.get(f"/api/catalog/snapshot/?version={snapshot['version']}").json()
+        self.assertEqual(unchanged, {'version': snapshot['version'], 'unchanged': True})
+
+    def test_delta_after_a_loan(self):
+        version = catalog.current_version()
+        self.copy.user = self.student
+        self.copy.save()
+        status, delta = self.changes(version)
+        self.assertEqual(status, 200)
+        self.assertEqual((delta['upserts'], delta['deletes'], delta['more']), ([['Dune', 'Herbert', 0, 2]], [], False))
+        self.assertEqual(delta['version'], catalog.current_version())
+        # Synced: nothing new, same version
+        self.assertEqual(self.changes(delta['version'])[1]['upserts'], [])
+        self.assertEqual(self.changes(delta['version'])[1]['version'], delta['version'])
+
+    def test_deleted_title(self):
+        version = catalog.current_version()
+        BooksLog.objects.create(book_barcode='T2', book_title='Emma', auther='Austen').delete()
+        delta = self.changes(version)[1]
+        self.assertEqual((delta['upserts'], delta['deletes']), ([], [['Emma', 'Austen']]))
+
+    @override_settings(NOVALIB_CATALOG_DELTA_MAX_CHANGES=1)
+    def test_paging(self):
+        version = catalog.current_version()
+        for barcode, title in (('T2', 'Emma'), ('T3', 'Ulysses'), ('T4', 'Walden')):
+            BooksLog.objects.create(book_barcode=barcode, book_title=title, auther='-')
+        pages, delta = [], {'version': version, 'more': True}
+        while delta['more']:
+            delta = self.changes(delta['version'])[1]
+            pages.append([row[0] for row in delta['upserts']])
+        self.assertEqual(pages, [['Emma'], ['Ulysses'], ['Walden']])
+        self.assertEqual(delta['version'], catalog.current_version())
+
+    def test_reset(self):
+        for barcode in ('C3', 'C4'):
+            BooksDetail.objects.create(book_barcode=barcode, book_title='Dune', auther='Herbert')
+        version = catalog.current_version()
+        catalog.prune_changes(version)
+        self.assertEqual(list(CatalogChange.objects.values_list('version', flat=True)), [version])
+        # Older than every row left, or from the future
+        for since in (0, version - 2, version + 1):
+            status, delta = self.changes(since)
+            self.assertEqual((status, delta), (410, {'version': version, 'reset': True}))
+        self.assertEqual(self.changes(version - 1)[0], 200)
+
+    def test_versions_follow_the_counter(self):
+        version = catalog.current_version()
+        with transaction.atomic():
+            catalog.record_catalog_change('Dune', 'Herbert')
+            transaction.set_rollback(True)
+        # A rolled back change hands its version back
+        self.assertEqual(catalog.current_version(), version)
+        change = catalog.record_catalog_change('Dune', 'Herbert')
+        self.assertEqual(change.version, version + 1)
+        self.assertEqual(catalog.current_version(), version + 1)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = get_user_model().objects.create_user('librarian', password='x', is_staff=True)
+
+    def test_header_needs_staff(self):
+        self.client.force_login(get_user_model().objects.create_user('visitor', password='x'))
+        response = self.client.get('/book-log/', HTTP_X_NOVALIB_PROFILE='1')
+        self.assertNotIn('X-Novalib-Profile-Id', response.headers)
+
+    def test_staff_request_is_stored(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/book-log/?search=a', HTTP_X_NOVALIB_PROFILE='1')
+        entry = profiling.get_profile(response.headers['X-Novalib-Profile-Id'])
+        self.assertEqual(entry['path'], '/book-log/?search=a')
+        self.assertIn('novalib_booksdetail', entry['sql'][-1]['sql'])
+        self.assertTrue(entry['top'])
+
+    def test_token_is_bound_to_its_path(self):
+        self.client.force_login(self.staff)
+        url = profiling.profile_url('/book-log/', self.staff)
+        self.assertIn('X-Novalib-Profile-Id', self.client.get(url).headers)
+        token = url.split('_profile=', 1)[1]
+        response = self.client.get(f'/book-suggestions/?_profile={token}')
+        self.assertNotIn('X-Novalib-Profile-Id', response.headers)
+
+    def test_token_is_bound_to_its_user(self):
+        url = profiling.profile_url('/book-log/', self.staff)
+        # A leaked link: anonymous, or another staff member
+        self.assertNotIn('X-Novalib-Profile-Id', self.client.get(url).headers)
+        self.client.force_login(get_user_model().objects.create_user('clerk', password='x', is_staff=True))
+        self.assertNotIn('X-Novalib-Profile-Id', self.client.get(url).headers)
+
+    async def test_async_staff_request_is_stored(self):
+        await self.async_client.aforce_login(self.staff)
+        with override_settings(ROOT_URLCONF=AsyncUrlconf):
+            response = await self.async_client.get('/book-suggestions/?search=a', headers={'X-Novalib-Profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        entry = await sync_to_async(profiling.get_profile)(response.headers['X-Novalib-Profile-Id'])
+        self.assertEqual((entry['path'], entry['user']), ('/book-suggestions/?search=a', 'librarian'))
+
+
+# Hot ORM queries, built as the views and admin build them, with users
+# resolved by id. Each takes the ids picked in QueryPlanTests and returns
+# a queryset; none may read a table in full.
+HOT_QUERIES = {
+    'issued_books': lambda p: _book_log_query({}, User.objects.filter(pk=p['borrower']))[0],
+    'wishlist': lambda p: wishlist_entries(User.objects.filter(pk=p['wisher'])).values('book_title', 'book_barcode', 'avalible'),
+    'wishlist_users': lambda p: wishers([p['title']]),
+    'title_copies': lambda p: BooksDetail.objects.filter(title_id=p['title']),
+    'title_available': lambda p: BooksDetail.objects.filter(title_id=p['title'], user__isnull=True, avalible=True),
+    'hold_queue_head': lambda p: HoldRequest.objects.filter(title_id=p['title'],
+                                                            status=HoldRequest.WAITING).order_by('position')[:1],
+    'last_login': lambda p: Login.objects.filter(user_id=p['borrower']).order_by('-login_time')[:1],
+    'notification_feed': lambda p: Notification.objects.order_by('-created_at')[:20],
+    'suggestions': lambda p: _suggestion_query(p['book_title'][:3]),
+    'book_search': lambda p: _book_log_query({'search': p['book_title'][:3]}, None)[0],
+    'notifications_unread': lambda p: Notification.objects.filter(created_at__gt=p['since']),
+    'developer_notifications_unread': lambda p: DeveloperNotification.objects.filter(created_at__gt=p['since']),
+    'user_by_email': lambda p: User.objects.filter(email=p['email']),
+    'user_by_email_iexact': lambda p: User.objects.filter(email__iexact=p['email']),
+    'fine_history': lambda p: FineLedgerEntry.objects.filter(user_id=p['borrower']).order_by('-created_at'),
+    'circulation_user': lambda p: user_history(p['borrower']),
+    'circulation_month': lambda p: monthly_report(p['since']),
+    'recommendations_by_barcode': lambda p: neighbors(book_barcode=p['book_barcode']),
+}
+# Only planned through an index where the backend can do that (see queryplan.iexact_uses_index)
+IEXACT_QUERIES = {'user_by_email_iexact'}
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN every hot query against a generated library: no full table scans."""
+    library = SMALL_LIBRARY
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_library(**cls.library)
+        borrower = BooksDetail.objects.filter(user__isnull=False).select_related('user', 'title').first()
+        cls.params = {
+            'borrower': borrower.user_id,
+            'wisher': WishlistEntry.objects.values_list('user_id', flat=True).first(),
+            'title': borrower.title_id,
+            'book_title': borrower.title.book_title,
+            'auther': borrower.title.auther,
+            'book_barcode': BooksLog.objects.values_list('book_barcode', flat=True).last(),
+            'email': borrower.user.email,
+            'since': Notification.objects.order_by('created_at').values_list('created_at', flat=True).first(),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, build in HOT_QUERIES.items():
+            with self.subTest(name):
+                if name in IEXACT_QUERIES and not queryplan.iexact_uses_index():
+                    self.skipTest(f'{connection.vendor} can\'t serve __iexact from an index')
+                queryset = build(self.params)
+                self.assertEqual(queryplan.full_table_scans(queryset), [],
+                                 f'{name} reads a table in full:\n{queryset.explain()}')
+
+    def test_search_ranks_titles_from_the_popularity_index(self):
+        if not queryplan.sorts_by_group():
+            self.skipTest(f'{connection.vendor} sorts the whole search result')
+        queryset = HOT_QUERIES['book_search'](self.params)
+        self.assertFalse(queryplan.sorts_all_rows(queryset), f'search sorts every match:\n{queryset.explain()}')
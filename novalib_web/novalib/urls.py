@@ -1,16 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+# Under ASGI (NOVALIB_ASYNC_VIEWS on) the read-heavy endpoints and OTP
+# dispatch are served by their async variants at the same paths
+read_views = async_views if getattr(settings, 'NOVALIB_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
     # ...existing code...
-    path('api/send-otp/', views.send_otp, name='send_otp'),
+    path('api/send-otp/', read_views.send_otp, name='send_otp'),
     path('api/verify-otp/', views.verify_otp, name='verify_otp'),
     path('wishlist/', views.wishlist, name='wishlist'),
     path('api/wishlist/', views.wishlist, name='api_wishlist'), # Wishlist endpoints
-    path('notifications/', views.DeveloperNotifications, name='developer_notifications'),
-    path('library-notifications/', views.notifications, name='library_notifications'),
-    path('book-log/', views.book_log_list, name='book_log_list'),
-    path('user-wishlist/', views.user_wishlist, name='user_wishlist'),
-    path('book-suggestions/', views.book_suggestions, name='book_suggestions'),
+    path('notifications/', read_views.DeveloperNotifications, name='developer_notifications'),
+    path('library-notifications/', read_views.notifications, name='library_notifications'),
+    path('book-log/', read_views.book_log_list, name='book_log_list'),
+    path('user-wishlist/', read_views.user_wishlist, name='user_wishlist'),
+    path('book-suggestions/', read_views.book_suggestions, name='book_suggestions'),
+    path('api/search-click/', views.search_click, name='search_click'),
+    path('api/recommendations/', views.book_recommendations, name='book_recommendations'),
+    path('api/fine-balance/', views.fine_balance, name='fine_balance'),
+    path('api/dashboard/', views.dashboard, name='dashboard'),
+    path('api/notifications/mark-read/', views.mark_notifications_read, name='mark_notifications_read'),
+    path('api/batch/', views.batch, name='batch'),
+    path('api/catalog/snapshot/', views.catalog_snapshot, name='catalog_snapshot'),
+    path('api/catalog/changes/', views.catalog_changes, name='catalog_changes'),
+    path('metrics/', views.metrics_endpoint, name='metrics'),
     # ...existing code...
 ]
\ No newline at end of file
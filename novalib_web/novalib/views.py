@@ -1,14 +1,26 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.core.mail import send_mail
 from novalib.models import User, Login, Notification, DeveloperNotification
-from novalib.models import BooksLog  # fixed import
+from novalib.models import BooksLog, BooksDetail, HoldRequest, Title, WishlistEntry  # fixed import
+from novalib.fines import get_fine_balance
+from novalib.holds import enqueue_hold, cancel_hold
+from novalib.wishlists import add_to_wishlist, remove_from_wishlist, wishers, wishlist_entries, with_catalog_entry
+from novalib.api import FastJsonResponse, selected_fields, project
+from novalib import catalog, metrics, popularity, recommendations, singleflight
+from novalib.refcache import NOTIFICATION_FEEDS, USER_IDS
+from novalib.db_router import replica_reads
 from django.utils.timezone import now, timedelta
-from django.db.models import Q
+from django.utils.crypto import constant_time_compare
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Prefetch
 import json
+import logging
 import random
 
+logger = logging.getLogger(__name__)
+
 @csrf_exempt
 def ping(request):
     return JsonResponse({'status': 'ok', 'message': 'Django server is running'})
@@ -16,6 +28,71 @@ def ping(request):
 def generate_otp():
     return str(random.randint(100000, 999999))
 
+def _otp_email(user, otp):
+    """Build the verification email (text + HTML) carrying `otp` for `user`."""
+    subject = "NovaLib verification code"
+
+    # Plain text message remains the same
+    message = (
+        f"Please verify your identity, {user.first_name}\n\n"
+        f"Here is your NovaLib verification code:\n\n"
+        f"{otp}\n\n"
+        f"This code is valid for 15 minutes and can only be used once.\n\n"
+        f"Please don't share this code with anyone: we'll never ask for it on the phone "
+        f"or via email.\n\n"
+        f"Thanks,\n"
+        f"The NovaLib Team"
+    )
+
+    # Updated HTML message with copy functionality
+    html_message = f"""
+    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+        <img src="https://auslogo.link" alt="NovaLib Logo" style="display: block; margin: 0 auto; width: 50px;">
+        <h2 style="text-align: center; color: #333;">Please verify your identity, {user.first_name}</h2>
+        <div style="background-color: #f9f9f9; border: 1px solid #ddd; border-radius: 5px; padding: 20px; margin: 20px 0;">
+            <p style="text-align: center; margin-bottom: 10px;">Here is your NovaLib verification code:</p>
+
+            <!-- Code container with copy button styling -->
+            <div style="position: relative; max-width: 300px; margin: 0 auto;">
+                <!-- The OTP code with special styling -->
+                <div style="background-color: #fff; border: 1px solid #ddd; border-radius: 4px; padding: 12px; 
+                            text-align: center; font-family: monospace; font-size: 24px; font-weight: bold; 
+                            letter-spacing: 4px; margin-bottom: 10px;">
+                    {otp}
+                </div>
+
+                <!-- Copy button with instructions -->
+                <a href="https://novalib-aus.web.app/copy?code={otp}" 
+                   style="display: block; text-align: center; background-color: #2EA44F; color: white; 
+                          text-decoration: none; padding: 8px 16px; border-radius: 4px; font-weight: bold; 
+                          margin: 0 auto; width: 100px;">
+                    Copy Code
+                </a>
+                <p style="text-align: center; color: #666; font-size: 12px; margin-top: 8px;">
+                    Click the button above to open a page where you can easily copy your code
+                </p>
+            </div>
+        </div>
+        <p>This code is valid for <strong>5 minutes</strong> and can only be used once.</p>
+        <p><strong>Please don't share this code with anyone:</strong> we'll never ask for it on the phone or via email.</p>
+        <hr style="border: none; border-top: 1px solid #eee; margin: 20px 0;">
+        <p>Thanks,<br>The NovaLib Team</p>
+
+        <!-- Alternative manual copy instructions -->
+        <div style="font-size: 12px; color: #666; margin-top: 20px;">
+            <p>If the button doesn't work, you can manually copy this code: <strong>{otp}</strong></p>
+        </div>
+    </div>
+    """
+
+    from_email = "sayan.kumar.roy@aus.ac.in"
+
+    # Email with both text and HTML versions
+    from django.core.mail import EmailMultiAlternatives
+    msg = EmailMultiAlternatives(subject, message, from_email, [user.email])
+    msg.attach_alternative(html_message, "text/html")
+    return msg
+
 @csrf_exempt
 def send_otp(request):
     if request.method == 'POST':
@@ -25,73 +102,12 @@ def send_otp(request):
         try:
             user = User.objects.get(barcode_number=barcode)
             email = user.email
-            subject = "NovaLib verification code"
-            
-            # Plain text message remains the same
-            message = (
-                f"Please verify your identity, {user.first_name}\n\n"
-                f"Here is your NovaLib verification code:\n\n"
-                f"{otp}\n\n"
-                f"This code is valid for 15 minutes and can only be used once.\n\n"
-                f"Please don't share this code with anyone: we'll never ask for it on the phone "
-                f"or via email.\n\n"
-                f"Thanks,\n"
-                f"The NovaLib Team"
-            )
-            
-            # Updated HTML message with copy functionality
-            html_message = f"""
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-                <img src="https://auslogo.link" alt="NovaLib Logo" style="display: block; margin: 0 auto; width: 50px;">
-                <h2 style="text-align: center; color: #333;">Please verify your identity, {user.first_name}</h2>
-                <div style="background-color: #f9f9f9; border: 1px solid #ddd; border-radius: 5px; padding: 20px; margin: 20px 0;">
-                    <p style="text-align: center; margin-bottom: 10px;">Here is your NovaLib verification code:</p>
-                    
-                    <!-- Code container with copy button styling -->
-                    <div style="position: relative; max-width: 300px; margin: 0 auto;">
-                        <!-- The OTP code with special styling -->
-                        <div style="background-color: #fff; border: 1px solid #ddd; border-radius: 4px; padding: 12px; 
-                                    text-align: center; font-family: monospace; font-size: 24px; font-weight: bold; 
-                                    letter-spacing: 4px; margin-bottom: 10px;">
-                            {otp}
-                        </div>
-                        
-                        <!-- Copy button with instructions -->
-                        <a href="https://novalib-aus.web.app/copy?code={otp}" 
-                           style="display: block; text-align: center; background-color: #2EA44F; color: white; 
-                                  text-decoration: none; padding: 8px 16px; border-radius: 4px; font-weight: bold; 
-                                  margin: 0 auto; width: 100px;">
-                            Copy Code
-                        </a>
-                        <p style="text-align: center; color: #666; font-size: 12px; margin-top: 8px;">
-                            Click the button above to open a page where you can easily copy your code
-                        </p>
-                    </div>
-                </div>
-                <p>This code is valid for <strong>5 minutes</strong> and can only be used once.</p>
-                <p><strong>Please don't share this code with anyone:</strong> we'll never ask for it on the phone or via email.</p>
-                <hr style="border: none; border-top: 1px solid #eee; margin: 20px 0;">
-                <p>Thanks,<br>The NovaLib Team</p>
-                
-                <!-- Alternative manual copy instructions -->
-                <div style="font-size: 12px; color: #666; margin-top: 20px;">
-                    <p>If the button doesn't work, you can manually copy this code: <strong>{otp}</strong></p>
-                </div>
-            </div>
-            """
-            
-            from_email = "sayan.kumar.roy@aus.ac.in"
-            
-            # Send email with both text and HTML versions
-            from django.core.mail import EmailMultiAlternatives
-            msg = EmailMultiAlternatives(subject, message, from_email, [email])
-            msg.attach_alternative(html_message, "text/html")
-            msg.send(fail_silently=False)
+            _otp_email(user, otp).send(fail_silently=False)
 
             # Store OTP and timestamp in the database
             user.otp = otp
             user.otp_created_at = now()
-            user.save()
+            user.save(update_fields=['otp', 'otp_created_at'])
 
             # Capture the user's IP address
             ip_address = get_client_ip(request)
@@ -137,170 +153,195 @@ def verify_otp(request):
             return JsonResponse({'error': 'No login record found for this user'}, status=400)
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
-def DeveloperNotifications(request):
-    notifications = DeveloperNotification.objects.all().order_by('-created_at')
-    data = []
-    for notification in notifications:
-        uploaded_by = notification.uploaded_by
-        if hasattr(uploaded_by, "get_full_name") and callable(uploaded_by.get_full_name):
-            uploaded_by_name = uploaded_by.get_full_name()
-            if not uploaded_by_name.strip():
-                uploaded_by_name = getattr(uploaded_by, "username", str(uploaded_by))
-        elif hasattr(uploaded_by, "username"):
-            uploaded_by_name = uploaded_by.username
-        else:
-            uploaded_by_name = str(uploaded_by)
-
-        image_url = ""
-        if notification.uploaded_image:
-            image_url = request.build_absolute_uri(notification.uploaded_image.url)
+def _uploaded_by_name(row):
+    # Same fallbacks as auth User.get_full_name() -> username
+    name = f"{row['uploaded_by__first_name'] or ''} {row['uploaded_by__last_name'] or ''}".strip()
+    return name or row['uploaded_by__username'] or ''
+
+def _notification_fields(request, model):
+    storage = model._meta.get_field('uploaded_image').storage
+    return {
+        'title': 'title',
+        'message': 'message',
+        'uploaded_by': (
+            ('uploaded_by__first_name', 'uploaded_by__last_name', 'uploaded_by__username'),
+            _uploaded_by_name,
+        ),
+        'uploaded_image': (
+            ('uploaded_image',),
+            lambda row: request.build_absolute_uri(storage.url(row['uploaded_image'])) if row['uploaded_image'] else '',
+        ),
         # Format timestamp as "Monday 14:30"
-        if hasattr(notification, "created_at") and notification.created_at:
-            timestamp = notification.created_at.strftime("%A %H:%M")
-        else:
-            timestamp = ""
-        data.append({
-            "title": notification.title,
-            "message": notification.message,
-            "uploaded_by": uploaded_by_name,
-            "uploaded_image": image_url,
-            "timestamp": timestamp,
-        })
-    return JsonResponse(data, safe=False)
+        'timestamp': (
+            ('created_at',),
+            lambda row: row['created_at'].strftime("%A %H:%M") if row['created_at'] else '',
+        ),
+    }
+
+def _notification_feed(request, model):
+    """
+    Shared body of the two notification feeds. Supports ?fields= (title,
+    message, uploaded_by, uploaded_image, timestamp); the uploader is only
+    joined when uploaded_by is requested.
+    """
+    return FastJsonResponse(_notification_rows(request, model))
+
+def _notification_rows(request, model):
+    notifications, field_map, fields = _notification_query(request, model)
+    # Image URLs are absolute, so the rows are cached per host
+    key = (model._meta.label, tuple(fields), request.scheme, request.get_host())
+    return NOTIFICATION_FEEDS.get_or_set(key, lambda: project(notifications, field_map, fields))
+
+def _notification_query(request, model):
+    field_map = _notification_fields(request, model)
+    fields = selected_fields(request.GET, field_map)
+    notifications = model.objects.all().order_by('-created_at')
+    return notifications, field_map, fields
+
+@replica_reads
+def DeveloperNotifications(request):
+    return _notification_feed(request, DeveloperNotification)
 
+@replica_reads
 def notifications(request):
-    notifications = Notification.objects.all().order_by('-created_at')
-    data = []
-    for notification in notifications:
-        uploaded_by = notification.uploaded_by
-        if hasattr(uploaded_by, "get_full_name") and callable(uploaded_by.get_full_name):
-            uploaded_by_name = uploaded_by.get_full_name()
-            if not uploaded_by_name.strip():
-                uploaded_by_name = getattr(uploaded_by, "username", str(uploaded_by))
-        elif hasattr(uploaded_by, "username"):
-            uploaded_by_name = uploaded_by.username
-        else:
-            uploaded_by_name = str(uploaded_by)
-
-        image_url = ""
-        if notification.uploaded_image:
-            image_url = request.build_absolute_uri(notification.uploaded_image.url)
-        # Format timestamp as "Monday 14:30"
-        if hasattr(notification, "created_at") and notification.created_at:
-            timestamp = notification.created_at.strftime("%A %H:%M")
-        else:
-            timestamp = ""
-        data.append({
-            "title": notification.title,
-            "message": notification.message,
-            "uploaded_by": uploaded_by_name,
-            "uploaded_image": image_url,
-            "timestamp": timestamp,
-        })
-    return JsonResponse(data, safe=False)
+    return _notification_feed(request, Notification)
+
+def _parse_bool(value):
+    value = (value or '').strip().lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    return None
+
+def _issuer_name(row):
+    return f"{row['user__first_name'] or ''} {row['user__last_name'] or ''}".strip()
+
+# Output fields of /book-log/ for copies (BooksDetail)
+BOOK_LOG_FIELDS = {
+    'book_title': 'book_title',
+    'book_author': 'auther',
+    'book_barcode': 'book_barcode',
+    # normalize backend 'avalible' typo to a stable 'available' flag
+    'available': (('avalible',), lambda row: bool(row['avalible'])),
+    'issued_date': 'issued_date',
+    'return_date': 'return_date',
+    'username': (('user__first_name', 'user__last_name'), _issuer_name),
+}
+
+# Same output shape for wishlist rows (wishlist entries have no loan columns)
+BOOK_LOG_WISHLIST_FIELDS = dict(
+    BOOK_LOG_FIELDS,
+    issued_date=((), lambda row: None),
+    return_date=((), lambda row: None),
+    username=((), lambda row: ''),
+)
+
+# Parameters that shape the book_log_list response: concurrent requests that
+# agree on these run one query (novalib.singleflight)
+BOOK_LOG_PARAMS = ('search', 'wishlist', 'avalible', 'fields', 'username', 'barcode', 'barcode_number',
+                   'email', 'user_id')
+
+def _search_term(value):
+    # Searches are icontains, so terms differing only in case find the same
+    # rows; queries and single-flight keys both use the folded term
+    return (value or '').strip().casefold()
+
+def _flight_key(params, names):
+    """
+    The request's query for single-flight: the stripped values of `names`
+    that are set, with the search term folded as the query uses it.
+    """
+    values = ((name, _search_term(params.get(name)) if name == 'search' else (params.get(name) or '').strip())
+              for name in names)
+    return tuple((name, value) for name, value in values if value)
 
 @csrf_exempt
+@replica_reads
 def book_log_list(request):
     """
-    API endpoint to list/search issued books from BooksLog.
+    API endpoint to list/search book copies (BooksDetail).
     Supports user filters via:
       - ?username= (full display name)
       - ?barcode= or ?barcode_number=
       - ?email=
       - ?user_id=
     And optional ?search= for title/author/barcode.
-    If a user is resolved, return only that user's issued books (avalible=False).
-    Otherwise, return global list (optionally filtered by ?search).
+    If a user is resolved, return only that user's issued books (avalible=False),
+    or their wishlist with ?wishlist=1.
+    Otherwise, return global list (optionally filtered by ?search, most
+    popular titles first).
+    ?fields=book_title,available,... limits the columns fetched and returned.
+    Identical concurrent requests share one query.
     """
     if request.method == 'GET':
-        search = (request.GET.get('search') or '').strip()
-        username = (request.GET.get('username') or '').strip()
-        barcode = (request.GET.get('barcode') or request.GET.get('barcode_number') or '').strip()
-        email = (request.GET.get('email') or '').strip()
-        user_id = (request.GET.get('user_id') or '').strip()
-        wishlist_param = (request.GET.get('wishlist') or '').strip().lower()
-        avalible_param = (request.GET.get('avalible') or '').strip().lower()
-
-        logs = BooksLog.objects.all().order_by('-issued_date')
-
         # Resolve users first if any identifier is provided
-        users_qs = None
-        if barcode or user_id or email or username:
-            users = User.objects.all()
-            q = Q()
-            if barcode:
-                q |= Q(barcode_number__iexact=barcode)
-            if user_id.isdigit():
-                q |= Q(id=int(user_id))
-            if email:
-                q |= Q(email__iexact=email)
-            if username:
-                parts = [p for p in username.split() if p]
-                if len(parts) >= 2:
-                    q |= (Q(first_name__iexact=parts[0]) & Q(last_name__iexact=parts[-1]))
-                # broaden username matching (either name part matches)
-                q |= Q(first_name__icontains=username) | Q(last_name__icontains=username)
-                # also try if someone passes barcode/email via username param
-                q |= Q(barcode_number__iexact=username) | Q(email__iexact=username)
-            users_qs = users.filter(q)
-
-        # Parse avalible filter if provided
-        avalible_value = None
-        if avalible_param in ('1', 'true', 'yes'):
-            avalible_value = True
-        elif avalible_param in ('0', 'false', 'no'):
-            avalible_value = False
-
-        # Wishlist branch
-        if users_qs is not None and wishlist_param in ('1', 'true', 'yes'):
-            logs = BooksLog.objects.filter(wishlist__in=users_qs).distinct()
-            if search:
-                logs = logs.filter(
-                    Q(book_title__icontains=search) |
-                    Q(auther__icontains=search) |
-                    Q(book_barcode__icontains=search)
-                )
-        # Issued-books branch
-        elif users_qs is not None:
-            logs = logs.filter(user__in=users_qs)
-            # default to issued (avalible=False) unless explicitly overridden
-            if avalible_value is None:
-                logs = logs.filter(avalible=False)
-            else:
-                logs = logs.filter(avalible=avalible_value)
-            if search:
-                logs = logs.filter(
-                    Q(book_title__icontains=search) |
-                    Q(auther__icontains=search) |
-                    Q(book_barcode__icontains=search)
-                )
-        else:
-            # Global listing/search (no user identified)
-            if avalible_value is not None:
-                logs = logs.filter(avalible=avalible_value)
-            if search:
-                logs = logs.filter(
-                    Q(book_title__icontains=search) |
-                    Q(auther__icontains=search) |
-                    Q(book_barcode__icontains=search)
-                )
-
-        data = []
-        for log in logs:
-            data.append({
-                'book_title': getattr(log, 'book_title', ''),
-                'book_author': getattr(log, 'auther', ''),
-                'book_barcode': getattr(log, 'book_barcode', ''),
-                # normalize backend 'avalible' typo to a stable 'available' flag
-                'available': bool(getattr(log, 'avalible', False)),
-                'issued_date': getattr(log, 'issued_date', None),
-                'return_date': getattr(log, 'return_date', None),
-                'username': (f"{getattr(log.user, 'first_name', '')} {getattr(log.user, 'last_name', '')}").strip() if getattr(log, 'user', None) else '',
-            })
-        return JsonResponse(data, safe=False)
+        user_q = _user_lookup_q(request.GET)
+        users_qs = User.objects.filter(user_q) if user_q else None
+        rows = singleflight.do('book_log', _flight_key(request.GET, BOOK_LOG_PARAMS),
+                               lambda: _book_log_rows(request.GET, users_qs))
+        return FastJsonResponse(rows)
 
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+def _book_log_rows(params, users_qs):
+    """Rows for book_log_list; `users_qs` is None when no user was identified."""
+    return project(*_book_log_query(params, users_qs))
+
+def _book_log_query(params, users_qs):
+    """(queryset, field_map, fields, extra_columns) to project for book_log_list."""
+    search = _search_term(params.get('search'))
+    wishlist_param = _parse_bool(params.get('wishlist'))
+    avalible_value = _parse_bool(params.get('avalible'))
+
+    search_q = Q()
+    if search:
+        search_q = (
+            Q(book_title__icontains=search) |
+            Q(auther__icontains=search) |
+            Q(book_barcode__icontains=search)
+        )
+
+    # Wishlist branch
+    if users_qs is not None and wishlist_param:
+        field_map = BOOK_LOG_WISHLIST_FIELDS
+        # distinct() only matters when several students matched the lookup
+        logs = wishlist_entries(users_qs).filter(search_q).distinct()
+        fields = selected_fields(params, field_map)
+        return logs, field_map, fields, ('title_id',)
+
+    logs = BooksDetail.objects.all().order_by('-issued_date')
+    # Issued-books branch
+    if users_qs is not None:
+        logs = logs.filter(user__in=users_qs)
+        # default to issued (avalible=False) unless explicitly overridden
+        logs = logs.filter(avalible=False if avalible_value is None else avalible_value)
+    # Global listing/search (no user identified)
+    elif avalible_value is not None:
+        logs = logs.filter(avalible=avalible_value)
+    logs = logs.filter(search_q)
+    if search and users_qs is None:
+        # Search results put the copies of popular titles first. Scores are
+        # never negative, so the popularity range only turns the title join
+        # into one the planner can drive from Title's popularity index: titles
+        # come out ranked and only each title's copies are sorted by date
+        logs = (logs.filter(title__popularity__gte=0)
+                .order_by('-title__popularity', 'title_id', '-issued_date'))
+
+    fields = selected_fields(params, BOOK_LOG_FIELDS)
+    return logs, BOOK_LOG_FIELDS, fields, ()
+
+USER_WISHLIST_FIELDS = {
+    'book_title': 'book_title',
+    'book_author': 'auther',
+    'issued_date': ((), lambda row: None),
+    'return_date': ((), lambda row: None),
+    'book_barcode': 'book_barcode',
+    'available': (('avalible',), lambda row: bool(row['avalible'])),
+    # carries the title id until names are filled in below, only when requested
+    'wishlist_users': (('title_id',), lambda row: row['title_id']),
+}
+
 @csrf_exempt
 def user_wishlist(request):
     """
@@ -312,38 +353,32 @@ def user_wishlist(request):
       - ?username= (full name or parts)
     Optional:
       - ?search= (title/author/barcode)
+      - ?fields= (any of book_title, book_author, issued_date, return_date,
+        book_barcode, available, wishlist_users); wishlist_users is only
+        returned when asked for
     """
     if request.method != 'GET':
         return JsonResponse({'error': 'Invalid request'}, status=400)
 
-    search = (request.GET.get('search') or '').strip()
-    username = (request.GET.get('username') or '').strip()
-    barcode = (request.GET.get('barcode') or request.GET.get('barcode_number') or '').strip()
-    email = (request.GET.get('email') or '').strip()
-    user_id = (request.GET.get('user_id') or '').strip()
-
     # Resolve user(s) from User table
-    users_qs = User.objects.none()
-    q = Q()
-    if barcode:
-        q |= Q(barcode_number__iexact=barcode)
-    if user_id.isdigit():
-        q |= Q(id=int(user_id))
-    if email:
-        q |= Q(email__iexact=email)
-    if username:
-        parts = [p for p in username.split() if p]
-        if len(parts) >= 2:
-            q |= (Q(first_name__iexact=parts[0]) & Q(last_name__iexact=parts[-1]))
-        q |= Q(first_name__icontains=username) | Q(last_name__icontains=username)
-    if q:
-        users_qs = User.objects.filter(q)
+    q = _user_lookup_q(request.GET)
+    if not q:
+        return FastJsonResponse([])
+    return FastJsonResponse(_user_wishlist_rows(request.GET, User.objects.filter(q)))
 
-    if not users_qs.exists():
-        return JsonResponse([], safe=False)
+def _user_wishlist_rows(params, users_qs):
+    logs, field_map, fields, extra_columns = _user_wishlist_query(params, users_qs)
+    rows = project(logs, field_map, fields, extra_columns)
+    if 'wishlist_users' in fields and rows:
+        # One query for the whole page instead of one per row
+        _attach_wishlist_users(rows, wishers([row['wishlist_users'] for row in rows]))
+    return rows
 
-    # Fetch BooksLog entries where wishlist includes the resolved users
-    logs = BooksLog.objects.filter(wishlist__in=users_qs).distinct().order_by('-issued_date')
+def _user_wishlist_query(params, users_qs):
+    search = _search_term(params.get('search'))
+
+    # The resolved users' entries, read through the (user, title) index
+    logs = wishlist_entries(users_qs).distinct()
 
     if search:
         logs = logs.filter(
@@ -352,54 +387,121 @@ def user_wishlist(request):
             Q(book_barcode__icontains=search)
         )
 
-    data = []
-    for log in logs:
-        data.append({
-            'book_title': getattr(log, 'book_title', ''),
-            'book_author': getattr(log, 'auther', ''),
-            'issued_date': getattr(log, 'issued_date', None),
-            'return_date': getattr(log, 'return_date', None),
-            'book_barcode': getattr(log, 'book_barcode', ''),
-            'available': bool(getattr(log, 'avalible', False)),
-            # include wishlist users for debugging if needed
-            'wishlist_users': [f"{u.first_name} {u.last_name}".strip() for u in log.wishlist.all()],
-        })
-    return JsonResponse(data, safe=False)
+    default = [name for name in USER_WISHLIST_FIELDS if name != 'wishlist_users']
+    fields = selected_fields(params, USER_WISHLIST_FIELDS, default)
+    return logs, USER_WISHLIST_FIELDS, fields, ('title_id',)
+
+def _attach_wishlist_users(rows, links):
+    names = {}
+    for link in links:
+        name = f"{link['user__first_name']} {link['user__last_name']}".strip()
+        names.setdefault(link['title_id'], []).append(name)
+    for row in rows:
+        row['wishlist_users'] = names.get(row['wishlist_users'], [])
 
 @csrf_exempt
+@replica_reads
 def book_suggestions(request):
     """
     GET /book-suggestions/?search=term
-    Returns up to 20 distinct suggestions with minimal fields:
+    Returns up to 20 distinct suggestions, most popular first, with minimal fields:
       - book_title, book_author
+    Identical concurrent requests share one query.
     """
     if request.method != 'GET':
       return JsonResponse({'error': 'Invalid request'}, status=400)
-    q = (request.GET.get('search') or '').strip()
-    if not q:
-      return JsonResponse([], safe=False)
+    term = _search_term(request.GET.get('search'))
+    return JsonResponse(singleflight.do('suggestions', term, lambda: _suggestion_rows(term)), safe=False)
 
-    qs = (BooksLog.objects
-          .filter(Q(book_title__icontains=q) |
-                  Q(auther__icontains=q) |
-                  Q(book_barcode__icontains=q))
-          .values('book_title', 'auther')
-          .distinct()[:20])
+def _suggestion_rows(term):
+    qs = _suggestion_query(term)
+    return _unique_suggestions(qs) if qs is not None else []
 
-    # Ensure unique titles in Python as well (extra safety)
+def _suggestion_query(term):
+    q = _search_term(term)
+    if not q:
+      return None
+
+    # Titles are distinct by construction; reading them down the popularity
+    # index, the query stops at the 20th catalogued match
+    logs = BooksLog.objects.filter(title=OuterRef('pk'))
+    return (Title.objects
+            .filter(Exists(logs))
+            .filter(Q(book_title__icontains=q) |
+                    Q(auther__icontains=q) |
+                    Exists(logs.filter(book_barcode__icontains=q)))
+            .order_by('-popularity', 'id')
+            .values('book_title', 'auther')[:20])
+
+def _unique_suggestions(rows):
+    # Titles differing only in surrounding whitespace are shown once
     seen = set()
     data = []
-    for row in qs:
+    for row in rows:
         title = (row.get('book_title') or '').strip()
-        if not title or title in seen:
+        key = (title, (row.get('auther') or '').strip())
+        if not title or key in seen:
             continue
-        seen.add(title)
+        seen.add(key)
         data.append({
             'book_title': title,
             'book_author': (row.get('auther') or '').strip(),
         })
+    return data
+
+@csrf_exempt
+@replica_reads
+def book_recommendations(request):
+    """
+    GET /api/recommendations/?book_barcode=... (or title_id=...)
+    "Students who wanted this also wanted": the title's nearest neighbours
+    by co-wishlisting and borrowing, best first, from the table rebuilt by
+    `manage.py build_recommendations`:
+      - book_title, book_author, book_barcode, available, score
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    barcode = (request.GET.get('book_barcode') or '').strip()
+    title_id = (request.GET.get('title_id') or '').strip()
+    if title_id and not title_id.isdigit():
+        return JsonResponse({'error': 'title_id must be a number'}, status=400)
+    if not (barcode or title_id):
+        return JsonResponse({'error': 'book_barcode or title_id is required'}, status=400)
+
+    rows = recommendations.neighbors(title_id=int(title_id) if title_id else None, book_barcode=barcode)
+    return FastJsonResponse([{
+        'book_title': row['neighbor__book_title'],
+        'book_author': row['neighbor__auther'],
+        'book_barcode': row['book_barcode'],
+        'available': row['avalible'],
+        'score': round(row['score'], 4),
+    } for row in rows])
+
+@csrf_exempt
+def search_click(request):
+    """
+    POST /api/search-click/ when a student opens a search result or
+    suggestion, with "book_barcode" (catalog or copy) or "book_title" and
+    "book_author". Counts towards the title's popularity.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        data = json.loads(request.body.decode('utf-8') or '{}')
+    except Exception:
+        data = {}
 
-    return JsonResponse(data, safe=False)
+    barcode = (data.get('book_barcode') or '').strip()
+    title = (data.get('book_title') or '').strip()
+    if barcode:
+        counted = popularity.record_click(book_barcode=barcode)
+    elif title:
+        counted = popularity.record_click(book_title=title, auther=(data.get('book_author') or '').strip())
+    else:
+        return JsonResponse({'error': 'book_barcode or book_title is required'}, status=400)
+    if not counted:
+        return JsonResponse({'error': 'Book not found'}, status=404)
+    return JsonResponse({'message': 'Click recorded'}, status=200)
 
 @csrf_exempt
 def wishlist(request):
@@ -426,38 +528,30 @@ def wishlist(request):
     except Exception:
         data = {}
 
-    # Resolve user
-    def _resolve_user():
-        username = (data.get('username') or '').strip()
-        email = (data.get('email') or '').strip()
-        user_id = (str(data.get('user_id') or '')).strip()
-        # Prefer explicit user_barcode to avoid clashing with book_barcode
-        user_barcode = (data.get('user_barcode') or data.get('barcode_number') or '').strip()
-        # As a last resort, if client only sent 'barcode' and no book_barcode, treat it as user barcode
-        if not user_barcode and not data.get('book_barcode'):
-            user_barcode = (data.get('barcode') or '').strip()
-
-        q = Q()
-        if user_barcode:
-            q |= Q(barcode_number__iexact=user_barcode)
-        if user_id.isdigit():
-            q |= Q(id=int(user_id))
-        if email:
-            q |= Q(email__iexact=email)
-        if username:
-            parts = [p for p in username.split() if p]
-            if len(parts) >= 2:
-                q |= (Q(first_name__iexact=parts[0]) & Q(last_name__iexact=parts[-1]))
-            q |= Q(first_name__icontains=username) | Q(last_name__icontains=username)
-            # also try if someone passed barcode/email via username param
-            q |= Q(barcode_number__iexact=username) | Q(email__iexact=username)
-
-        return User.objects.filter(q).first()
-
-    user = _resolve_user()
+    # Resolve user with the lookups every endpoint shares (_user_lookup_q)
+    user_q = _user_lookup_q(_wishlist_user_params(data))
+    user = User.objects.filter(user_q).first() if user_q else None
     if not user:
         return JsonResponse({'error': 'User not found for wishlist operation'}, status=404)
 
+    payload, status = _change_wishlist(user, data, add=request.method == 'POST')
+    return JsonResponse(payload, status=status)
+
+def _wishlist_user_params(data):
+    """The student identifiers of a wishlist body, named as _user_lookup_q reads them."""
+    # Prefer explicit user_barcode to avoid clashing with book_barcode
+    barcode = data.get('user_barcode') or data.get('barcode_number')
+    # As a last resort, if client only sent 'barcode' and no book_barcode, treat it as user barcode
+    if not barcode and not data.get('book_barcode'):
+        barcode = data.get('barcode')
+    return {'barcode': barcode, 'username': data.get('username'),
+            'email': data.get('email'), 'user_id': data.get('user_id')}
+
+def _change_wishlist(user, data, add):
+    """
+    Add (add=True) or remove a book from `user`'s wishlist. The book is
+    resolved from `data` as described on wishlist(). Returns (payload, status).
+    """
     # Resolve book
     book_barcode = (data.get('book_barcode') or '').strip()
     isbn = (data.get('isbn') or '').strip()
@@ -477,7 +571,7 @@ def wishlist(request):
             qs &= Q(auther__iexact=author)
         books_qs = books_qs.filter(qs)
     else:
-        return JsonResponse({'error': 'Insufficient book identifiers'}, status=400)
+        return {'error': 'Insufficient book identifiers'}, 400
 
     if not books_qs.exists():
         # Relax matching if strict match failed
@@ -490,28 +584,336 @@ def wishlist(request):
                 q &= Q(auther__icontains=author)
             relaxed = relaxed.filter(q)
         if not relaxed.exists():
-            return JsonResponse({'error': 'Book not found for wishlist'}, status=404)
+            return {'error': 'Book not found for wishlist'}, 404
         books_qs = relaxed
 
-    # Prefer an available copy if multiple entries
+    # The wishlist is per title; prefer an entry on the shelf for the response
     book = books_qs.filter(avalible=True).first() or books_qs.first()
 
-    if request.method == 'POST':
-        book.wishlist.add(user)
-        return JsonResponse({
+    if add:
+        add_to_wishlist(user.id, book.title_id)
+        # Wishing for a title also queues the student for the next returned copy
+        hold = enqueue_hold(user.id, book.title_id)
+        return {
             'message': 'Added to wishlist',
             'book_title': getattr(book, 'book_title', ''),
             'book_author': getattr(book, 'auther', ''),
             'book_barcode': getattr(book, 'book_barcode', ''),
             'user': {'id': user.id, 'name': f'{user.first_name} {user.last_name}'.strip()},
-        }, status=200)
-
-    # DELETE
-    book.wishlist.remove(user)
-    return JsonResponse({
+            'hold_position': hold.position,
+            'hold_status': hold.status,
+        }, 200
+
+    # Remove
+    remove_from_wishlist(user.id, book.title_id)
+    cancel_hold(user.id, book.title_id)
+    return {
         'message': 'Removed from wishlist',
         'book_title': getattr(book, 'book_title', ''),
         'book_author': getattr(book, 'auther', ''),
         'book_barcode': getattr(book, 'book_barcode', ''),
         'user': {'id': user.id, 'name': f'{user.first_name} {user.last_name}'.strip()},
-    }, status=200)
\ No newline at end of file
+    }, 200
+
+# Request parameters _user_lookup_q reads
+USER_IDENTIFIERS = ('username', 'barcode', 'barcode_number', 'email', 'user_id')
+
+def _user_lookup_q(params):
+    """
+    Build the Q used to resolve a student from request parameters
+    (barcode / barcode_number, user_id, email, username), matching the
+    lookups the list endpoints above accept.
+    """
+    username = (params.get('username') or '').strip()
+    barcode = (params.get('barcode') or params.get('barcode_number') or '').strip()
+    email = (params.get('email') or '').strip()
+    user_id = (str(params.get('user_id') or '')).strip()
+
+    q = Q()
+    if barcode:
+        q |= Q(barcode_number__iexact=barcode)
+    if user_id.isdigit():
+        q |= Q(id=int(user_id))
+    if email:
+        q |= Q(email__iexact=email)
+    if username:
+        parts = [p for p in username.split() if p]
+        if len(parts) >= 2:
+            q |= (Q(first_name__iexact=parts[0]) & Q(last_name__iexact=parts[-1]))
+        q |= Q(first_name__icontains=username) | Q(last_name__icontains=username)
+        q |= Q(barcode_number__iexact=username) | Q(email__iexact=username)
+    return q
+
+def _resolve_user_id(params):
+    """Id of the student `params` identify (see _user_lookup_q), or None; cached in novalib.refcache."""
+    q = _user_lookup_q(params)
+    if not q:
+        return None
+    return USER_IDS.get_or_set(str(q), lambda: User.objects.filter(q).values_list('id', flat=True).first())
+
+@csrf_exempt
+def fine_balance(request):
+    """
+    GET /api/fine-balance/?barcode=... (or user_id / email / username)
+    Returns the student's outstanding fine from the materialized balance row.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    user_id = _resolve_user_id(request.GET)
+    if user_id is None:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    return JsonResponse({'user_id': user_id, 'due_fine': str(get_fine_balance(user_id))}, status=200)
+
+@csrf_exempt
+def dashboard(request):
+    """
+    GET /api/dashboard/?barcode=... (or user_id / email / username)
+    Everything the home screen needs in one response: issued books,
+    wishlist, fine balance, active holds and unread notification counts.
+    Runs a fixed number of queries regardless of how much the student has:
+    the user (joined with their balance), three prefetches and two counts.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    q = _user_lookup_q(request.GET)
+    if not q:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    user = (User.objects
+            .filter(q)
+            .select_related('fine_balance')
+            .prefetch_related(
+                Prefetch('book_details',
+                         queryset=BooksDetail.objects.order_by('-issued_date'),
+                         to_attr='issued_copies'),
+                Prefetch('wishlist_entries',
+                         queryset=with_catalog_entry(WishlistEntry.objects.all()).order_by('book_title'),
+                         to_attr='wishlisted'),
+                Prefetch('holds',
+                         queryset=(HoldRequest.objects
+                                   .filter(status__in=HoldRequest.ACTIVE_STATUSES)
+                                   .select_related('title', 'copy')
+                                   .order_by('created_at')),
+                         to_attr='active_holds'),
+            )
+            .first())
+    if not user:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    library_unread = Notification.objects.all()
+    if user.notifications_seen_at:
+        library_unread = library_unread.filter(created_at__gt=user.notifications_seen_at)
+    developer_unread = DeveloperNotification.objects.all()
+    if user.developer_notifications_seen_at:
+        developer_unread = developer_unread.filter(created_at__gt=user.developer_notifications_seen_at)
+
+    balance = getattr(user, 'fine_balance', None)
+    return JsonResponse({
+        'user': {
+            'id': user.id,
+            'name': f'{user.first_name} {user.last_name}'.strip(),
+            'barcode': user.barcode_number,
+        },
+        'issued_books': [{
+            'book_title': copy.book_title,
+            'book_author': copy.auther,
+            'book_barcode': copy.book_barcode,
+            'issued_date': copy.issued_date,
+            'return_date': copy.return_date,
+        } for copy in user.issued_copies],
+        'wishlist': [{
+            'book_title': book.book_title,
+            'book_author': book.auther,
+            'book_barcode': book.book_barcode,
+            'available': bool(book.avalible),
+        } for book in user.wishlisted],
+        'due_fine': str(balance.balance if balance else '0.00'),
+        'holds': [{
+            'book_title': hold.title.book_title,
+            'book_author': hold.title.auther,
+            'position': hold.position,
+            'status': hold.status,
+            'copy_barcode': hold.copy.book_barcode if hold.copy else '',
+            'expires_at': hold.expires_at,
+        } for hold in user.active_holds],
+        'unread_notifications': {
+            'library': library_unread.count(),
+            'developer': developer_unread.count(),
+        },
+    }, status=200)
+
+@csrf_exempt
+def mark_notifications_read(request):
+    """
+    POST /api/notifications/mark-read/ with a user identifier and optional
+    "feed": "library" | "developer" (default both). Resets unread counts.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        data = json.loads(request.body.decode('utf-8') or '{}')
+    except Exception:
+        data = {}
+
+    user_id = _resolve_user_id(data)
+    if user_id is None:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    feed = (data.get('feed') or '').strip().lower()
+    stamp = now()
+    fields = {}
+    if feed in ('', 'library'):
+        fields['notifications_seen_at'] = stamp
+    if feed in ('', 'developer'):
+        fields['developer_notifications_seen_at'] = stamp
+    if not fields:
+        return JsonResponse({'error': 'Unknown feed'}, status=400)
+    User.objects.filter(pk=user_id).update(**fields)
+    return JsonResponse({'message': 'Notifications marked as read'}, status=200)
+
+# Sub-request handlers for /api/batch/: (user, op) -> (status, body)
+def _batch_wishlist_add(user, op):
+    if not user:
+        return 404, {'error': 'User not found for wishlist operation'}
+    payload, status = _change_wishlist(user, op, add=True)
+    return status, payload
+
+def _batch_wishlist_remove(user, op):
+    if not user:
+        return 404, {'error': 'User not found for wishlist operation'}
+    payload, status = _change_wishlist(user, op, add=False)
+    return status, payload
+
+def _batch_wishlist_list(user, op):
+    if not user:
+        return 200, []
+    return 200, _user_wishlist_rows(op, User.objects.filter(pk=user.pk))
+
+def _batch_issued_list(user, op):
+    if not user:
+        return 404, {'error': 'User not found'}
+    return 200, _book_log_rows(op, User.objects.filter(pk=user.pk))
+
+def _batch_books_search(user, op):
+    return 200, _book_log_rows(op, None)
+
+def _batch_suggestions(user, op):
+    return 200, _suggestion_rows(op.get('search'))
+
+BATCH_OPERATIONS = {
+    'wishlist.add': _batch_wishlist_add,
+    'wishlist.remove': _batch_wishlist_remove,
+    'wishlist.list': _batch_wishlist_list,
+    'issued.list': _batch_issued_list,
+    'books.search': _batch_books_search,
+    'suggestions': _batch_suggestions,
+}
+BATCH_MAX_OPERATIONS = 50
+
+@csrf_exempt
+def batch(request):
+    """
+    POST /api/batch/
+    Run several API operations in one HTTP request. Body:
+      {"barcode": "...",                 # user identifiers, resolved once
+       "requests": [{"id": 1, "op": "wishlist.add", "book_barcode": "..."},
+                    {"op": "wishlist.list", "fields": "book_title"}, ...]}
+    A bare JSON array of operations is accepted when no user is needed.
+    Ops: wishlist.add, wishlist.remove, wishlist.list, issued.list,
+    books.search, suggestions; each takes the same parameters as its
+    standalone endpoint. Everything runs in one transaction with a
+    savepoint per operation, so a failed operation is rolled back on its
+    own. Returns [{"id", "status", "body"}, ...] in request order.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        data = json.loads(request.body.decode('utf-8') or '{}')
+    except Exception:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+
+    if isinstance(data, list):
+        operations, identifiers = data, {}
+    elif isinstance(data, dict):
+        operations, identifiers = data.get('requests') or [], data
+    else:
+        return JsonResponse({'error': 'Body must be a JSON object or array'}, status=400)
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return JsonResponse({'error': 'requests must be a list of objects'}, status=400)
+    if not all(isinstance(op.get('op'), str) for op in operations):
+        return JsonResponse({'error': 'op must be a string'}, status=400)
+    if not all(isinstance(identifiers.get(name), (str, type(None))) for name in USER_IDENTIFIERS):
+        return JsonResponse({'error': f"{', '.join(USER_IDENTIFIERS)} must be strings"}, status=400)
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return JsonResponse({'error': f'At most {BATCH_MAX_OPERATIONS} operations per batch'}, status=400)
+
+    q = _user_lookup_q(identifiers)
+    user = User.objects.filter(q).first() if q else None
+
+    results = []
+    with transaction.atomic():
+        for op in operations:
+            handler = BATCH_OPERATIONS.get(op.get('op'))
+            if handler is None:
+                status, body = 400, {'error': f"Unknown operation: {op.get('op')}"}
+            else:
+                try:
+                    with transaction.atomic():
+                        status, body = handler(user, op)
+                except Exception:
+                    # The details go to the log, not to the client
+                    logger.exception('Batch operation %s failed', op['op'])
+                    status, body = 500, {'error': 'Internal error'}
+            results.append({'id': op.get('id'), 'status': status, 'body': body})
+    return FastJsonResponse(results)
+
+@csrf_exempt
+def catalog_snapshot(request):
+    """
+    GET /api/catalog/snapshot/
+    Every title with its availability for offline search:
+      {"version": 123, "fields": [...], "titles": [[title, author, available, total], ...]}
+    Pass ?version= with the client's current version to get
+    {"version": ..., "unchanged": true} when nothing changed.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    known = (request.GET.get('version') or '').strip()
+    if known.isdigit() and int(known) == catalog.current_version():
+        return FastJsonResponse({'version': int(known), 'unchanged': True})
+    return FastJsonResponse(catalog.snapshot())
+
+@csrf_exempt
+def catalog_changes(request):
+    """
+    GET /api/catalog/changes/?since=<version>
+    Titles changed after `since` as upserts/deletes, and the version to
+    sync from next. Keep calling while "more" is true. A 410 response
+    with "reset": true means the client must download the snapshot again.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    since = (request.GET.get('since') or '').strip()
+    if not since.isdigit():
+        return JsonResponse({'error': 'since must be a version number'}, status=400)
+    delta = catalog.changes_since(int(since))
+    return FastJsonResponse(delta, status=410 if delta.get('reset') else 200)
+
+
+def metrics_endpoint(request):
+    """
+    GET /metrics/ in the Prometheus text format (see novalib.metrics).
+    Requires `Authorization: Bearer <NOVALIB_METRICS_TOKEN>` when a token is
+    configured; without one only requests from the host itself are served.
+    """
+    token = getattr(settings, 'NOVALIB_METRICS_TOKEN', None)
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    elif request.META.get('REMOTE_ADDR') not in ('127.0.0.1', '::1'):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(metrics.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
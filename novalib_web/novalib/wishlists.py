@@ -0,0 +1,52 @@
+"""
+Wishlist reads and writes. Membership is one WishlistEntry per (student,
+title): adding twice is a no-op and removing deletes that single row.
+"""
+from django.db.models import F, OuterRef, Subquery
+from django.utils.timezone import now
+
+from novalib import popularity
+from novalib.models import BooksLog, WishlistEntry
+
+
+def with_catalog_entry(entries):
+    """
+    `entries` (WishlistEntry queryset) annotated with the title's book_title
+    and auther, and the book_barcode and avalible flag of its BooksLog entry
+    (one on the shelf when there is one). The annotations are only computed
+    when selected, so project() pays for the subqueries it asks for.
+    """
+    log = BooksLog.objects.filter(title=OuterRef('title_id')).order_by('-avalible', 'pk')
+    return entries.annotate(
+        book_title=F('title__book_title'),
+        auther=F('title__auther'),
+        book_barcode=Subquery(log.values('book_barcode')[:1]),
+        avalible=Subquery(log.values('avalible')[:1]),
+    )
+
+
+def wishlist_entries(users):
+    """Wishlist of `users` (User queryset or ids) with catalog columns, by title."""
+    return with_catalog_entry(WishlistEntry.objects.filter(user__in=users)).order_by('book_title')
+
+
+def wishers(title_ids):
+    """(title_id, user__first_name, user__last_name) rows for the given titles."""
+    # values() rather than values_list(): the latter can't be consumed with aiterator()
+    return (WishlistEntry.objects
+            .filter(title_id__in=title_ids)
+            .values('title_id', 'user__first_name', 'user__last_name'))
+
+
+def add_to_wishlist(user_id, title_id):
+    # One INSERT that skips an existing (user, title) pair
+    stamp = now()
+    WishlistEntry.objects.bulk_create([WishlistEntry(user_id=user_id, title_id=title_id, created_at=stamp)],
+                                      ignore_conflicts=True)
+    # Only an entry created just now counts: adding twice doesn't make a title more popular
+    popularity.record(popularity.WISHLIST, stamp, pk=title_id,
+                      wishlist_entries__user_id=user_id, wishlist_entries__created_at=stamp)
+
+
+def remove_from_wishlist(user_id, title_id):
+    return WishlistEntry.objects.filter(user_id=user_id, title_id=title_id).delete()[0]
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "novalib_web.settings")
+# Route the read-heavy API endpoints to the async views (novalib/async_views.py)
+os.environ.setdefault("NOVALIB_ASYNC_VIEWS", "1")
 
 application = get_asgi_application()
@@ -7,6 +7,19 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are stored once per distinct content, named by its hash, and served
+# by novalib.media with long-lived cache headers. NOVALIB_MEDIA_OFFLOAD=x-accel-redirect (nginx,
+# with an internal location at NOVALIB_MEDIA_ACCEL_PREFIX aliased to
+# MEDIA_ROOT) or x-sendfile hands the transfer to the front server.
+STORAGES = {
+    'default': {'BACKEND': 'novalib.media.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+NOVALIB_MEDIA_OFFLOAD = os.environ.get('NOVALIB_MEDIA_OFFLOAD') or None
+NOVALIB_MEDIA_ACCEL_PREFIX = os.environ.get('NOVALIB_MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Cache lifetime of media files whose names predate content hashing
+NOVALIB_MEDIA_MAX_AGE = int(os.environ.get('NOVALIB_MEDIA_MAX_AGE', '3600'))
+
 SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'django-insecure-your-secret-key-here')
 DEBUG = os.environ.get('DJANGO_DEBUG', 'True') == 'True'
 PYTHONANYWHERE_DOMAIN = os.environ.get('PYTHONANYWHERE_DOMAIN', 'voidnova.pythonanywhere.com')
@@ -32,10 +45,17 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Outermost of ours so its counts include session/auth queries
+    'novalib.middleware.QueryStatsMiddleware',
+    'novalib.middleware.MetricsMiddleware',
+    # Placed early so it compresses the final body after other middleware
+    'novalib.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Staff-requested profiling; needs request.user
+    'novalib.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -75,6 +95,31 @@ DATABASES = {
     }
 }
 
+# Read replicas for the read-only API views, e.g. NOVALIB_DB_REPLICAS=10.0.0.2,10.0.0.3
+# (aliases replica1, replica2, ...). In tests they mirror the primary.
+for _i, _host in enumerate([h.strip() for h in os.environ.get('NOVALIB_DB_REPLICAS', '').split(',') if h.strip()], 1):
+    DATABASES[f'replica{_i}'] = dict(DATABASES['default'], HOST=_host, TEST={'MIRROR': 'default'})
+
+# Local development and tests without MySQL: NOVALIB_SQLITE=1 uses a primary
+# and a replica SQLite file. SQLite doesn't replicate, so the router keeps
+# reads on the primary; the alias lets tests route to a second database.
+if os.environ.get('NOVALIB_SQLITE') == '1':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        },
+        'replica1': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db_replica.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+
+DATABASE_ROUTERS = ['novalib.db_router.ReplicaRouter']
+# Replicas further behind than this (seconds) are skipped for reads
+NOVALIB_REPLICA_MAX_LAG = int(os.environ.get('NOVALIB_REPLICA_MAX_LAG', '5'))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -102,10 +147,55 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
 }
 
+# Serve the async API views (set by asgi.py; leave off under WSGI)
+NOVALIB_ASYNC_VIEWS = os.environ.get('NOVALIB_ASYNC_VIEWS', '0') == '1'
+
+# JSON API response compression (gzip, or brotli when the package is installed)
+NOVALIB_COMPRESS_MIN_SIZE = int(os.environ.get('NOVALIB_COMPRESS_MIN_SIZE', '860'))
+
+# Per-request SQL stats: slow/N+1 requests are logged to `novalib.sql`
+NOVALIB_SLOW_REQUEST_MS = int(os.environ.get('NOVALIB_SLOW_REQUEST_MS', '500'))
+NOVALIB_SLOW_REQUEST_QUERIES = int(os.environ.get('NOVALIB_SLOW_REQUEST_QUERIES', '50'))
+NOVALIB_N_PLUS_ONE_THRESHOLD = int(os.environ.get('NOVALIB_N_PLUS_ONE_THRESHOLD', '5'))
+
+# /metrics/ (Prometheus). Workers share counters through files in this
+# directory; scrapes need `Authorization: Bearer <token>` when a token is set,
+# otherwise only local requests are answered
+NOVALIB_METRICS_DIR = os.environ.get('NOVALIB_METRICS_DIR') or None
+NOVALIB_METRICS_TOKEN = os.environ.get('NOVALIB_METRICS_TOKEN') or None
+
+# Cache shared by all workers: profiles, catalog snapshots and the shared
+# tier of novalib.refcache, e.g. NOVALIB_CACHE_URL=redis://10.0.0.5:6379/1
+# or memcached://10.0.0.5:11211. Without one every process caches alone.
+_cache_url = os.environ.get('NOVALIB_CACHE_URL', '')
+if _cache_url.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': _cache_url}}
+elif _cache_url.startswith('memcached://'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+                          'LOCATION': _cache_url[len('memcached://'):]}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'novalib'}}
+
+# novalib.refcache: per-process LRU size per namespace, and how long a process
+# may serve entries before noticing another worker's invalidation (seconds)
+NOVALIB_REFCACHE_LOCAL_ENTRIES = int(os.environ.get('NOVALIB_REFCACHE_LOCAL_ENTRIES', '1000'))
+NOVALIB_REFCACHE_LOCAL_TTL = int(os.environ.get('NOVALIB_REFCACHE_LOCAL_TTL', '5'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'novalib': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 600  # 10 minutes
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = os.environ.get('DJANGO_EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
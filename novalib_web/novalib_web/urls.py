@@ -16,14 +16,17 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path, include
+import re
+
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from novalib.media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('novalib.urls')),  # Include the app's URLs
     #path('', include('main_page.urls')),  # Include the main_page app's URLs
+    # Uploaded images, in production too (see novalib.media for offloading to the front server)
+    re_path(rf"^{re.escape(settings.MEDIA_URL.lstrip('/'))}(?P<path>.+)$", serve_media, name='media'),
 ]
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)